@@ -0,0 +1,67 @@
+"""
+Per packet cost of building and dispatching request/response packets.
+
+    $ python -m benchmarks.packet_bench
+
+'before' replays the previous implementation (uuid4/unique_hex ids, getattr dispatch), 'after' uses vyked.packet
+and the dispatch tables TCPBus uses now.
+"""
+import socket
+import timeit
+from uuid import uuid4
+
+from again.utils import unique_hex
+
+from vyked.packet import MessagePacket
+from vyked.services import TCPService
+
+N = 200000
+HOST = socket.gethostbyname(socket.gethostname())
+
+
+class Dispatcher:
+    def __init__(self):
+        self._senders = {'request': self._request_sender}
+
+    def _request_sender(self, packet):
+        pass
+
+    def send_before(self, packet):
+        func = getattr(self, '_' + packet['type'] + '_sender')
+        func(packet)
+
+    def send_after(self, packet):
+        self._senders[packet['type']](packet)
+
+
+def response_before(request_id, from_id, entity, result, service_name, method):
+    payload = {'request_id': request_id, 'result': result}
+    return {'pid': unique_hex(), 'from': service_name, 'endpoint': method, 'to': from_id, 'host': HOST,
+            'entity': entity, 'type': 'response', 'payload': payload}
+
+
+def response_after(request_id, from_id, entity, result, service_name, method):
+    return TCPService._make_response_packet(request_id=request_id, from_id=from_id, entity=entity, result=result,
+                                            error=None, failed=False, service_name=service_name, method=method)
+
+
+def bench(name, stmt):
+    seconds = min(timeit.repeat(stmt, number=N, repeat=3))
+    print('{:<28} {:8.3f} us/packet'.format(name, seconds / N * 1e6))
+
+
+def main():
+    dispatcher = Dispatcher()
+    packet = {'type': 'request'}
+    bench('pid before (uuid4)', lambda: str(uuid4()))
+    bench('pid after (counter)', MessagePacket._next_pid)
+    bench('request id before', unique_hex)
+    bench('request id after', MessagePacket.next_request_id)
+    bench('dispatch before (getattr)', lambda: dispatcher.send_before(packet))
+    bench('dispatch after (table)', lambda: dispatcher.send_after(packet))
+    bench('response before', lambda: response_before('r', 'n', None, [1, 2], 'svc', 'get'))
+    bench('response after', lambda: response_after('r', 'n', None, [1, 2], 'svc', 'get'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Cost of resolving an entity to an instance and the share of entities that move when the instance set changes.
+
+    $ python -m benchmarks.routing_bench
+
+'before' replays the previous implementation, a random instance remembered per entity in a dict that never shrinks,
+'after' uses the rendezvous hashing RoutingTable does now.
+"""
+import random
+import timeit
+
+from vyked.routing import RoutingTable
+
+N = 100000
+SERVICE = 'orders/1'
+
+
+def table_with(nodes):
+    table = RoutingTable()
+    for node in nodes:
+        table.add(SERVICE, ('10.0.0.1', 4000, node, 'tcp'))
+    return table
+
+
+def resolve_before(assigned, routes, entity):
+    if entity in assigned:
+        return assigned[entity]
+    node = random.choice(routes)
+    assigned[entity] = node
+    return node
+
+
+def assignments(table, entities):
+    return [table.choose_for_entity(SERVICE, 'tcp', entity)[2] for entity in entities]
+
+
+def moved(before, after):
+    return sum(1 for a, b in zip(before, after) if a != b) / len(before)
+
+
+def main():
+    entities = ['order-{}'.format(i) for i in range(N)]
+    for instances in (4, 16, 64):
+        nodes = ['node-{}'.format(i) for i in range(instances)]
+        table = table_with(nodes)
+        routes = table.get(SERVICE, 'tcp')
+        assigned = {}
+        before = min(timeit.repeat(lambda: [resolve_before(assigned, routes, e) for e in entities], number=1, repeat=3))
+        after = min(timeit.repeat(lambda: assignments(table, entities), number=1, repeat=3))
+        print('{:>3} instances  resolve before {:6.2f} us  after {:6.2f} us  entities remembered before {}'.format(
+            instances, before / N * 1e6, after / N * 1e6, len(assigned)))
+
+        current = assignments(table, entities)
+        table.add(SERVICE, ('10.0.0.2', 4000, 'node-new', 'tcp'))
+        grown = assignments(table, entities)
+        table.remove(SERVICE, nodes[0])
+        shrunk = assignments(table, entities)
+        print('{:>3} instances  moved on add {:.3f}  moved on remove {:.3f}  ideal {:.3f}'.format(
+            instances, moved(current, grown), moved(grown, shrunk), 1 / (instances + 1)))
+
+
+if __name__ == '__main__':
+    main()
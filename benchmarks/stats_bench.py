@@ -0,0 +1,92 @@
+"""
+Cost of recording one request in the Aggregator.
+
+    $ python -m benchmarks.stats_bench
+
+'before' replays the previous implementation, running averages in a StatUnit per level updated by a recursive walk
+with a list of the last values trimmed by pop(0), 'after' records into the histogram of the request's
+(server_type, endpoint, status) window and adds the levels up only when the stats are dumped.
+"""
+import random
+import timeit
+
+from vyked.utils.stats import Aggregator
+
+N = 200000
+ENDPOINTS = ['endpoint_{}'.format(i) for i in range(20)]
+STATUSES = ['succesful', 'succesful', 'succesful', 'handled_error', 'timeout']
+
+
+class OldStatUnit:
+    MAXSIZE = 10
+
+    def __init__(self, key=None):
+        self.key = key
+        self.average = 0
+        self.process_time_average = 0
+        self.queue_time_average = 0
+        self.values = list()
+        self.count = 0
+        self.success_count = 0
+        self.sub = dict()
+
+    def update(self, val, process_time_taken, success, queue_time=0):
+        self.values.append(val)
+        if len(self.values) > self.MAXSIZE:
+            self.values.pop(0)
+
+        self.count += 1
+        if success:
+            self.average = (self.average * self.success_count + val)/(self.success_count+1)
+            self.process_time_average = (self.process_time_average * self.success_count + process_time_taken)/(self.success_count+1)
+            self.queue_time_average = (self.queue_time_average * self.success_count + queue_time)/(self.success_count+1)
+            self.success_count += 1
+
+
+class OldAggregator:
+    _stats = OldStatUnit(key='total')
+
+    @classmethod
+    def recursive_update(cls, d, new_val, keys, success, process_time_taken=0, queue_time=0):
+        if len(keys) == 0:
+            return
+
+        try:
+            key = keys.pop()
+            value = d[key]
+
+        except KeyError:
+            value = OldStatUnit(key=key)
+            d[key] = value
+
+        finally:
+            value.update(new_val, process_time_taken, success, queue_time)
+            cls.recursive_update(value.sub, new_val, keys, success, process_time_taken, queue_time)
+
+    @classmethod
+    def update_stats(cls, endpoint, status, time_taken, server_type, success=True, process_time_taken=0, queue_time=0):
+        cls._stats.update(val=time_taken, process_time_taken=process_time_taken, success=success, queue_time=queue_time)
+        cls.recursive_update(cls._stats.sub, time_taken, keys=[status, endpoint, server_type], success=success,
+                             process_time_taken=process_time_taken, queue_time=queue_time)
+
+
+def main():
+    rng = random.Random(1)
+    requests = [(rng.choice(ENDPOINTS), rng.choice(STATUSES), int(rng.lognormvariate(3, 1))) for _ in range(N)]
+
+    def run(aggregator):
+        for endpoint, status, time_taken in requests:
+            aggregator.update_stats(endpoint=endpoint, status=status, time_taken=time_taken, server_type='tcp',
+                                    success=status != 'timeout', process_time_taken=1)
+
+    before = min(timeit.repeat(lambda: run(OldAggregator), number=1, repeat=3))
+    after = min(timeit.repeat(lambda: run(Aggregator), number=1, repeat=3))
+    dump = min(timeit.repeat(Aggregator.dump_stats, number=1, repeat=3))
+    stats = Aggregator.dump_stats()
+    print('update before {:.2f} us  after {:.2f} us'.format(before / N * 1e6, after / N * 1e6))
+    print('dump_stats of {} endpoints {:.2f} ms  p50 {} p99 {} p99.9 {} max {}'.format(
+        len(ENDPOINTS), dump * 1000, stats['p50'], stats['p99'], stats['p99.9'], stats['max']))
+
+
+if __name__ == '__main__':
+    main()
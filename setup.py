@@ -49,7 +49,7 @@ setup(
     author_email='kashif.razzaqui@gmail.com, ankitchandawala@gmail.com',
     url='https://github.com/kashifrazzaqui/vyked',
     description='A micro-service framework for Python',
-    packages=find_packages(exclude=['examples', 'tests', 'docs']),
+    packages=find_packages(exclude=['examples', 'tests', 'docs', 'benchmarks']),
     package_data={'requirements': ['*.txt']},
     install_requires=install_requires
 )
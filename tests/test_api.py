@@ -0,0 +1,225 @@
+import asyncio
+import time
+
+from vyked import TCPService, TCPServiceClient, api, executors, limiter
+from vyked.config import CONFIG
+from vyked.shared_context import SharedContext
+from vyked.streams import StreamWriter
+from vyked.utils.common_utils import X_DEADLINE, request_deadline
+
+
+class _Protocol:
+    def __init__(self):
+        self.sent = []
+
+    def is_writable(self):
+        return True
+
+    def send(self, packet):
+        self.sent.append(packet)
+
+
+class OrderService(TCPService):
+    def __init__(self):
+        super().__init__('OrderService', 1, host_port=4501)
+        self.calls = []
+
+    @api(stream=True, timeout=0.05)
+    def export(self, order_id):
+        for i in range(10):
+            yield i
+
+    @api(timeout=0.05)
+    def slow(self, order_id):
+        self.calls.append(order_id)
+        yield from asyncio.sleep(0.2)
+        self.calls.append('done')
+
+    @api(timeout=0.1, max_concurrency=1, queue_size=1)
+    def guarded(self, order_id):
+        self.calls.append(order_id)
+        yield from asyncio.sleep(0.15)
+        self.calls.append('done ' + order_id)
+
+    @api(timeout=10, coalesce=True)
+    def lookup(self, order_id):
+        self.calls.append(order_id)
+        try:
+            yield from asyncio.sleep(10)
+        except asyncio.CancelledError:
+            self.calls.append('cancelled ' + order_id)
+            raise
+
+    @api(timeout=0.05, cache={'shared': True})
+    def cached(self, order_id):
+        self.calls.append(order_id)
+        yield from asyncio.sleep(0)
+        return order_id
+
+    @api(timeout=0.05, executor='thread')
+    def render(self, order_id):
+        time.sleep(0.1)
+        self.calls.append(order_id)
+
+    @api(timeout=10)
+    def get(self, order_id):
+        self.calls.append(order_id)
+        yield from asyncio.sleep(0.2)
+        return order_id
+
+
+def test_timed_out_stream_stops_when_the_consumer_stops_acking():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    service = OrderService()
+    protocol = _Protocol()
+    writer = StreamWriter(protocol, 'r1', window=2)
+    loop.run_until_complete(service.export(request_id='r1', entity=None, from_id='client1', order_id='o1',
+                                           _stream=writer))
+    assert [packet['chunk'] for packet in protocol.sent] == [0, 1]
+    # the handler isn't left waiting for credit that never comes
+    loop.run_until_complete(asyncio.sleep(0))
+    assert writer._waiter is None or writer._waiter.cancelled()
+    loop.close()
+
+
+class _Bus:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, packet, future):
+        self.sent.append(packet)
+
+
+def test_request_deadline_is_inherited_from_the_shared_context():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    client = TCPServiceClient('OrderService', 1)
+    client.tcp_bus = _Bus()
+
+    @asyncio.coroutine
+    def nested_call():
+        inherited = time.time() + 1
+        SharedContext.set(X_DEADLINE, inherited)
+        assert request_deadline(60) == inherited
+        assert request_deadline(0.5) < inherited
+        future = client._send_request(None, 'get', None, {'request_id': 'r1'})
+        future.cancel()
+        return inherited
+
+    inherited = loop.run_until_complete(nested_call())
+    assert client.tcp_bus.sent[0]['deadline'] == inherited
+    loop.close()
+
+
+def test_api_timeout_is_clamped_to_the_deadline():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    service = OrderService()
+    start = time.time()
+    response = loop.run_until_complete(service.get(request_id='r1', entity=None, from_id='client1', order_id='o1',
+                                                   _deadline=start + 0.05))
+    assert time.time() - start < 0.15
+    assert response['payload'].get('result') is None
+    assert service.calls == ['o1']
+    loop.run_until_complete(asyncio.sleep(0.2))
+    loop.close()
+
+
+def test_expired_deadline_skips_the_handler():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    service = OrderService()
+    response = loop.run_until_complete(service.get(request_id='r1', entity=None, from_id='client1', order_id='o1',
+                                                   _deadline=time.time() - 1))
+    assert response['payload']['error'] == 'deadline exceeded'
+    assert service.calls == []
+    loop.close()
+
+
+def test_timed_out_handler_holds_its_limit_till_it_is_done(monkeypatch):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    monkeypatch.setattr(CONFIG, 'CONCURRENCY_LIMIT', True)
+    monkeypatch.setattr(limiter, 'server_limiter', limiter.ConcurrencyLimiter(initial=10, min_limit=1, max_limit=10))
+    service = OrderService()
+    loop.run_until_complete(service.slow(request_id='r1', entity=None, from_id='client1', order_id='o1'))
+    assert limiter.server_limiter.in_flight == 1
+    loop.run_until_complete(asyncio.sleep(0.25))
+    assert service.calls == ['o1', 'done']
+    assert limiter.server_limiter.in_flight == 0
+    assert limiter.server_limiter.limit < 10
+    loop.close()
+
+
+def test_timed_out_handler_holds_its_bulkhead_slot_till_it_is_done():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    service = OrderService()
+
+    @asyncio.coroutine
+    def call_later(delay, order_id):
+        yield from asyncio.sleep(delay)
+        return (yield from service.guarded(request_id=order_id, entity=None, from_id='client1', order_id=order_id))
+
+    loop.run_until_complete(asyncio.gather(call_later(0, 'o1'), call_later(0.08, 'o2')))
+    loop.run_until_complete(asyncio.sleep(0.2))
+    # the second call only starts once the timed out first one is done
+    assert service.calls == ['o1', 'done o1', 'o2', 'done o2']
+    loop.close()
+
+
+def test_coalesced_call_is_cancelled_once_no_follower_is_left():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    service = OrderService()
+    leader = asyncio.async(service.lookup(request_id='r1', entity=None, from_id='client1', order_id='o1'))
+    loop.run_until_complete(asyncio.sleep(0))
+    follower = asyncio.async(service.lookup(request_id='r2', entity=None, from_id='client2', order_id='o1'))
+    loop.run_until_complete(asyncio.sleep(0))
+    assert service.calls == ['o1']
+
+    follower.cancel()
+    loop.run_until_complete(asyncio.sleep(0.01))
+    leader.cancel()
+    loop.run_until_complete(asyncio.sleep(0.01))
+    assert service.calls == ['o1', 'cancelled o1']
+    loop.close()
+
+
+class _SlowSharedCache:
+    @asyncio.coroutine
+    def get(self, namespace, key):
+        yield from asyncio.sleep(1)
+        return True, 'stale'
+
+
+def test_shared_cache_lookup_is_bounded_by_the_api_timeout():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    service = OrderService()
+    service.pubsub_bus = type('PubSub', (), {'shared_cache': _SlowSharedCache()})()
+    start = time.time()
+    response = loop.run_until_complete(service.cached(request_id='r1', entity=None, from_id='client1',
+                                                      order_id='o1'))
+    assert time.time() - start < 0.5
+    assert response['payload']['error'] == 'deadline exceeded'
+    assert service.calls == []
+    loop.close()
+
+
+def test_timed_out_call_still_queued_for_the_pool_is_dropped(monkeypatch):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    executors.shutdown()
+    monkeypatch.setattr(CONFIG, 'EXECUTOR_THREADS', 1)
+    service = OrderService()
+    try:
+        loop.run_until_complete(asyncio.gather(
+            service.render(request_id='r1', entity=None, from_id='client1', order_id='o1'),
+            service.render(request_id='r2', entity=None, from_id='client1', order_id='o2')))
+        loop.run_until_complete(asyncio.sleep(0.2))
+        assert service.calls == ['o1']
+    finally:
+        executors.shutdown()
+        loop.close()
@@ -0,0 +1,37 @@
+import asyncio
+
+from vyked.batcher import Batcher
+
+
+def _request(n):
+    return {'type': 'request', 'service': 'test', 'version': '1', 'payload': {'request_id': n}}
+
+
+def test_batches_packets_added_in_one_tick():
+    loop = asyncio.new_event_loop()
+    sent = []
+    batcher = Batcher(sent.append, loop=loop)
+    for n in range(3):
+        batcher.add(_request(n))
+    assert sent == []
+    loop.call_soon(loop.stop)
+    loop.run_forever()
+    loop.close()
+    assert len(sent) == 1
+    batch = sent[0]
+    assert batch['type'] == 'batch'
+    assert batch['service'] == 'test'
+    assert [packet['payload']['request_id'] for packet in batch['packets']] == [0, 1, 2]
+
+
+def test_single_packet_is_not_wrapped_and_max_size_flushes():
+    loop = asyncio.new_event_loop()
+    sent = []
+    batcher = Batcher(sent.append, max_size=2, loop=loop)
+    batcher.add(_request(0))
+    batcher.add(_request(1))
+    assert len(sent) == 1 and len(sent[0]['packets']) == 2
+    batcher.add(_request(2))
+    batcher.flush()
+    assert sent[1] == _request(2)
+    loop.close()
@@ -0,0 +1,246 @@
+import asyncio
+import logging
+
+from vyked.bus import TCPBus, _with_deadline
+from vyked.config import CONFIG
+from vyked.connection_pool import ConnectionPool
+from vyked.exceptions import ClientDisconnected
+from vyked.jsonprotocol import VykedProtocol
+from vyked.registry_client import RegistryClient
+from vyked.routing import NodeStats
+from vyked.utils.common_utils import X_DEADLINE, parse_deadline
+
+
+class _Protocol:
+    def __init__(self):
+        self.in_flight = 0
+        self.deferred_sends = 0
+        self.sent = []
+
+    def is_connected(self):
+        return True
+
+    def is_writable(self):
+        return True
+
+    def track_request(self, request_id, future):
+        self.in_flight += 1
+
+    def send_batched(self, packet):
+        self.sent.append(packet)
+
+
+def tcp_bus(*node_ids):
+    bus = TCPBus.__new__(TCPBus)
+    bus._logger = logging.getLogger(__name__)
+    bus._client_protocols = {}
+    bus._node_clients = {}
+    bus._registry_client = RegistryClient(None, None, None)
+    addresses = [{'host': '10.0.0.1', 'port': 4000 + i, 'node_id': node_id, 'type': 'tcp'}
+                 for i, node_id in enumerate(node_ids)]
+    bus._registry_client.cache_vendors([{'name': 'orders', 'version': '1', 'addresses': addresses}])
+    return bus
+
+
+def connect(bus, node_id):
+    protocol = _Protocol()
+    bus._client_protocols[node_id] = pool = ConnectionPool(node_id)
+    pool.add(protocol)
+    return protocol
+
+
+def in_flight_request(idempotent):
+    future = asyncio.Future()
+    packet = {'type': 'request', 'service': 'orders', 'version': '1', 'entity': None, 'endpoint': 'get',
+              'payload': {'request_id': 'r1'}}
+    future.retry_packet = packet if idempotent else None
+    return future
+
+
+def test_request_in_flight_on_a_lost_connection_fails():
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    bus = tcp_bus('a', 'b')
+    other = connect(bus, 'b')
+    future = in_flight_request(idempotent=False)
+    bus._fail_in_flight('a', [future])
+    assert isinstance(future.exception(), ClientDisconnected)
+    assert other.sent == []
+
+
+def test_idempotent_request_is_retried_once_on_another_node():
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    bus = tcp_bus('a', 'b')
+    bus._client_protocols['a'] = ConnectionPool('a')
+    other = connect(bus, 'b')
+    future = in_flight_request(idempotent=True)
+    bus._fail_in_flight('a', [future])
+    assert not future.done()
+    assert [packet['to'] for packet in other.sent] == ['b']
+    assert future.retry_packet is None
+
+    # lost again, it isn't retried a second time
+    bus._fail_in_flight('b', [future])
+    assert isinstance(future.exception(), ClientDisconnected)
+
+
+def test_idempotent_request_fails_when_the_lost_node_is_the_only_one():
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    bus = tcp_bus('a')
+    bus._client_protocols['a'] = ConnectionPool('a')
+    refilled = []
+    bus._refill_pool = refilled.append
+    future = in_flight_request(idempotent=True)
+    bus._fail_in_flight('a', [future])
+    assert isinstance(future.exception(), ClientDisconnected)
+    # without trying to reconnect to the lost node
+    assert refilled == []
+
+
+def test_retried_request_is_charged_to_the_node_it_was_sent_to():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    NodeStats.forget('a')
+    NodeStats.forget('b')
+    bus = tcp_bus('a', 'b')
+    bus._client_protocols['a'] = ConnectionPool('a')
+    connect(bus, 'b')
+    future = in_flight_request(idempotent=True)
+    NodeStats.track(future, 'a')
+    assert NodeStats.in_flight('a') == 1
+    bus._fail_in_flight('a', [future])
+    assert future.node_id == 'b'
+    assert NodeStats.in_flight('a') == 0 and NodeStats.in_flight('b') == 1
+
+    future.set_result(None)
+    loop.run_until_complete(asyncio.sleep(0))
+    assert NodeStats.in_flight('b') == 0
+    loop.close()
+
+
+def test_http_request_carries_its_deadline_in_a_header():
+    headers = _with_deadline({'Accept': 'application/json'}, 1700000000.25)
+    assert headers['Accept'] == 'application/json'
+    assert parse_deadline(headers[X_DEADLINE]) == 1700000000.25
+
+
+class _Transport:
+    def __init__(self):
+        self.written = []
+
+    def writelines(self, frames):
+        self.written.extend(frames)
+
+    def write(self, data):
+        self.written.append(data)
+
+    def get_write_buffer_size(self):
+        return 0
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        pass
+
+    def get_extra_info(self, name):
+        return None
+
+
+def client_protocol(loop, peer_features):
+    protocol = VykedProtocol(None)
+    transport = _Transport()
+    protocol.connection_made(transport)
+    protocol._handle_hello({'type': 'hello', 'features': peer_features})
+    loop.run_until_complete(asyncio.sleep(0))
+    transport.written.clear()
+    return protocol, transport
+
+
+def test_client_cancels_requests_it_gave_up_on(monkeypatch):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    monkeypatch.setattr(CONFIG, 'TCP_CANCEL_REQUESTS', True)
+    protocol, transport = client_protocol(loop, {'cancel': True})
+    cancelled, timed_out, answered = asyncio.Future(), asyncio.Future(), asyncio.Future()
+    protocol.track_request('r1', cancelled)
+    protocol.track_request('r2', timed_out)
+    protocol.track_request('r3', answered)
+    cancelled.cancel()
+    timed_out.set_exception(TimeoutError())
+    answered.set_result({})
+    for _ in range(2):
+        loop.run_until_complete(asyncio.sleep(0))
+    written = b''.join(transport.written).decode()
+    assert written.count('"cancel"') == 2
+    assert '"r1"' in written and '"r2"' in written and '"r3"' not in written
+    loop.close()
+
+
+def test_client_does_not_cancel_on_peers_without_the_cancel_feature(monkeypatch):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    monkeypatch.setattr(CONFIG, 'TCP_CANCEL_REQUESTS', True)
+    protocol, transport = client_protocol(loop, {})
+    future = asyncio.Future()
+    protocol.track_request('r1', future)
+    future.cancel()
+    for _ in range(2):
+        loop.run_until_complete(asyncio.sleep(0))
+    assert transport.written == []
+    loop.close()
+
+
+def test_server_cancels_a_handler_for_the_connection_that_sent_it():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    started = []
+
+    @asyncio.coroutine
+    def get(from_id, entity, request_id):
+        started.append(request_id)
+        yield from asyncio.sleep(10)
+    get.is_api, get.is_stream, get.cancellable = True, False, True
+
+    bus = TCPBus.__new__(TCPBus)
+    bus._streams, bus._running = {}, {}
+    bus.tcp_host = type('Host', (), {'get': staticmethod(get)})()
+    protocol, other = _Protocol(), _Protocol()
+    bus._request_receiver({'type': 'request', 'from': 'client1', 'endpoint': 'get', 'entity': None,
+                           'payload': {'request_id': 'r1'}}, protocol)
+    loop.run_until_complete(asyncio.sleep(0))
+    assert started == ['r1']
+    task, = bus._running.values()
+
+    # the same request id from another client is another request
+    bus._handle_cancel({'type': 'cancel', 'request_id': 'r1'}, other)
+    assert not task.cancelled()
+    bus._handle_cancel({'type': 'cancel', 'request_id': 'r1'}, protocol)
+    loop.run_until_complete(asyncio.sleep(0))
+    assert task.cancelled() and bus._running == {}
+    assert protocol.sent == []
+    loop.close()
+
+
+def test_stream_ack_only_grants_credit_to_streams_of_its_connection():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    protocol, other = _Protocol(), _Protocol()
+    protocol.add_connection_lost_callback = protocol.remove_connection_lost_callback = lambda callback: None
+
+    @asyncio.coroutine
+    def export(from_id, entity, request_id, _stream):
+        yield from asyncio.sleep(10)
+    export.is_api, export.is_stream, export.cancellable = True, True, True
+
+    bus = TCPBus.__new__(TCPBus)
+    bus._streams, bus._running = {}, {}
+    bus.tcp_host = type('Host', (), {'export': staticmethod(export)})()
+    bus._request_receiver({'type': 'request', 'from': 'client1', 'endpoint': 'export', 'entity': None,
+                           'payload': {'request_id': 'r1', '_stream_window': 1}}, protocol)
+    writer, = bus._streams.values()
+
+    bus._handle_stream_ack({'type': 'stream_ack', 'request_id': 'r1', 'credit': 5}, other)
+    assert writer._credit == 1
+    bus._handle_stream_ack({'type': 'stream_ack', 'request_id': 'r1', 'credit': 5}, protocol)
+    assert writer._credit == 6
+    bus._handle_cancel({'type': 'cancel', 'request_id': 'r1'}, protocol)
+    loop.run_until_complete(asyncio.sleep(0))
+    assert bus._streams == {}
+    loop.close()
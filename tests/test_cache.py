@@ -0,0 +1,47 @@
+import time
+
+from vyked import api
+from vyked.utils.cache import ResultCache, cache_stats, canonical_key
+
+
+def test_evicts_least_recently_used_and_expires():
+    cache = ResultCache('lookup', ttl=0.05, max_size=2)
+    a = cache.make_key('e', {'x': 1, 'y': 2})
+    assert a == cache.make_key('e', {'y': 2, 'x': 1})
+    b = cache.make_key('e', {'x': 2})
+    c = cache.make_key(None, {'x': 3})
+    cache.put(a, 'A')
+    cache.put(b, 'B')
+    assert cache.get(a) == (True, 'A')
+    cache.put(c, 'C')
+    assert cache.get(b) == (False, None)
+    assert cache.evictions == 1
+    time.sleep(0.06)
+    assert cache.get(a) == (False, None)
+    assert cache.to_dict() == {'size': 1, 'hits': 1, 'misses': 2, 'evictions': 1, 'expirations': 1,
+                               'invalidations': 0}
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.invalidations == 1
+
+
+def test_canonical_key_ignores_key_order():
+    assert canonical_key('app', 'get', None, {'a': 1, 'b': [1, 2]}) == canonical_key('app', 'get', None,
+                                                                                   {'b': [1, 2], 'a': 1})
+    assert canonical_key('app', 'get', None, {'a': object()}) is None
+
+
+def test_apis_with_the_same_name_get_their_own_caches():
+    class Orders:
+        @api(cache=True)
+        def get(self, order_id):
+            return order_id
+
+    class Users:
+        @api(cache=True)
+        def get(self, user_id):
+            return user_id
+
+    assert Orders.get.result_cache is not Users.get.result_cache
+    stats = cache_stats()
+    assert Orders.get.__qualname__ in stats and Users.get.__qualname__ in stats
@@ -0,0 +1,35 @@
+import datetime
+import uuid
+from time import mktime
+
+from vyked import codec
+from vyked.codec import BinaryCodec, JSONCodec, get_codec, get_codec_by_id
+
+
+def test_codec_registry():
+    assert get_codec('json') is JSONCodec
+    assert get_codec_by_id(BinaryCodec.codec_id) is BinaryCodec
+
+
+def test_binary_codec_round_trip():
+    packet = {'pid': 'abc', 'type': 'request', 'payload': {'ids': [1, -5, 300, 70000, 2 ** 40, -2 ** 40],
+                                                           'ratio': 0.25, 'ok': True, 'missing': None,
+                                                           'blob': b'\x00\x01', 'name': 'x' * 40}}
+    assert BinaryCodec.decode(BinaryCodec.encode(packet)) == packet
+
+
+def test_binary_codec_matches_json_conversions():
+    now = datetime.datetime.now().replace(microsecond=0)
+    uid = uuid.uuid4()
+    packet = {'when': now, 'id': uid}
+    expected = {'when': int(mktime(now.timetuple())), 'id': str(uid)}
+    assert BinaryCodec.decode(BinaryCodec.encode(packet)) == expected
+    assert JSONCodec.decode(JSONCodec.encode(packet)) == expected
+
+
+def test_pure_python_fallback_is_wire_compatible(monkeypatch):
+    packet = {'type': 'response', 'payload': {'result': list(range(20)), 'text': 'y' * 300}}
+    encoded = BinaryCodec.encode(packet)
+    monkeypatch.setattr(codec, 'msgpack', None)
+    assert BinaryCodec.encode(packet) == encoded
+    assert BinaryCodec.decode(encoded) == packet
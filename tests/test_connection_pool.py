@@ -0,0 +1,31 @@
+from vyked.connection_pool import ConnectionPool
+
+
+class _Protocol:
+    def __init__(self, in_flight, connected=True):
+        self.in_flight = in_flight
+        self.send_queue_depth = 0
+        self._connected = connected
+
+    def is_connected(self):
+        return self._connected
+
+
+def test_acquire_picks_least_outstanding():
+    pool = ConnectionPool('node', size=3)
+    busy, idle, down = _Protocol(5), _Protocol(1), _Protocol(0, connected=False)
+    for protocol in (busy, idle, down):
+        pool.add(protocol)
+    assert pool.acquire() is idle
+    assert pool.missing == 0
+    assert pool.in_flight == 6
+
+
+def test_acquire_without_connected_members():
+    pool = ConnectionPool('node', size=2)
+    assert pool.acquire() is None
+    protocol = _Protocol(0, connected=False)
+    pool.add(protocol)
+    assert pool.acquire() is None
+    pool.remove(protocol)
+    assert pool.missing == 2
@@ -0,0 +1,66 @@
+import asyncio
+import os
+import time
+from functools import wraps
+
+from vyked import executors
+from vyked.config import CONFIG
+
+
+def _decorated(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        raise AssertionError('the pool must run the undecorated function')
+    return wrapper
+
+
+class Reports:
+    @_decorated
+    def render(self, n):
+        return os.getpid(), sum(range(n))
+
+
+def test_runs_in_thread_and_process_pools():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    reports = Reports()
+    render = Reports.render.__wrapped__
+    try:
+        pid, total = loop.run_until_complete(executors.run(executors.THREAD, render, (reports,), {'n': 10}))
+        assert (pid, total) == (os.getpid(), 45)
+        pid, total = loop.run_until_complete(executors.run(executors.PROCESS, render, (None,), {'n': 10}))
+        assert pid != os.getpid() and total == 45
+        gauges = executors.gauges()
+        assert gauges[executors.THREAD]['completed'] == 1
+        assert gauges[executors.PROCESS]['pending'] == 0
+    finally:
+        executors.shutdown()
+        loop.close()
+
+
+def test_cancelled_call_is_dropped_if_queued_and_waited_for_if_running(monkeypatch):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    executors.shutdown()
+    monkeypatch.setattr(CONFIG, 'EXECUTOR_THREADS', 1)
+    calls = []
+
+    def work(name):
+        time.sleep(0.1)
+        calls.append(name)
+
+    try:
+        running = asyncio.async(executors.run(executors.THREAD, work, ('first',), {}))
+        queued = asyncio.async(executors.run(executors.THREAD, work, ('second',), {}))
+        loop.run_until_complete(asyncio.sleep(0.02))
+        running.cancel()
+        queued.cancel()
+        loop.run_until_complete(asyncio.sleep(0.02))
+        assert queued.cancelled() and not running.done()
+        loop.run_until_complete(asyncio.wait([running]))
+        assert running.cancelled() and calls == ['first']
+        loop.run_until_complete(asyncio.sleep(0.15))
+        assert calls == ['first']
+    finally:
+        executors.shutdown()
+        loop.close()
@@ -0,0 +1,97 @@
+import zlib
+
+from vyked.codec import get_codec_by_id
+from vyked.config import CONFIG
+from vyked.framing import (FrameBuffer, CODEC_MASK, FLAG_COMPRESSED, LEGACY_FRAME, make_binary_frame,
+                           make_legacy_frame)
+from vyked.jsonprotocol import JSONProtocol
+
+
+def test_legacy_frames_split_on_delimiter():
+    buffer = FrameBuffer()
+    frames = buffer.feed(make_legacy_frame(b'{"a": 1}') + make_legacy_frame(b'{"b": 2}'))
+    assert frames == [(LEGACY_FRAME, b'{"a": 1}'), (LEGACY_FRAME, b'{"b": 2}')]
+    assert len(buffer) == 0
+
+
+def test_binary_frame_across_chunks():
+    buffer = FrameBuffer()
+    frame = make_binary_frame(b'x' * 1000, flags=3)
+    assert buffer.feed(frame[:3]) == []
+    assert buffer.feed(frame[3:500]) == []
+    assert buffer.feed(frame[500:]) == [(3, b'x' * 1000)]
+
+
+def test_binary_payload_may_contain_delimiter():
+    buffer = FrameBuffer()
+    payload = b'{"a": "!<^>!"}'
+    assert buffer.feed(make_binary_frame(payload)) == [(0, payload)]
+
+
+def test_mixed_framing_on_one_stream():
+    buffer = FrameBuffer()
+    data = make_legacy_frame(b'{"hello": 1}') + make_binary_frame(b'{"a": 1}') + make_legacy_frame(b'[]')
+    assert buffer.feed(data) == [(LEGACY_FRAME, b'{"hello": 1}'), (0, b'{"a": 1}'), (LEGACY_FRAME, b'[]')]
+
+
+def test_legacy_frame_byte_by_byte():
+    buffer = FrameBuffer()
+    data = make_legacy_frame(b'{"a": "' + b'y' * 50 + b'"}') + make_legacy_frame(b'{}')
+    frames = []
+    for i in range(len(data)):
+        frames.extend(buffer.feed(data[i:i + 1]))
+    assert frames == [(LEGACY_FRAME, b'{"a": "' + b'y' * 50 + b'"}'), (LEGACY_FRAME, b'{}')]
+    assert len(buffer) == 0
+
+
+def negotiated_protocol(monkeypatch, threshold=100, peer_compression=('zlib',)):
+    monkeypatch.setattr(CONFIG, 'TCP_BINARY_FRAMING', True)
+    monkeypatch.setattr(CONFIG, 'TCP_COMPRESSION_THRESHOLD', threshold)
+    protocol = JSONProtocol()
+    protocol._transport = type('Transport', (), {'get_extra_info': lambda self, name: None})()
+    peer_features = dict(JSONProtocol.local_features(), compression=list(peer_compression))
+    protocol._handle_hello({'type': 'hello', 'features': peer_features})
+    return protocol
+
+
+def read_frame(frame):
+    (flags, payload), = FrameBuffer().feed(frame)
+    if flags & FLAG_COMPRESSED:
+        payload = zlib.decompress(payload)
+    return flags, get_codec_by_id(flags & CODEC_MASK).decode(payload)
+
+
+def test_frame_below_compression_threshold_is_not_compressed(monkeypatch):
+    protocol = negotiated_protocol(monkeypatch)
+    packet = {'type': 'request', 'payload': 'x' * 10}
+    flags, decoded = read_frame(protocol._make_frame(packet))
+    assert not flags & FLAG_COMPRESSED
+    assert decoded == packet
+
+
+def test_frame_above_compression_threshold_is_compressed(monkeypatch):
+    protocol = negotiated_protocol(monkeypatch)
+    packet = {'type': 'request', 'payload': 'x' * 1000}
+    frame = protocol._make_frame(packet)
+    flags, decoded = read_frame(frame)
+    assert flags & FLAG_COMPRESSED
+    assert decoded == packet
+    assert len(frame) < 1000
+
+
+def test_incompressible_frame_is_sent_raw(monkeypatch):
+    protocol = negotiated_protocol(monkeypatch, threshold=1)
+    packet = {'a': 'k7Q'}
+    data = protocol._codec.encode(packet)
+    assert len(zlib.compress(data)) >= len(data)
+    flags, decoded = read_frame(protocol._make_frame(packet))
+    assert not flags & FLAG_COMPRESSED
+    assert decoded == packet
+
+
+def test_peer_without_zlib_never_gets_compressed_frames(monkeypatch):
+    protocol = negotiated_protocol(monkeypatch, peer_compression=())
+    packet = {'type': 'request', 'payload': 'x' * 1000}
+    flags, decoded = read_frame(protocol._make_frame(packet))
+    assert not flags & FLAG_COMPRESSED
+    assert decoded == packet
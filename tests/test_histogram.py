@@ -0,0 +1,27 @@
+from vyked.utils.histogram import Histogram, bucket_index, bucket_value, BUCKETS
+
+
+def test_buckets_are_within_a_sixteenth_of_the_value():
+    assert bucket_index(0) == 0 and bucket_index(31) == 31
+    assert bucket_index(10 ** 12) == BUCKETS - 1
+    previous = -1
+    for value in list(range(0, 5000)) + [10 ** 6, 10 ** 7]:
+        index = bucket_index(value)
+        assert index >= previous
+        previous = index
+        assert abs(bucket_value(index) - value) <= value / 16
+
+
+def test_percentiles_and_merge():
+    histogram = Histogram()
+    for value in range(1, 1001):
+        histogram.record(value)
+    other = Histogram.from_dict(histogram.to_dict())
+    histogram.merge(other)
+    assert histogram.count == 2000
+    percentiles = histogram.percentiles()
+    assert abs(percentiles['p50'] - 500) <= 500 / 16
+    assert abs(percentiles['p99'] - 990) <= 990 / 16
+    assert percentiles['p99.9'] <= histogram.max == 1000
+    histogram.clear()
+    assert histogram.percentiles()['p50'] == 0
@@ -0,0 +1,50 @@
+import asyncio
+
+from vyked.exceptions import ServiceOverloaded
+from vyked.limiter import ConcurrencyLimiter, Bulkhead
+
+
+def test_rejects_over_limit():
+    limiter = ConcurrencyLimiter(initial=2, min_limit=1, max_limit=10)
+    assert limiter.try_acquire() and limiter.try_acquire()
+    assert not limiter.try_acquire()
+    assert limiter.gauges() == {'limit': 2, 'in_flight': 2, 'rejected': 1}
+
+
+def test_limit_grows_while_fast_and_shrinks_when_slow():
+    limiter = ConcurrencyLimiter(initial=10, min_limit=1, max_limit=100)
+    for _ in range(50):
+        for _ in range(10):
+            limiter.try_acquire()
+        for _ in range(10):
+            limiter.release(10)
+    grown = limiter.limit
+    assert grown > 10
+    limiter.try_acquire()
+    limiter.release(1000)
+    assert limiter.limit < grown
+    limiter.try_acquire()
+    limiter.release(None, dropped=True)
+    assert limiter.limit >= limiter.min_limit
+
+
+def test_bulkhead_queues_then_rejects():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    bulkhead = Bulkhead(max_concurrency=1, queue_size=1)
+    assert loop.run_until_complete(bulkhead.acquire()) == 0
+    waiting = loop.create_task(bulkhead.acquire())
+    loop.run_until_complete(asyncio.sleep(0))
+    assert bulkhead.queued == 1
+    try:
+        loop.run_until_complete(bulkhead.acquire())
+    except ServiceOverloaded:
+        pass
+    else:
+        assert False, 'a full bulkhead must reject'
+    bulkhead.release()
+    assert loop.run_until_complete(waiting) >= 0
+    assert bulkhead.running == 1 and bulkhead.queued == 0
+    bulkhead.release()
+    assert bulkhead.running == 0
+    loop.close()
@@ -0,0 +1,88 @@
+import time
+
+from vyked.config import CONFIG
+from vyked.routing import RoutingTable, NodeStats, NodeHealth, CircuitBreaker
+
+
+def test_routing_table_is_updated_incrementally():
+    table = RoutingTable()
+    table.add('users/1', ('10.0.0.1', 4000, 'a', 'tcp'))
+    table.add('users/1', ('10.0.0.1', 4001, 'b', 'http'))
+    table.add('users/1', ('10.0.0.2', 4000, 'c', 'tcp'))
+    assert [entry[2] for entry in table.get('users/1', 'tcp')] == ['a', 'c']
+    table.remove('users/1', 'a')
+    assert table.choose('users/1', 'tcp')[2] == 'c'
+    assert table.choose('users/1', 'http')[2] == 'b'
+    assert table.choose('orders/1', 'tcp') is None
+    assert table.choose('users/1', 'tcp', exclude='c') is None
+
+
+def test_two_choices_prefers_less_loaded_node():
+    table = RoutingTable()
+    table.add('users/1', ('10.0.0.1', 4000, 'fast', 'tcp'))
+    table.add('users/1', ('10.0.0.2', 4000, 'slow', 'tcp'))
+    NodeStats.update_latency('fast', 10)
+    NodeStats.update_latency('slow', 200)
+    try:
+        assert all(table.choose('users/1', 'tcp')[2] == 'fast' for _ in range(20))
+        for _ in range(30):
+            NodeStats.request_sent('fast')
+        assert table.choose('users/1', 'tcp')[2] == 'slow'
+    finally:
+        NodeStats.forget('fast')
+        NodeStats.forget('slow')
+
+
+def test_entity_routing_is_stable_and_moves_few_entities():
+    table = RoutingTable()
+    for node in range(8):
+        table.add('orders/1', ('10.0.0.1', 4000 + node, 'node-{}'.format(node), 'tcp'))
+    entities = ['order-{}'.format(i) for i in range(2000)]
+    before = [table.choose_for_entity('orders/1', 'tcp', entity)[2] for entity in entities]
+    assert before == [table.choose_for_entity('orders/1', 'tcp', entity)[2] for entity in entities]
+    table.remove('orders/1', 'node-3')
+    after = [table.choose_for_entity('orders/1', 'tcp', entity)[2] for entity in entities]
+    moved = [b for b, a in zip(before, after) if a != b]
+    assert set(moved) == {'node-3'}
+    assert table.choose_for_entity('users/1', 'tcp', 'order-1') is None
+    assert all(table.choose_for_entity('orders/1', 'tcp', entity, exclude='node-0')[2] != 'node-0'
+               for entity in entities)
+
+
+def test_failing_node_is_ejected_and_probed_after_backoff():
+    table = RoutingTable()
+    table.add('users/1', ('10.0.0.1', 4000, 'sick', 'tcp'))
+    table.add('users/1', ('10.0.0.2', 4000, 'healthy', 'tcp'))
+    try:
+        for _ in range(CONFIG.CIRCUIT_BREAKER_WINDOW):
+            NodeHealth.record('sick', failed=True)
+        assert NodeHealth.states()['sick'] == CircuitBreaker.OPEN
+        assert all(table.choose('users/1', 'tcp')[2] == 'healthy' for _ in range(20))
+        assert table.choose_for_entity('users/1', 'tcp', 'any')[2] == 'healthy'
+
+        NodeHealth._breakers['sick']._retry_at = 0
+        table.remove('users/1', 'healthy')
+        assert table.choose('users/1', 'tcp')[2] == 'sick'
+        assert NodeHealth.states()['sick'] == CircuitBreaker.HALF_OPEN
+        NodeHealth.record('sick', failed=False)
+        assert NodeHealth.states()['sick'] == CircuitBreaker.CLOSED
+    finally:
+        NodeHealth.forget('sick')
+
+
+def test_only_the_probe_decides_a_half_open_breaker():
+    breaker = CircuitBreaker()
+    for _ in range(CONFIG.CIRCUIT_BREAKER_WINDOW):
+        breaker.record(True)
+    assert breaker.state == CircuitBreaker.OPEN
+    sent_before_probe = time.time()
+    breaker._retry_at = 0
+    breaker.routed()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    # late outcomes of requests sent before the probe don't close or reopen it
+    breaker.record(False, sent_at=sent_before_probe - 1)
+    breaker.record(True, sent_at=sent_before_probe - 1)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.record(False, sent_at=time.time())
+    assert breaker.state == CircuitBreaker.CLOSED
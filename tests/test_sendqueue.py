@@ -0,0 +1,181 @@
+import asyncio
+
+import pytest
+
+from vyked.bus import TCPBus
+from vyked.config import CONFIG
+from vyked.exceptions import SendBufferFull
+from vyked.jsonprotocol import JSONProtocol, VykedProtocol
+from vyked.sendqueue import SendQueue
+
+
+class FakeTransport:
+    def __init__(self):
+        self.writes = []
+        self.buffered = 0
+
+    def writelines(self, frames):
+        self.writes.append(list(frames))
+
+    def write(self, data):
+        self.writes.append([data])
+
+    def get_write_buffer_size(self):
+        return self.buffered
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        pass
+
+    def get_extra_info(self, name):
+        return None
+
+    def close(self):
+        self.closed = True
+
+    def pause_reading(self):
+        self.reading = False
+
+    def resume_reading(self):
+        self.reading = True
+
+
+def test_sends_of_one_loop_iteration_are_written_together_in_order():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    transport = FakeTransport()
+    queue = SendQueue(transport, loop=loop)
+    for i in range(5):
+        queue.send('frame{}'.format(i).encode())
+    assert transport.writes == []
+    loop.run_until_complete(asyncio.sleep(0))
+    assert transport.writes == [[b'frame0', b'frame1', b'frame2', b'frame3', b'frame4']]
+    assert queue.flushes == 1 and queue.frames_flushed == 5
+    loop.close()
+
+
+def test_flush_writes_out_what_is_left():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    transport = FakeTransport()
+    queue = SendQueue(transport, loop=loop)
+    queue.pause()
+    queue.send(b'a')
+    queue.send(b'b')
+    queue.flush()
+    assert transport.writes == []
+    queue.resume()
+    queue.flush()
+    assert transport.writes == [[b'a', b'b']]
+    # nothing is written twice by the flush scheduled on resume
+    loop.run_until_complete(asyncio.sleep(0))
+    assert transport.writes == [[b'a', b'b']]
+    loop.close()
+
+
+def test_close_writes_out_what_is_left_before_ending_the_stream():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    transport = FakeTransport()
+    protocol = JSONProtocol()
+    protocol.connection_made(transport)
+    protocol.send({'type': 'ping'})
+    protocol.send({'type': 'pong'})
+    protocol.close()
+    assert len(transport.writes) == 2
+    written = b''.join(transport.writes[0]).decode()
+    assert written.count('ping') == 1 and written.index('ping') < written.index('pong')
+    assert transport.writes[1] == [b']'] and transport.closed
+    loop.close()
+
+
+def request_packet(request_id):
+    return {'type': 'request', 'service': 'orders', 'version': '1', 'to': 'node1', 'endpoint': 'get',
+            'entity': None, 'payload': {'request_id': request_id}}
+
+
+def full_protocol(monkeypatch, loop, protocol):
+    monkeypatch.setattr(CONFIG, 'TCP_SEND_BUFFER_HIGH_WATER', 10)
+    transport = FakeTransport()
+    protocol.connection_made(transport)
+    loop.run_until_complete(asyncio.sleep(0))
+    transport.writes.clear()
+    transport.buffered = 100
+    return transport
+
+
+def test_request_to_a_full_connection_raises_with_the_raise_policy(monkeypatch):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    monkeypatch.setattr(CONFIG, 'TCP_SEND_BUFFER_FULL_POLICY', 'raise')
+    protocol = VykedProtocol(None)
+    full_protocol(monkeypatch, loop, protocol)
+    future = asyncio.Future()
+    with pytest.raises(SendBufferFull):
+        TCPBus.__new__(TCPBus)._write_request(protocol, request_packet('r1'), future)
+    assert protocol.in_flight == 0
+    loop.close()
+
+
+def test_request_to_a_full_connection_is_sent_once_it_drains(monkeypatch):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    monkeypatch.setattr(CONFIG, 'TCP_SEND_BUFFER_FULL_POLICY', 'block')
+    protocol = VykedProtocol(None)
+    transport = full_protocol(monkeypatch, loop, protocol)
+    TCPBus.__new__(TCPBus)._write_request(protocol, request_packet('r1'), asyncio.Future())
+    loop.run_until_complete(asyncio.sleep(0))
+    assert transport.writes == [] and protocol.deferred_sends == 1 and protocol.in_flight == 1
+
+    transport.buffered = 10
+    protocol.resume_writing()
+    for _ in range(3):
+        loop.run_until_complete(asyncio.sleep(0))
+    assert len(transport.writes) == 1 and b'r1' in b''.join(transport.writes[0])
+    assert protocol.deferred_sends == 0
+    loop.close()
+
+
+def test_deferred_sends_per_connection_are_capped(monkeypatch):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    monkeypatch.setattr(CONFIG, 'TCP_SEND_BUFFER_FULL_POLICY', 'block')
+    monkeypatch.setattr(CONFIG, 'TCP_MAX_DEFERRED_SENDS', 2)
+    protocol = VykedProtocol(None)
+    full_protocol(monkeypatch, loop, protocol)
+    bus = TCPBus.__new__(TCPBus)
+    bus._write_request(protocol, request_packet('r1'), asyncio.Future())
+    bus._write_request(protocol, request_packet('r2'), asyncio.Future())
+    with pytest.raises(SendBufferFull):
+        bus._write_request(protocol, request_packet('r3'), asyncio.Future())
+    assert protocol.deferred_sends == 2
+
+    # waiting sends give up with the connection
+    protocol.connection_lost(None)
+    loop.run_until_complete(asyncio.sleep(0))
+    assert protocol.deferred_sends == 0
+    loop.close()
+
+
+def test_server_stops_reading_from_a_client_that_does_not_read_its_responses(monkeypatch):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    protocol = VykedProtocol(None)
+    transport = full_protocol(monkeypatch, loop, protocol)
+
+    @asyncio.coroutine
+    def get(from_id, entity, request_id):
+        return {'type': 'response', 'request_id': request_id}
+    get.is_api, get.is_stream, get.cancellable = True, False, False
+
+    bus = TCPBus.__new__(TCPBus)
+    bus._streams, bus._running = {}, {}
+    bus.tcp_host = type('Host', (), {'get': staticmethod(get)})()
+    bus._request_receiver(dict(request_packet('r1'), **{'from': 'client1'}), protocol)
+    assert transport.reading is False
+
+    transport.buffered = 0
+    protocol.resume_writing()
+    for _ in range(3):
+        loop.run_until_complete(asyncio.sleep(0))
+    assert transport.reading is True
+    loop.close()
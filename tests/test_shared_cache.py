@@ -0,0 +1,39 @@
+import asyncio
+import socket
+
+import pytest
+
+from vyked.shared_cache import SharedCache
+
+
+def _redis_running(host='localhost', port=6379):
+    try:
+        socket.create_connection((host, port), timeout=0.5).close()
+    except OSError:
+        return False
+    return True
+
+
+@pytest.mark.skipif(not _redis_running(), reason='needs a local redis-server')
+def test_stores_expires_and_invalidates_per_namespace():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    cache = SharedCache('localhost', 6379, pool_size=2, max_value_size=64)
+
+    @asyncio.coroutine
+    def run():
+        yield from cache.connect()
+        assert (yield from cache.set('test/1/lookup', 'a', {'x': 1}, ttl=0.2))
+        assert (yield from cache.set('test/1/other', 'a', {'x': 2}, ttl=5))
+        assert not (yield from cache.set('test/1/lookup', 'big', 'x' * 100, ttl=5))
+        assert (yield from cache.get('test/1/lookup', 'a')) == (True, {'x': 1})
+        yield from asyncio.sleep(0.3)
+        assert (yield from cache.get('test/1/lookup', 'a')) == (False, None)
+        assert (yield from cache.invalidate('test/1/other')) == 1
+        assert (yield from cache.get('test/1/other', 'a')) == (False, None)
+        # an invalidation right after another one isn't skipped
+        assert (yield from cache.set('test/1/other', 'a', {'x': 3}, ttl=5))
+        assert (yield from cache.invalidate('test/1/other')) == 1
+        cache.close()
+
+    loop.run_until_complete(run())
@@ -0,0 +1,42 @@
+import json
+import os
+import time
+
+from vyked.utils.stats import Aggregator, StatUnit
+
+
+def test_merges_the_stats_of_all_workers(tmpdir, monkeypatch):
+    monkeypatch.setattr(Aggregator, '_units', {})
+    other = {'count': 3, 'success_count': 2, 'average': 40, 'process_time_average': 4, 'queue_time_average': 0,
+             'sub': {'tcp': {'count': 3, 'success_count': 2, 'average': 40, 'process_time_average': 4,
+                             'queue_time_average': 0, 'sub': {}}},
+             'cache': {'lookup': {'hits': 5, 'misses': 1}}}
+    with open(os.path.join(str(tmpdir), '1.json'), 'w') as f:
+        json.dump(other, f)
+    Aggregator.update_stats(endpoint='lookup', status='succesful', time_taken=10, server_type='tcp')
+    Aggregator.update_stats(endpoint='lookup', status='succesful', time_taken=10, server_type='tcp')
+    Aggregator.stats_dir, Aggregator.worker_id = str(tmpdir), 0
+    try:
+        stats = Aggregator.dump_all_stats()
+    finally:
+        Aggregator.stats_dir = Aggregator.worker_id = None
+    assert stats['workers'] == 2
+    assert stats['count'] == 5 and stats['success_count'] == 4
+    assert stats['average'] == 25
+    assert stats['sub']['tcp']['count'] == 5
+    assert stats['cache']['lookup']['hits'] == 5
+    assert stats['p99'] == 10
+
+
+def test_window_slides_instead_of_resetting(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    unit = StatUnit(key=('tcp', 'lookup', 'succesful'))
+    unit.update(10, 1, True)
+    now[0] += StatUnit.WINDOW / 2
+    unit.update(30, 1, True)
+    window = unit.window()
+    assert window.count == 2 and window.to_dict()['average'] == 20
+    now[0] += StatUnit.WINDOW / 2 + 1
+    window = unit.window()
+    assert window.count == 1 and window.to_dict()['max'] == 30
@@ -0,0 +1,60 @@
+import asyncio
+
+from vyked.streams import StreamWriter, ResponseStream
+
+
+class _Protocol:
+    def __init__(self):
+        self.sent = []
+
+    def is_writable(self):
+        return True
+
+    def send(self, packet):
+        self.sent.append(packet)
+
+
+def test_writer_waits_for_credit():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    protocol = _Protocol()
+    writer = StreamWriter(protocol, 'rid', window=2)
+
+    @asyncio.coroutine
+    def produce():
+        for chunk in range(3):
+            yield from writer.write(chunk)
+
+    task = loop.create_task(produce())
+    loop.run_until_complete(asyncio.sleep(0))
+    assert [packet['chunk'] for packet in protocol.sent] == [0, 1]
+    writer.grant(1)
+    loop.run_until_complete(task)
+    assert [packet['seq'] for packet in protocol.sent] == [0, 1, 2]
+    loop.close()
+
+
+def test_response_stream_reads_chunks_and_acks():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    protocol = _Protocol()
+    future = asyncio.Future()
+    stream = ResponseStream('rid', future, window=2)
+
+    @asyncio.coroutine
+    def consume():
+        chunks = []
+        while True:
+            chunk = yield from stream.read()
+            if chunk is None:
+                return chunks
+            chunks.append(chunk)
+
+    task = loop.create_task(consume())
+    stream.feed('a', protocol)
+    stream.feed('b', protocol)
+    loop.run_until_complete(asyncio.sleep(0))
+    future.set_result(2)
+    assert loop.run_until_complete(task) == ['a', 'b']
+    assert [packet['type'] for packet in protocol.sent] == ['stream_ack', 'stream_ack']
+    loop.close()
@@ -0,0 +1,21 @@
+import asyncio
+
+from vyked.utils.timing_wheel import TimingWheel
+
+
+def test_expires_due_timeouts_and_skips_cancelled():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    wheel = TimingWheel(resolution=0.01, slots=8, loop=loop)
+    expired = []
+    wheel.schedule('short', 0.02, lambda: expired.append('short'))
+    wheel.schedule('cancelled', 0.02, lambda: expired.append('cancelled'))
+    wheel.schedule('long', 0.2, lambda: expired.append('long'))
+    wheel.cancel('cancelled')
+    loop.run_until_complete(asyncio.sleep(0.06))
+    assert expired == ['short']
+    assert len(wheel) == 1
+    loop.run_until_complete(asyncio.sleep(0.2))
+    assert expired == ['short', 'long']
+    assert len(wheel) == 0
+    loop.close()
@@ -0,0 +1,47 @@
+import asyncio
+
+from .packet import MessagePacket
+from .utils.stats import Stats
+
+
+class Batcher:
+    """
+    Collects packets bound for one connection and sends them as a single batch packet.
+    Packets are held for at most `window` seconds, a window of 0 sends everything added within the same iteration
+    of the event loop together. A batch is sent right away once it holds `max_size` packets
+    """
+
+    def __init__(self, send_func, window=0, max_size=64, loop=None):
+        self._send = send_func
+        self._window = window
+        self._max_size = max(1, max_size)
+        self._loop = loop or asyncio.get_event_loop()
+        self._packets = []
+        self._flush_handle = None
+
+    def __len__(self):
+        return len(self._packets)
+
+    def add(self, packet: dict):
+        self._packets.append(packet)
+        if len(self._packets) >= self._max_size:
+            self.flush()
+        elif self._flush_handle is None:
+            if self._window:
+                self._flush_handle = self._loop.call_later(self._window, self.flush)
+            else:
+                self._flush_handle = self._loop.call_soon(self.flush)
+
+    def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._packets:
+            return
+        packets, self._packets = self._packets, []
+        if len(packets) == 1:
+            self._send(packets[0])
+        else:
+            Stats.send_stats['batches'] += 1
+            Stats.send_stats['batched_packets'] += len(packets)
+            self._send(MessagePacket.batch(packets))
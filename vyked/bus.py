@@ -4,6 +4,7 @@ from functools import partial
 import json
 import logging
 import random
+import time
 
 from again.utils import unique_hex
 import aiohttp
@@ -12,11 +13,17 @@ from random import shuffle
 
 from .services import TCPServiceClient, HTTPServiceClient
 from .pubsub import PubSub
+from .shared_cache import SharedCache
 from .packet import ControlPacket
 from .protocol_factory import get_vyked_protocol
+from .connection_pool import ConnectionPool
+from .limiter import server_limiter
+from .routing import NodeHealth, NodeStats
+from .streams import StreamWriter
 from .utils.jsonencoder import VykedEncoder
-from .exceptions import ClientNotFoundError, RecursionDepthExceeded
+from .exceptions import ClientException, ClientDisconnected, ClientNotFoundError, RecursionDepthExceeded, SendBufferFull
 from .config import CONFIG
+from .utils.common_utils import X_DEADLINE, request_deadline
 
 
 HTTP = 'http'
@@ -32,6 +39,12 @@ def _retry_for_exception(_):
     return True
 
 
+def _with_deadline(headers, deadline):
+    headers = dict(headers or {})
+    headers[X_DEADLINE] = repr(deadline)
+    return headers
+
+
 class HTTPBus:
     def __init__(self, registry_client):
         self._registry_client = registry_client
@@ -46,6 +59,7 @@ class HTTPBus:
 
         http_keys = ['data', 'headers', 'cookies', 'auth', 'allow_redirects', 'compress', 'chunked']
         kwargs = {k: params[k] for k in http_keys if k in params}
+        kwargs['headers'] = _with_deadline(kwargs.get('headers'), request_deadline(CONFIG.HTTP_TIMEOUT))
 
         query_params = params.pop('params', {})
 
@@ -65,6 +79,8 @@ class TCPBus:
         self._registry_client = registry_client
         self._client_protocols = {}
         self._pingers = {}
+        self._streams = {}
+        self._running = {}
         self._node_clients = {}
         self._service_clients = []
         self.tcp_host = None
@@ -77,6 +93,21 @@ class TCPBus:
         tcp_connector = aiohttp.TCPConnector(conn_timeout= CONFIG.HTTP_TIMEOUT,
                                              keepalive_timeout=CONFIG.HTTP_KEEP_ALIVE_TIMEOUT)
         self._aiohttp_session = aiohttp.ClientSession(connector=tcp_connector)
+        # packet type dispatch tables, built once instead of a getattr() lookup per packet
+        self._senders = {'request': self._request_sender}
+        self._control_handlers = {'ping': self._handle_ping,
+                                  'pong': self._handle_pong_packet,
+                                  'change_log_level': self._handle_log_change,
+                                  'get_tasks': self._handle_get_tasks,
+                                  'get_queues': self._handle_get_queues,
+                                  'get_send_queues': self._handle_get_send_queues,
+                                  'get_connections': self._handle_get_connections,
+                                  'get_circuits': self._handle_get_circuits,
+                                  'get_limits': self._handle_get_limits,
+                                  'blacklist': self._handle_blacklist_packet,
+                                  'stream_ack': self._handle_stream_ack,
+                                  'cancel': self._handle_cancel}
+        self._receivers = {'request': self._request_receiver, 'batch': self._batch_receiver}
 
     def _create_service_clients(self):
         futures = []
@@ -84,8 +115,7 @@ class TCPBus:
             for host, port, node_id, service_type in self._registry_client.get_all_addresses(*sc.properties):
                 if service_type == 'tcp' and node_id not in self._node_clients.keys():
                     self._node_clients[node_id] = sc
-                    future = self._connect_to_client(host, node_id, port, service_type, sc)
-                    futures.append(future)
+                    futures.extend(self._fill_pool(host, node_id, port, service_type, sc))
         return asyncio.gather(*futures, return_exceptions=False)
 
     def register(self):
@@ -105,55 +135,138 @@ class TCPBus:
         sc = next(sc for sc in self._service_clients if sc.name == service and sc.version == version)
         if type == 'tcp' and node_id not in self._node_clients.keys():
             self._node_clients[node_id] = sc
-            asyncio.async(self._connect_to_client(host, node_id, port, type, sc))
+            for connection in self._fill_pool(host, node_id, port, type, sc):
+                asyncio.async(connection)
 
-    def send(self, packet: dict):
+    def send(self, packet: dict, future=None):
         packet['from'] = self._host_id
-        func = getattr(self, '_' + packet['type'] + '_sender')
-        func(packet)
+        self._senders[packet['type']](packet, future)
 
-    def _request_sender(self, packet: dict, retry_count=0):
+    def _request_sender(self, packet: dict, future=None, retry_count=0, exclude=None):
         """
         Sends a request to a server from a ServiceClient
         auto dispatch method called from self.send()
+        :param exclude: id of a node not to send the request to
         """
         if retry_count == MAX_RETRY_COUNT:
             _msg = 'could not connect to service: {} while calling endpoint: {}'.format(packet['service'],
                                                                                         packet['endpoint'])
             raise RecursionDepthExceeded(_msg)
 
-        node = self._get_node_id_for_packet(packet)
-        node_id = node[2]
+        node = self._get_node_id_for_packet(packet, exclude=exclude)
+        node_id = node[2] if node is not None else None
         try:
-            client_protocol = self._client_protocols.get(node_id)
+            pool = self._client_protocols.get(node_id)
         except TypeError:
-            client_protocol = None
+            pool = None
+        client_protocol = pool.acquire() if pool is not None else None
 
         if node_id and client_protocol:
-            if client_protocol.is_connected():
-                packet['to'] = node_id
-                client_protocol.send(packet)
-
-            else:
-                self._client_protocols.pop(node_id)
-                self.new_instance(packet['service'], packet['version'], *node)
-                self._request_sender(packet, retry_count)
+            packet['to'] = node_id
+            self._write_request(client_protocol, packet, future)
         else:
             # No node found to send request
             if node_id:
+                if pool is not None:
+                    self._refill_pool(node)
                 retry_count += 1
-                self._request_sender(packet, retry_count)
+                self._request_sender(packet, future, retry_count, exclude)
             else:
                 self._logger.error('Out of %s, Client Not found for packet %s', self._client_protocols.keys(), packet)
                 raise ClientNotFoundError()
 
+    def _write_request(self, protocol, packet, future):
+        writable = protocol.is_writable()
+        if not writable and (CONFIG.TCP_SEND_BUFFER_FULL_POLICY == 'raise' or
+                             protocol.deferred_sends >= CONFIG.TCP_MAX_DEFERRED_SENDS):
+            raise SendBufferFull('Send buffer full for service: {} node: {}'.format(packet['service'], packet['to']))
+        if future is not None:
+            protocol.track_request(packet['payload']['request_id'], future)
+        if writable:
+            protocol.send_batched(packet)
+        else:
+            # sent once the peer catches up, at most TCP_MAX_DEFERRED_SENDS of them wait per connection
+            protocol.send_when_writable(packet)
+
+    def send_queue_depths(self):
+        return {node_id: sum(protocol.send_queue_depth for protocol in pool)
+                for node_id, pool in self._client_protocols.items()}
+
+    def connection_gauges(self):
+        return {node_id: pool.gauges() for node_id, pool in self._client_protocols.items()}
+
+    def _fill_pool(self, host, node_id, port, service_type, service_client):
+        """
+        :return: a connect coroutine for every connection missing from the node's pool
+        """
+        pool = self._client_protocols.get(node_id)
+        if pool is None:
+            pool = self._client_protocols[node_id] = ConnectionPool(node_id, CONFIG.TCP_CONNECTIONS_PER_NODE)
+        missing = pool.missing - pool.connecting
+        pool.connecting += max(missing, 0)
+        return [self._add_pool_member(pool, host, node_id, port, service_type, service_client)
+                for _ in range(missing)]
+
+    def _refill_pool(self, node):
+        host, port, node_id, service_type = node
+        service_client = self._node_clients.get(node_id)
+        if service_client is not None:
+            for connection in self._fill_pool(host, node_id, port, service_type, service_client):
+                asyncio.async(connection)
+
+    @asyncio.coroutine
+    def _add_pool_member(self, pool, host, node_id, port, service_type, service_client):
+        try:
+            yield from self._connect_to_client(host, node_id, port, service_type, service_client)
+        finally:
+            pool.connecting -= 1
+
     @retry(should_retry_for_exception=_retry_for_exception, strategy=[0, 2, 4, 8, 16, 32], max_attempts=6)
     @asyncio.coroutine
     def _connect_to_client(self, host, node_id, port, service_type, service_client):
 
         _, protocol = yield from asyncio.get_event_loop().create_connection(partial(get_vyked_protocol, service_client),
                                                                             host, port, ssl=service_client._ssl_context)
-        self._client_protocols[node_id] = protocol
+        pool = self._client_protocols.get(node_id)
+        if pool is None:
+            pool = self._client_protocols[node_id] = ConnectionPool(node_id, CONFIG.TCP_CONNECTIONS_PER_NODE)
+        pool.add(protocol)
+        protocol.add_connection_lost_callback(partial(self._client_connection_lost, node_id))
+
+    def _client_connection_lost(self, node_id, protocol, exc):
+        pool = self._client_protocols.get(node_id)
+        if pool is not None:
+            pool.remove(protocol)
+        self._fail_in_flight(node_id, protocol.pop_in_flight())
+        if pool is None:
+            return
+        node = self._registry_client.get_for_node(node_id)
+        if node is not None:
+            # the node is still registered, replace the dead member
+            self._refill_pool(node)
+        elif not len(pool) and not pool.connecting:
+            self._client_protocols.pop(node_id, None)
+            self._node_clients.pop(node_id, None)
+
+    def _fail_in_flight(self, node_id, futures):
+        """
+        Requests in flight on a lost connection won't get a response, fail them now instead of at their timeout.
+        Requests to idempotent endpoints are sent again, once, to another node
+        """
+        if futures:
+            self._logger.info('Connection to %s lost with %d requests in flight', node_id, len(futures))
+        for future in futures:
+            packet = getattr(future, 'retry_packet', None)
+            if packet is not None:
+                future.retry_packet = None
+                try:
+                    self._request_sender(packet, future, exclude=node_id)
+                    NodeStats.track(future, packet['to'])
+                    continue
+                except (ClientException, RecursionDepthExceeded) as e:
+                    self._logger.info('Could not retry request %s: %s', packet['payload']['request_id'], e)
+            if not future.done():
+                future.set_exception(ClientDisconnected('Connection to node {} lost'.format(node_id)))
 
     @staticmethod
     def _create_json_service_name(app, service, version):
@@ -167,9 +280,48 @@ class TCPBus:
         pinger = self._pingers[node_id]
         asyncio.async(pinger.pong_received(count))
 
-    def _get_node_id_for_packet(self, packet):
+    def _handle_pong_packet(self, packet, _):
+        self._handle_pong(packet['node_id'], packet['count'])
+
+    @staticmethod
+    def _handle_get_tasks(_, protocol):
+        protocol.send(len(list(asyncio.Task.all_tasks())))
+
+    def _handle_get_queues(self, _, protocol):
+        protocol.send(str([(x._service_name, len(x._pending_requests.keys())) for x in self._service_clients]))
+
+    def _handle_get_send_queues(self, _, protocol):
+        protocol.send(self.send_queue_depths())
+
+    def _handle_cancel(self, packet, protocol):
+        # request ids are only unique per client, a request is cancelled by the connection that sent it
+        task = self._running.pop((protocol, packet['request_id']), None)
+        if task is not None:
+            task.cancel()
+
+    def _handle_stream_ack(self, packet, protocol):
+        # like cancels, acks only count for streams of requests sent on the same connection
+        stream_writer = self._streams.get((protocol, packet['request_id']))
+        if stream_writer is not None:
+            stream_writer.grant(packet['credit'])
+
+    def _handle_get_connections(self, _, protocol):
+        protocol.send(self.connection_gauges())
+
+    @staticmethod
+    def _handle_get_circuits(_, protocol):
+        protocol.send(NodeHealth.states())
+
+    @staticmethod
+    def _handle_get_limits(_, protocol):
+        protocol.send(server_limiter.gauges())
+
+    def _handle_blacklist_packet(self, _, protocol):
+        self._handle_blacklist(protocol)
+
+    def _get_node_id_for_packet(self, packet, exclude=None):
         service, version, entity = packet['service'], packet['version'], packet['entity']
-        node = self._registry_client.resolve(service, version, entity, TCP)
+        node = self._registry_client.resolve(service, version, entity, TCP, exclude=exclude)
         return node
 
     def handle_ping_timeout(self, node_id):
@@ -178,44 +330,71 @@ class TCPBus:
         service_props = self._registry_client.get_for_node(node_id)
         self._logger.info('service client props {}'.format(service_props))
         if service_props is not None:
-            host, port, _node_id, _type = service_props
-            asyncio.async(self._connect_to_client(host, _node_id, port, _type))
+            self._refill_pool(service_props)
 
     def receive(self, packet: dict, protocol, transport):
-        if packet['type'] == 'ping':
-            self._handle_ping(packet, protocol)
-        elif packet['type'] == 'pong':
-            self._handle_pong(packet['node_id'], packet['count'])
-        elif packet['type'] == 'change_log_level':
-            self._handle_log_change(packet, protocol)
-        elif packet['type'] == 'get_tasks':
-            protocol.send(len(list(asyncio.Task.all_tasks())))
-        elif packet['type'] == 'get_queues':
-            protocol.send(str([(x._service_name, len(x._pending_requests.keys())) for x in self._service_clients]))
-        elif packet['type'] == 'blacklist':
-            self._handle_blacklist(protocol)
-        else:
-            if self.tcp_host.is_for_me(packet['service'], packet['version']):
-                func = getattr(self, '_' + packet['type'] + '_receiver')
-                func(packet, protocol)
+        packet_type = packet['type']
+        handler = self._control_handlers.get(packet_type)
+        if handler is not None:
+            handler(packet, protocol)
+        elif self.tcp_host.is_for_me(packet['service'], packet['version']):
+            receiver = self._receivers.get(packet_type)
+            if receiver is not None:
+                receiver(packet, protocol)
             else:
-                self._logger.warn('wrongly routed packet: ', packet)
+                self._logger.warn('no receiver for packet type %s', packet_type)
+        else:
+            self._logger.warn('wrongly routed packet: %s', packet)
 
     def _request_receiver(self, packet, protocol):
         api_fn = getattr(self.tcp_host, packet['endpoint'])
         if api_fn.is_api:
             from_node_id = packet['from']
             entity = packet['entity']
-            future = asyncio.async(api_fn(from_id=from_node_id, entity=entity, **packet['payload']))
+            payload = packet['payload']
+            if 'deadline' in packet:
+                payload['_deadline'] = packet['deadline']
+            stream_writer = None
+            if api_fn.is_stream:
+                window = payload.pop('_stream_window', CONFIG.TCP_STREAM_WINDOW)
+                stream_writer = StreamWriter(protocol, payload['request_id'], window)
+                self._streams[protocol, stream_writer.request_id] = stream_writer
+                protocol.add_connection_lost_callback(stream_writer.connection_lost)
+                payload['_stream'] = stream_writer
+            request_id = payload['request_id']
+            future = asyncio.async(api_fn(from_id=from_node_id, entity=entity, **payload))
+            if api_fn.cancellable:
+                self._running[protocol, request_id] = future
+            if not protocol.is_writable():
+                # the caller isn't reading its responses, stop taking more requests from it
+                protocol.throttle_reading()
 
             def send_result(f):
+                self._running.pop((protocol, request_id), None)
+                if stream_writer is not None:
+                    self._streams.pop((protocol, stream_writer.request_id), None)
+                    protocol.remove_connection_lost_callback(stream_writer.connection_lost)
+                    # a chunk still waiting for credit fails instead of waiting forever
+                    stream_writer.connection_lost(protocol, None)
+                if f.cancelled():
+                    # cancelled by the client, which isn't waiting for a response
+                    return
                 result_packet = f.result()
-                protocol.send(result_packet)
+                # responses completing together go back in one batch, a slow request doesn't hold up the rest
+                protocol.send_batched(result_packet)
 
             future.add_done_callback(send_result)
         else:
             print('no api found for packet: ', packet)
 
+    def _batch_receiver(self, packet, protocol):
+        for request in packet['packets']:
+            receiver = self._receivers.get(request['type'])
+            if receiver is not None:
+                receiver(request, protocol)
+            else:
+                self._logger.warn('no receiver for batched packet type %s', request['type'])
+
     def handle_connected(self):
         if self.tcp_host:
             self._registry_client.register(self.tcp_host.host, self.tcp_host.port, self.tcp_host.name,
@@ -256,6 +435,8 @@ class TCPBus:
 
         http_keys = ['data', 'headers', 'cookies', 'auth', 'allow_redirects', 'compress', 'chunked']
         kwargs = {k: params[k] for k in http_keys if k in params}
+        deadline = request_deadline(60)
+        kwargs['headers'] = _with_deadline(kwargs.get('headers'), deadline)
 
         query_params = params.pop('params', {})
 
@@ -264,7 +445,8 @@ class TCPBus:
 
         query_params['version'] = version
         query_params['service'] = service
-        response = yield from asyncio.wait_for(asyncio.shield(self._aiohttp_session.request(method, url, params=query_params, **kwargs)), 60)
+        request = self._aiohttp_session.request(method, url, params=query_params, **kwargs)
+        response = yield from asyncio.wait_for(asyncio.shield(request), max(deadline - time.time(), 0))
         return response
 
 
@@ -276,10 +458,21 @@ class PubSubBus:
         self._registry_client = registry_client
         self._clients = None
         self._ssl_context = ssl_context
+        self._cache_invalidations = defaultdict(list)
+        self._shared_cache = None
+
+    @property
+    def shared_cache(self):
+        return self._shared_cache
 
     def create_pubsub_handler(self, host, port):
         self._pubsub_handler = PubSub(host, port)
         yield from self._pubsub_handler.connect()
+        if CONFIG.SHARED_CACHE:
+            shared_cache = SharedCache(host, port, pool_size=CONFIG.SHARED_CACHE_POOL_SIZE,
+                                       max_value_size=CONFIG.SHARED_CACHE_MAX_VALUE_SIZE)
+            yield from shared_cache.connect()
+            self._shared_cache = shared_cache
         return self._pubsub_handler
 
     def register_for_subscription(self, host, port, node_id, clients, service):
@@ -297,10 +490,28 @@ class PubSubBus:
                 elif getattr(fn, 'is_xsubscribe', False):
                     xsubs_list4registry.append((client.name, client.version, fn.__name__, getattr(fn, 'strategy')))
                     xsubs_list4redis.append('/'.join((client.name, client.version, fn.__name__, service.name, service.version)))
+        for key in self._register_cache_invalidations(service):
+            if key not in subs_list:
+                subs_list.append(key)
         asyncio.async(self.message_queue_popper(xsubs_list4redis))
         self._registry_client.x_subscribe(host, port, node_id, xsubs_list4registry)
         yield from self._pubsub_handler.subscribe(subs_list, handler=self.subscription_handler)
 
+    def _register_cache_invalidations(self, service):
+        """
+        :return: pubsub keys of the events that clear the result caches of the service's apis
+        """
+        for each in dir(service):
+            result_cache = getattr(getattr(service, each), 'result_cache', None)
+            if result_cache is None:
+                continue
+            result_cache.namespace_for(service)
+            for event in result_cache.invalidated_by:
+                if '/' not in event:
+                    event = self._get_pubsub_key(service.name, service.version, event)
+                self._cache_invalidations[event].append(result_cache)
+        return list(self._cache_invalidations)
+
     def publish(self, service, version, endpoint, payload):
         endpoint_key = self._get_pubsub_key(service, version, endpoint)
         asyncio.async(self._pubsub_handler.publish(endpoint_key, json.dumps(payload, cls=VykedEncoder)))
@@ -325,14 +536,23 @@ class PubSubBus:
         asyncio.async(self._pubsub_handler.add_to_queue(str(endpoint), json.dumps(payload, cls=VykedEncoder)))
 
     def subscription_handler(self, endpoint, payload):
+        for result_cache in self._cache_invalidations.get(endpoint, ()):
+            result_cache.clear()
+            if result_cache.shared and self._shared_cache is not None:
+                asyncio.async(self._shared_cache.invalidate(result_cache.namespace))
         elements = endpoint.split('/')
         node_id = None
         if len(elements) > 3:
             service, version, endpoint, node_id = elements
         else:
             service, version, endpoint = elements
-        client = [sc for sc in self._clients if (sc.name == service and sc.version == version)][0]
-        func = getattr(client, endpoint)
+        clients = [sc for sc in self._clients if (sc.name == service and sc.version == version)]
+        if not clients:
+            # only subscribed to for cache invalidation
+            return
+        func = getattr(clients[0], endpoint, None)
+        if func is None:
+            return
         if node_id:
             asyncio.async(func(json.loads(payload)))
         else:
@@ -0,0 +1,247 @@
+import datetime
+import json
+import struct
+import uuid
+from time import mktime
+
+from .utils.jsonencoder import VykedEncoder
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+if msgpack is not None and msgpack.version >= (1, 0, 0):
+    _UNPACK_OPTIONS = {'raw': False, 'strict_map_key': False}
+else:
+    _UNPACK_OPTIONS = {'raw': False}
+
+_codecs_by_name = {}
+_codecs_by_id = {}
+
+
+def register_codec(codec):
+    """
+    Make a codec available for negotiation, codec ids are carried in the low nibble of a binary frame's flags
+    """
+    if not 0 <= codec.codec_id <= 0x0F:
+        raise ValueError('codec id must be between 0 and 15')
+    _codecs_by_name[codec.name] = codec
+    _codecs_by_id[codec.codec_id] = codec
+
+
+def get_codec(name):
+    return _codecs_by_name[name]
+
+
+def get_codec_by_id(codec_id):
+    return _codecs_by_id[codec_id]
+
+
+def codec_names():
+    return list(_codecs_by_name.keys())
+
+
+class JSONCodec:
+    name = 'json'
+    codec_id = 0
+
+    @staticmethod
+    def encode(packet) -> bytes:
+        return json.dumps(packet, cls=VykedEncoder).encode()
+
+    @staticmethod
+    def decode(data: bytes):
+        return json.loads(data.decode())
+
+
+def _to_serializable(obj):
+    """
+    Same conversions as VykedEncoder
+    """
+    if isinstance(obj, datetime.datetime):
+        return int(mktime(obj.timetuple()))
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    raise TypeError('{} is not serializable'.format(repr(obj)))
+
+
+def _pack(obj, out):
+    if obj is None:
+        out.append(0xc0)
+    elif obj is True:
+        out.append(0xc3)
+    elif obj is False:
+        out.append(0xc2)
+    elif isinstance(obj, int):
+        if 0 <= obj < 0x80:
+            out.append(obj)
+        elif -0x20 <= obj < 0:
+            out.append(obj & 0xff)
+        elif obj > 0:
+            if obj <= 0xff:
+                out += struct.pack('>BB', 0xcc, obj)
+            elif obj <= 0xffff:
+                out += struct.pack('>BH', 0xcd, obj)
+            elif obj <= 0xffffffff:
+                out += struct.pack('>BI', 0xce, obj)
+            else:
+                out += struct.pack('>BQ', 0xcf, obj)
+        else:
+            if obj >= -0x80:
+                out += struct.pack('>Bb', 0xd0, obj)
+            elif obj >= -0x8000:
+                out += struct.pack('>Bh', 0xd1, obj)
+            elif obj >= -0x80000000:
+                out += struct.pack('>Bi', 0xd2, obj)
+            else:
+                out += struct.pack('>Bq', 0xd3, obj)
+    elif isinstance(obj, float):
+        out += struct.pack('>Bd', 0xcb, obj)
+    elif isinstance(obj, str):
+        data = obj.encode()
+        length = len(data)
+        if length < 0x20:
+            out.append(0xa0 | length)
+        elif length <= 0xff:
+            out += struct.pack('>BB', 0xd9, length)
+        elif length <= 0xffff:
+            out += struct.pack('>BH', 0xda, length)
+        else:
+            out += struct.pack('>BI', 0xdb, length)
+        out += data
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        length = len(obj)
+        if length <= 0xff:
+            out += struct.pack('>BB', 0xc4, length)
+        elif length <= 0xffff:
+            out += struct.pack('>BH', 0xc5, length)
+        else:
+            out += struct.pack('>BI', 0xc6, length)
+        out += obj
+    elif isinstance(obj, (list, tuple)):
+        length = len(obj)
+        if length < 0x10:
+            out.append(0x90 | length)
+        elif length <= 0xffff:
+            out += struct.pack('>BH', 0xdc, length)
+        else:
+            out += struct.pack('>BI', 0xdd, length)
+        for item in obj:
+            _pack(item, out)
+    elif isinstance(obj, dict):
+        length = len(obj)
+        if length < 0x10:
+            out.append(0x80 | length)
+        elif length <= 0xffff:
+            out += struct.pack('>BH', 0xde, length)
+        else:
+            out += struct.pack('>BI', 0xdf, length)
+        for key, value in obj.items():
+            _pack(key, out)
+            _pack(value, out)
+    else:
+        _pack(_to_serializable(obj), out)
+
+
+_FIXED = {0xc0: None, 0xc2: False, 0xc3: True}
+_NUMBERS = {0xca: struct.Struct('>f'), 0xcb: struct.Struct('>d'),
+            0xcc: struct.Struct('>B'), 0xcd: struct.Struct('>H'), 0xce: struct.Struct('>I'), 0xcf: struct.Struct('>Q'),
+            0xd0: struct.Struct('>b'), 0xd1: struct.Struct('>h'), 0xd2: struct.Struct('>i'), 0xd3: struct.Struct('>q')}
+_LENGTHS = {0xc4: struct.Struct('>B'), 0xc5: struct.Struct('>H'), 0xc6: struct.Struct('>I'),
+            0xd9: struct.Struct('>B'), 0xda: struct.Struct('>H'), 0xdb: struct.Struct('>I'),
+            0xdc: struct.Struct('>H'), 0xdd: struct.Struct('>I'), 0xde: struct.Struct('>H'), 0xdf: struct.Struct('>I')}
+
+
+def _unpack(data, offset):
+    code = data[offset]
+    offset += 1
+    if code < 0x80:
+        return code, offset
+    if code >= 0xe0:
+        return code - 0x100, offset
+    if code <= 0x8f:
+        return _unpack_map(data, offset, code & 0x0f)
+    if code <= 0x9f:
+        return _unpack_array(data, offset, code & 0x0f)
+    if code <= 0xbf:
+        return _unpack_str(data, offset, code & 0x1f)
+    if code in _FIXED:
+        return _FIXED[code], offset
+    if code in _NUMBERS:
+        number = _NUMBERS[code]
+        return number.unpack_from(data, offset)[0], offset + number.size
+    if code in _LENGTHS:
+        size = _LENGTHS[code]
+        length = size.unpack_from(data, offset)[0]
+        offset += size.size
+        if code <= 0xc6:
+            end = offset + length
+            if end > len(data):
+                raise ValueError('truncated bin')
+            return bytes(data[offset:end]), end
+        if code <= 0xdb:
+            return _unpack_str(data, offset, length)
+        if code <= 0xdd:
+            return _unpack_array(data, offset, length)
+        return _unpack_map(data, offset, length)
+    raise ValueError('unsupported type code 0x{:02x}'.format(code))
+
+
+def _unpack_str(data, offset, length):
+    end = offset + length
+    if end > len(data):
+        raise ValueError('truncated str')
+    return bytes(data[offset:end]).decode(), end
+
+
+def _unpack_array(data, offset, length):
+    items = []
+    for _ in range(length):
+        item, offset = _unpack(data, offset)
+        items.append(item)
+    return items, offset
+
+
+def _unpack_map(data, offset, length):
+    items = {}
+    for _ in range(length):
+        key, offset = _unpack(data, offset)
+        items[key], offset = _unpack(data, offset)
+    return items, offset
+
+
+class BinaryCodec:
+    """
+    Compact binary codec using the msgpack wire format, the msgpack package is used when it is installed and a pure
+    python implementation otherwise, so nodes with and without it can talk to each other
+    """
+    name = 'msgpack'
+    codec_id = 1
+
+    @staticmethod
+    def encode(packet) -> bytes:
+        if msgpack is not None:
+            return msgpack.packb(packet, default=_to_serializable, use_bin_type=True)
+        out = bytearray()
+        _pack(packet, out)
+        return bytes(out)
+
+    @staticmethod
+    def decode(data: bytes):
+        if msgpack is not None:
+            try:
+                return msgpack.unpackb(data, **_UNPACK_OPTIONS)
+            except Exception as e:
+                raise ValueError(str(e))
+        try:
+            packet, offset = _unpack(data, 0)
+        except (IndexError, struct.error) as e:
+            raise ValueError('truncated data: {}'.format(e))
+        if offset != len(data):
+            raise ValueError('extra data after packet')
+        return packet
+
+
+register_codec(JSONCodec)
+register_codec(BinaryCodec)
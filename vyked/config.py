@@ -8,3 +8,32 @@ class CONFIG:
     HTTP_KEEP_ALIVE_TIMEOUT = config['HTTP_KEEP_ALIVE_TIMEOUT'] if isinstance(config, dict) and 'HTTP_KEEP_ALIVE_TIMEOUT' in config and valid_timeout(config['HTTP_KEEP_ALIVE_TIMEOUT']) else 15
     INTERNAL_HTTP_PREFIX = '/__onemg-internal__'
     SLOW_API_THRESHOLD = config['SLOW_API_THRESHOLD'] if isinstance(config, dict) and 'SLOW_API_THRESHOLD' in config and valid_timeout(config['SLOW_API_THRESHOLD']) else 1
+    TCP_BINARY_FRAMING = config['TCP_BINARY_FRAMING'] if isinstance(config, dict) and 'TCP_BINARY_FRAMING' in config else False
+    TCP_CODEC = config['TCP_CODEC'] if isinstance(config, dict) and 'TCP_CODEC' in config else 'json'
+    TCP_SEND_BUFFER_HIGH_WATER = config['TCP_SEND_BUFFER_HIGH_WATER'] if isinstance(config, dict) and 'TCP_SEND_BUFFER_HIGH_WATER' in config else 4 * 1024 * 1024
+    TCP_SEND_BUFFER_LOW_WATER = config['TCP_SEND_BUFFER_LOW_WATER'] if isinstance(config, dict) and 'TCP_SEND_BUFFER_LOW_WATER' in config else 1024 * 1024
+    TCP_SEND_BUFFER_FULL_POLICY = config['TCP_SEND_BUFFER_FULL_POLICY'] if isinstance(config, dict) and config.get('TCP_SEND_BUFFER_FULL_POLICY') in ('block', 'raise') else 'block'
+    TCP_MAX_DEFERRED_SENDS = config['TCP_MAX_DEFERRED_SENDS'] if isinstance(config, dict) and 'TCP_MAX_DEFERRED_SENDS' in config else 1024
+    TCP_COMPRESSION_THRESHOLD = config['TCP_COMPRESSION_THRESHOLD'] if isinstance(config, dict) and 'TCP_COMPRESSION_THRESHOLD' in config else 0
+    TCP_CONNECTIONS_PER_NODE = config['TCP_CONNECTIONS_PER_NODE'] if isinstance(config, dict) and 'TCP_CONNECTIONS_PER_NODE' in config else 1
+    TCP_BATCHING = config['TCP_BATCHING'] if isinstance(config, dict) and 'TCP_BATCHING' in config else False
+    TCP_BATCH_WINDOW = config['TCP_BATCH_WINDOW'] if isinstance(config, dict) and 'TCP_BATCH_WINDOW' in config else 0
+    TCP_BATCH_MAX_SIZE = config['TCP_BATCH_MAX_SIZE'] if isinstance(config, dict) and 'TCP_BATCH_MAX_SIZE' in config else 64
+    TCP_CANCEL_REQUESTS = config['TCP_CANCEL_REQUESTS'] if isinstance(config, dict) and 'TCP_CANCEL_REQUESTS' in config else False
+    CIRCUIT_BREAKER_WINDOW = config['CIRCUIT_BREAKER_WINDOW'] if isinstance(config, dict) and 'CIRCUIT_BREAKER_WINDOW' in config else 20
+    CIRCUIT_BREAKER_ERROR_RATE = config['CIRCUIT_BREAKER_ERROR_RATE'] if isinstance(config, dict) and 'CIRCUIT_BREAKER_ERROR_RATE' in config else 0.5
+    CIRCUIT_BREAKER_SLOW_MS = config['CIRCUIT_BREAKER_SLOW_MS'] if isinstance(config, dict) and 'CIRCUIT_BREAKER_SLOW_MS' in config else 5000
+    CIRCUIT_BREAKER_BACKOFF = config['CIRCUIT_BREAKER_BACKOFF'] if isinstance(config, dict) and 'CIRCUIT_BREAKER_BACKOFF' in config else 5
+    CIRCUIT_BREAKER_MAX_BACKOFF = config['CIRCUIT_BREAKER_MAX_BACKOFF'] if isinstance(config, dict) and 'CIRCUIT_BREAKER_MAX_BACKOFF' in config else 60
+    CONCURRENCY_LIMIT = config['CONCURRENCY_LIMIT'] if isinstance(config, dict) and 'CONCURRENCY_LIMIT' in config else False
+    CONCURRENCY_LIMIT_INITIAL = config['CONCURRENCY_LIMIT_INITIAL'] if isinstance(config, dict) and 'CONCURRENCY_LIMIT_INITIAL' in config else 100
+    CONCURRENCY_LIMIT_MIN = config['CONCURRENCY_LIMIT_MIN'] if isinstance(config, dict) and 'CONCURRENCY_LIMIT_MIN' in config else 10
+    CONCURRENCY_LIMIT_MAX = config['CONCURRENCY_LIMIT_MAX'] if isinstance(config, dict) and 'CONCURRENCY_LIMIT_MAX' in config else 2000
+    CONCURRENCY_LIMIT_BACKOFF = config['CONCURRENCY_LIMIT_BACKOFF'] if isinstance(config, dict) and 'CONCURRENCY_LIMIT_BACKOFF' in config else 0.9
+    CONCURRENCY_LATENCY_TOLERANCE = config['CONCURRENCY_LATENCY_TOLERANCE'] if isinstance(config, dict) and 'CONCURRENCY_LATENCY_TOLERANCE' in config else 2.0
+    TCP_STREAM_WINDOW = config['TCP_STREAM_WINDOW'] if isinstance(config, dict) and 'TCP_STREAM_WINDOW' in config else 16
+    SHARED_CACHE = config['SHARED_CACHE'] if isinstance(config, dict) and 'SHARED_CACHE' in config else False
+    SHARED_CACHE_POOL_SIZE = config['SHARED_CACHE_POOL_SIZE'] if isinstance(config, dict) and 'SHARED_CACHE_POOL_SIZE' in config else 4
+    SHARED_CACHE_MAX_VALUE_SIZE = config['SHARED_CACHE_MAX_VALUE_SIZE'] if isinstance(config, dict) and 'SHARED_CACHE_MAX_VALUE_SIZE' in config else 512 * 1024
+    EXECUTOR_THREADS = config['EXECUTOR_THREADS'] if isinstance(config, dict) and 'EXECUTOR_THREADS' in config else None
+    EXECUTOR_PROCESSES = config['EXECUTOR_PROCESSES'] if isinstance(config, dict) and 'EXECUTOR_PROCESSES' in config else None
@@ -0,0 +1,51 @@
+class ConnectionPool:
+    """
+    Client connections to one remote node.
+    Requests are sent on the connected member with the fewest requests in flight, so one slow response
+    only holds up the requests queued behind it on the same connection
+    """
+
+    def __init__(self, node_id, size=1):
+        self.node_id = node_id
+        self.size = max(1, size)
+        self.connecting = 0
+        self._members = []
+
+    def __len__(self):
+        return len(self._members)
+
+    def __iter__(self):
+        return iter(self._members)
+
+    @property
+    def missing(self):
+        """
+        Number of connections needed to fill up the pool, connections still being opened are counted by `connecting`
+        """
+        return self.size - len(self._members)
+
+    def add(self, protocol):
+        if protocol not in self._members:
+            self._members.append(protocol)
+
+    def remove(self, protocol):
+        if protocol in self._members:
+            self._members.remove(protocol)
+
+    def acquire(self):
+        """
+        :return: the connected member with the least requests in flight or None when no member is connected
+        """
+        best = None
+        for protocol in self._members:
+            if protocol.is_connected() and (best is None or protocol.in_flight < best.in_flight):
+                best = protocol
+        return best
+
+    @property
+    def in_flight(self):
+        return sum(protocol.in_flight for protocol in self._members)
+
+    def gauges(self):
+        return [{'in_flight': protocol.in_flight, 'send_queue': protocol.send_queue_depth,
+                 'connected': protocol.is_connected()} for protocol in self._members]
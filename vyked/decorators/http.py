@@ -1,10 +1,13 @@
+import asyncio
 from asyncio import iscoroutine, coroutine, wait_for, TimeoutError, shield
 from functools import wraps
 from vyked import HTTPServiceClient, HTTPService
-from ..exceptions import VykedServiceException
+from ..exceptions import VykedServiceException, DeadlineExceeded, ServiceOverloaded
+from .. import limiter, executors
+from ..limiter import Bulkhead
 from aiohttp.web import Response
 from ..utils.stats import Stats, Aggregator
-from ..utils.common_utils import json_file_to_dict, valid_timeout, X_REQUEST_ID
+from ..utils.common_utils import json_file_to_dict, valid_timeout, X_REQUEST_ID, X_DEADLINE
 import logging
 import setproctitle
 import socket
@@ -24,8 +27,17 @@ def make_request(func, self, args, kwargs, method):
     return response
 
 
-def get_decorated_fun(method, path, required_params, timeout, suppressed_errors):
+def get_decorated_fun(method, path, required_params, timeout, suppressed_errors, max_concurrency=None, queue_size=0,
+                      executor=None):
     def decorator(func):
+        # requests to this handler beyond max_concurrency wait in a queue of their own, queue_size long
+        bulkhead = Bulkhead(max_concurrency, queue_size) if max_concurrency else None
+        if executor is not None:
+            # the request and the service can't be sent to another process, a blocking handler runs in a thread
+            if executor != executors.THREAD:
+                raise ValueError('http handler {} can only run in a thread executor'.format(func.__name__))
+            executors.validate(executor, func)
+
         @wraps(func)
         def f(self, *args, **kwargs):
             if isinstance(self, HTTPServiceClient):
@@ -76,11 +88,55 @@ def get_decorated_fun(method, path, required_params, timeout, suppressed_errors)
                     wrapped_func = coroutine(func)
 
                 tracking_id = SharedContext.get(X_REQUEST_ID)
+                deadline = SharedContext.get(X_DEADLINE)
+                if deadline is not None:
+                    api_timeout = min(api_timeout, deadline - time.time())
 
+                task = None
+                admitted = False
+                queue_time = 0
                 try:
-                    result = yield from wait_for(shield(wrapped_func(self, *args, **kwargs)), api_timeout)
+                    if api_timeout <= 0:
+                        raise DeadlineExceeded()
+                    if bulkhead is not None:
+                        queue_time = yield from bulkhead.acquire()
+                        admitted = True
+                        if queue_time:
+                            api_timeout -= queue_time
+                            if api_timeout <= 0:
+                                raise DeadlineExceeded()
+                    if not limiter.try_acquire():
+                        raise ServiceOverloaded()
+                    if executor is not None:
+                        call = executors.run(executor, func, (self,) + args, kwargs)
+                    else:
+                        call = wrapped_func(self, *args, **kwargs)
+                    task = asyncio.async(call)
+                    limiter.release_when_done(task, bulkhead)
+                    admitted = False
+                    result = yield from wait_for(shield(task), api_timeout)
+
+                except ServiceOverloaded:
+                    Stats.http_stats['overloaded'] += 1
+                    status = 'overloaded'
+                    success = False
+                    res_d = {'error': limiter.OVERLOADED}
+                    return Response(status=503, content_type='application/json', body=json.dumps(res_d).encode())
+
+                except DeadlineExceeded:
+                    Stats.http_stats['deadline_exceeded'] += 1
+                    status = 'deadline_exceeded'
+                    success = False
+                    _logger.info('Skipped method %s, deadline has passed', func.__name__)
+                    res_d = {'error': 'deadline exceeded'}
+                    return Response(status=504, content_type='application/json', body=json.dumps(res_d).encode())
 
                 except TimeoutError as e:
+                    if task is not None:
+                        task.timed_out = True
+                        if executor is not None:
+                            # drops the call if it is still queued for the pool
+                            task.cancel()
                     Stats.http_stats['timedout'] += 1
                     status = 'timeout'
                     success = False
@@ -158,9 +214,12 @@ def get_decorated_fun(method, path, required_params, timeout, suppressed_errors)
                 finally:
                     t2 = time.time()
                     tp2 = time.process_time()
+                    queue_time = int(queue_time * 1000)
+                    if admitted:
+                        bulkhead.release()
                     Aggregator.update_stats(endpoint=func.__name__, status=status, success=success,
-                                            server_type='http', time_taken=int((t2 - t1) * 1000),
-                                            process_time_taken=int((tp2 - tp1) * 1000))
+                                            server_type='http', time_taken=int((t2 - t1) * 1000) - queue_time,
+                                            process_time_taken=int((tp2 - tp1) * 1000), queue_time=queue_time)
 
         f.is_http_method = True
         f.method = method
@@ -172,36 +231,52 @@ def get_decorated_fun(method, path, required_params, timeout, suppressed_errors)
     return decorator
 
 
-def get(path=None, required_params=None, timeout=None, is_internal=False, suppressed_errors=None):
-    return get_decorated_fun('get', get_path(path, is_internal), required_params, timeout, suppressed_errors)
+def get(path=None, required_params=None, timeout=None, is_internal=False, suppressed_errors=None,
+        max_concurrency=None, queue_size=0, executor=None):
+    return get_decorated_fun('get', get_path(path, is_internal), required_params, timeout, suppressed_errors,
+                             max_concurrency, queue_size, executor)
 
 
-def head(path=None, required_params=None, timeout=None, is_internal=False, suppressed_errors=None):
-    return get_decorated_fun('head', get_path(path, is_internal), required_params, timeout, suppressed_errors)
+def head(path=None, required_params=None, timeout=None, is_internal=False, suppressed_errors=None,
+         max_concurrency=None, queue_size=0, executor=None):
+    return get_decorated_fun('head', get_path(path, is_internal), required_params, timeout, suppressed_errors,
+                             max_concurrency, queue_size, executor)
 
 
-def options(path=None, required_params=None, timeout=None, is_internal=False, suppressed_errors=None):
-    return get_decorated_fun('options', get_path(path, is_internal), required_params, timeout, suppressed_errors)
+def options(path=None, required_params=None, timeout=None, is_internal=False, suppressed_errors=None,
+            max_concurrency=None, queue_size=0, executor=None):
+    return get_decorated_fun('options', get_path(path, is_internal), required_params, timeout, suppressed_errors,
+                             max_concurrency, queue_size, executor)
 
 
-def patch(path=None, required_params=None, timeout=None, is_internal=False, suppressed_errors=None):
-    return get_decorated_fun('patch', get_path(path, is_internal), required_params, timeout, suppressed_errors)
+def patch(path=None, required_params=None, timeout=None, is_internal=False, suppressed_errors=None,
+          max_concurrency=None, queue_size=0, executor=None):
+    return get_decorated_fun('patch', get_path(path, is_internal), required_params, timeout, suppressed_errors,
+                             max_concurrency, queue_size, executor)
 
 
-def post(path=None, required_params=None, timeout=None, is_internal=False, suppressed_errors=None):
-    return get_decorated_fun('post', get_path(path, is_internal), required_params, timeout, suppressed_errors)
+def post(path=None, required_params=None, timeout=None, is_internal=False, suppressed_errors=None,
+         max_concurrency=None, queue_size=0, executor=None):
+    return get_decorated_fun('post', get_path(path, is_internal), required_params, timeout, suppressed_errors,
+                             max_concurrency, queue_size, executor)
 
 
-def put(path=None, required_params=None, timeout=None, is_internal=False, suppressed_errors=None):
-    return get_decorated_fun('put', get_path(path, is_internal), required_params, timeout, suppressed_errors)
+def put(path=None, required_params=None, timeout=None, is_internal=False, suppressed_errors=None,
+        max_concurrency=None, queue_size=0, executor=None):
+    return get_decorated_fun('put', get_path(path, is_internal), required_params, timeout, suppressed_errors,
+                             max_concurrency, queue_size, executor)
 
 
-def trace(path=None, required_params=None, timeout=None, is_internal=False, suppressed_errors=None):
-    return get_decorated_fun('put', get_path(path, is_internal), required_params, timeout, suppressed_errors)
+def trace(path=None, required_params=None, timeout=None, is_internal=False, suppressed_errors=None,
+          max_concurrency=None, queue_size=0, executor=None):
+    return get_decorated_fun('put', get_path(path, is_internal), required_params, timeout, suppressed_errors,
+                             max_concurrency, queue_size, executor)
 
 
-def delete(path=None, required_params=None, timeout=None, is_internal=False, suppressed_errors=None):
-    return get_decorated_fun('delete', get_path(path, is_internal), required_params, timeout, suppressed_errors)
+def delete(path=None, required_params=None, timeout=None, is_internal=False, suppressed_errors=None,
+           max_concurrency=None, queue_size=0, executor=None):
+    return get_decorated_fun('delete', get_path(path, is_internal), required_params, timeout, suppressed_errors,
+                             max_concurrency, queue_size, executor)
 
 
 def get_path(path, is_internal=False):
@@ -1,8 +1,11 @@
 from functools import wraps, partial
-from again.utils import unique_hex
+from ..packet import MessagePacket
 from ..utils.stats import Stats, Aggregator
-from ..exceptions import VykedServiceException
-from ..utils.common_utils import valid_timeout, X_REQUEST_ID, get_uuid
+from ..exceptions import VykedServiceException, DeadlineExceeded, ServiceOverloaded
+from .. import limiter, executors
+from ..limiter import Bulkhead
+from ..utils.common_utils import valid_timeout, X_REQUEST_ID, X_DEADLINE, get_uuid
+from ..utils.cache import create_cache, canonical_key
 import asyncio
 import logging
 import socket
@@ -74,10 +77,18 @@ def _get_subscribe_decorator(func):
     return wrapper
 
 
-def request(func):
+def request(func=None, stream=False, timeout=None, idempotent=False, coalesce=False):
     """
     use to request an api call from a specific endpoint
+    with stream=True the call returns a ResponseStream over the chunks of a streamed api instead of a future
+    timeout (seconds) overrides TCPServiceClient.REQUEST_TIMEOUT_SECS for this endpoint
+    requests to idempotent endpoints are retried on another instance when the connection they were sent on is lost,
+    others fail with ClientDisconnected
+    with coalesce=True a request made while an identical one (same entity and params) is waiting for its response
+    shares that response instead of being sent
     """
+    if func is None:
+        return partial(request, stream=stream, timeout=timeout, idempotent=idempotent, coalesce=coalesce)
 
     @wraps(func)
     def wrapper(self, *args, **kwargs):
@@ -85,16 +96,22 @@ def request(func):
         self = params.pop('self', None)
         entity = params.pop('entity', None)
         app_name = params.pop('app_name', None)
-        request_id = unique_hex()
+        request_id = MessagePacket.next_request_id()
         params['request_id'] = request_id
-        future = self._send_request(app_name, endpoint=func.__name__, entity=entity, params=params)
+        if stream:
+            return self._send_stream_request(app_name, endpoint=func.__name__, entity=entity, params=params,
+                                             timeout=timeout)
+        future = self._send_request(app_name, endpoint=func.__name__, entity=entity, params=params, timeout=timeout,
+                                    idempotent=idempotent, coalesce=coalesce)
         return future
 
     wrapper.is_request = True
+    wrapper.is_stream = stream
     return wrapper
 
 
-def api(func=None, timeout=None):  # incoming
+def api(func=None, timeout=None, stream=False, cancellable=True, max_concurrency=None, queue_size=0,
+        cache=None, coalesce=False, executor=None):  # incoming
     """
     provide a request/response api
     receives any requests here and return value is the response
@@ -102,11 +119,28 @@ def api(func=None, timeout=None):  # incoming
         - request_id
         - entity (partition/routing key)
         followed by kwargs
+    with stream=True the function is a generator (or a coroutine returning an iterable) of chunks, which are sent
+    to the caller as they are produced followed by a final response carrying the number of chunks sent
+    the function is cancelled when the caller gives up on the request, unless cancellable is False
+    max_concurrency limits the calls to this endpoint running at once, with up to queue_size more waiting their
+    turn, so a slow endpoint can't take all of the service's capacity
+    cache keeps successful results in memory keyed by the entity and params, it is True, a ttl in seconds or a dict
+    of ttl, max_size and invalidated_by, the events ('event' of this service or 'service/version/event') whose
+    publication clears the cache. With shared True in the dict results are also kept in redis, under namespace
+    when given, for all the instances of the service when SHARED_CACHE is configured. Streamed apis are never cached
+    with coalesce=True a call made while an identical one (same entity and params) is running waits for its result
+    instead of running the function again, streamed apis are never coalesced
+    executor ('thread' or 'process') runs a plain, blocking function in a pool off the event loop, a function run
+    in a process gets None for self. A call that times out while queued for the pool is dropped, a running function
+    can't be stopped and runs to completion
     """
     if func is None:
-        return partial(api, timeout=timeout)
+        return partial(api, timeout=timeout, stream=stream, cancellable=cancellable, max_concurrency=max_concurrency,
+                       queue_size=queue_size, cache=cache, coalesce=coalesce, executor=executor)
     else:
-        wrapper = _get_api_decorator(func=func, timeout=timeout)
+        wrapper = _get_api_decorator(func=func, timeout=timeout, stream=stream, cancellable=cancellable,
+                                     max_concurrency=max_concurrency, queue_size=queue_size, cache=cache,
+                                     coalesce=coalesce, executor=executor)
         return wrapper
 
 
@@ -118,7 +152,28 @@ def deprecated(func=None, replacement_api=None):
         return wrapper
 
 
-def _get_api_decorator(func=None, old_api=None, replacement_api=None, timeout=None):
+@asyncio.coroutine
+def _stream_chunks(func, self, kwargs, stream_writer):
+    if asyncio.iscoroutinefunction(func):
+        chunks = yield from func(self, **kwargs)
+    else:
+        chunks = func(self, **kwargs)
+    for chunk in chunks:
+        yield from stream_writer.write(chunk)
+    return stream_writer.chunks_sent
+
+
+def _get_api_decorator(func=None, old_api=None, replacement_api=None, timeout=None, stream=False, cancellable=True,
+                       max_concurrency=None, queue_size=0, cache=None, coalesce=False, executor=None):
+    if executor is not None:
+        if stream:
+            raise ValueError('streamed api {} can not run in an executor'.format(func.__name__))
+        executors.validate(executor, func)
+    bulkhead = Bulkhead(max_concurrency, queue_size) if max_concurrency else None
+    result_cache = create_cache(func.__name__, cache, func.__qualname__) if cache and not stream else None
+    # running calls by their entity and params, for identical calls to share
+    flights = {} if coalesce and not stream else None
+
     @asyncio.coroutine
     @wraps(func)
     def wrapper(*args, **kwargs):
@@ -129,6 +184,8 @@ def _get_api_decorator(func=None, old_api=None, replacement_api=None, timeout=No
         rid = kwargs.pop('request_id')
         entity = kwargs.pop('entity')
         from_id = kwargs.pop('from_id')
+        stream_writer = kwargs.pop('_stream', None)
+        deadline = kwargs.pop('_deadline', None)
         wrapped_func = func
         result = None
         error = None
@@ -146,9 +203,78 @@ def _get_api_decorator(func=None, old_api=None, replacement_api=None, timeout=No
         Stats.tcp_stats['total_requests'] += 1
         tracking_id = kwargs.pop(X_REQUEST_ID , None) or get_uuid()
         SharedContext.set(X_REQUEST_ID, tracking_id)
-
+        if deadline is not None:
+            # nested requests inherit the caller's deadline, and nothing runs past it
+            SharedContext.set(X_DEADLINE, deadline)
+            api_timeout = min(api_timeout, deadline - time.time())
+
+        task = None
+        admitted = False
+        queue_time = 0
+        cache_key = None
+        cache_hit = False
+        shared_cache = None
+        if result_cache is not None:
+            if result_cache.shared and self.pubsub_bus is not None:
+                shared_cache = self.pubsub_bus.shared_cache
+            cache_key = result_cache.make_key(entity, kwargs)
+            if cache_key is not None:
+                cache_hit, result = result_cache.get(cache_key)
+                if not cache_hit and shared_cache is not None and api_timeout > 0:
+                    lookup_start = time.time()
+                    try:
+                        cache_hit, result = yield from asyncio.wait_for(
+                            shared_cache.get(result_cache.namespace_for(self), cache_key), api_timeout)
+                    except asyncio.TimeoutError:
+                        # a slow redis counts as a miss, with no time left the function is not called
+                        pass
+                    else:
+                        if cache_hit:
+                            result_cache.put(cache_key, result)
+                    api_timeout -= time.time() - lookup_start
+        flight_key = None
+        flight = None
+        if flights is not None and not cache_hit:
+            flight_key = canonical_key(entity, kwargs)
+            flight = flights.get(flight_key)
         try:
-            result = yield from asyncio.wait_for(asyncio.shield(wrapped_func(self, **kwargs)), api_timeout)
+            if cache_hit:
+                pass
+            elif flight is not None:
+                if api_timeout <= 0:
+                    raise DeadlineExceeded()
+                flight.followers += 1
+                Stats.coalesce_stats['calls_collapsed'] += 1
+                try:
+                    result = yield from asyncio.wait_for(asyncio.shield(flight), api_timeout)
+                finally:
+                    flight.followers -= 1
+            else:
+                if api_timeout <= 0:
+                    raise DeadlineExceeded()
+                if bulkhead is not None:
+                    queue_time = yield from bulkhead.acquire()
+                    admitted = True
+                    if queue_time:
+                        api_timeout -= queue_time
+                        if api_timeout <= 0:
+                            raise DeadlineExceeded()
+                if not limiter.try_acquire():
+                    raise ServiceOverloaded()
+                if stream:
+                    task = asyncio.async(_stream_chunks(func, self, kwargs, stream_writer))
+                elif executor is not None:
+                    handler_self = None if executor == executors.PROCESS else self
+                    task = asyncio.async(executors.run(executor, func, (handler_self,), kwargs))
+                else:
+                    task = asyncio.async(wrapped_func(self, **kwargs))
+                limiter.release_when_done(task, bulkhead)
+                admitted = False
+                if flight_key is not None:
+                    task.followers = 0
+                    flights[flight_key] = task
+                    task.add_done_callback(lambda _: flights.pop(flight_key, None))
+                result = yield from asyncio.wait_for(asyncio.shield(task), api_timeout)
 
         except asyncio.TimeoutError as e:
             Stats.tcp_stats['timedout'] += 1
@@ -156,8 +282,42 @@ def _get_api_decorator(func=None, old_api=None, replacement_api=None, timeout=No
             status = 'timeout'
             success = False
             failed = True
+            if task is not None:
+                task.timed_out = True
+                if stream:
+                    # the caller gets the timeout, nobody will ack the rest of the stream
+                    task.cancel()
+                elif executor is not None and not getattr(task, 'followers', 0):
+                    # drops the call if it is still queued for the pool
+                    task.cancel()
             logging.exception("%s TCP request had a timeout for method %s", tracking_id, func.__name__)
 
+        except asyncio.CancelledError:
+            # the shield keeps a timed out handler running, a cancelled request stops it unless others share it
+            if task is not None and not getattr(task, 'followers', 0):
+                task.cancel()
+            if admitted:
+                bulkhead.release()
+            Stats.tcp_stats['cancelled'] += 1
+            _logger.info('%s Cancelled method %s', tracking_id, func.__name__)
+            raise
+
+        except ServiceOverloaded:
+            # fail fast, the client routes around an overloaded node
+            Stats.tcp_stats['overloaded'] += 1
+            error = limiter.OVERLOADED
+            status = 'overloaded'
+            success = False
+            failed = True
+
+        except DeadlineExceeded:
+            Stats.tcp_stats['deadline_exceeded'] += 1
+            error = 'deadline exceeded'
+            status = 'deadline_exceeded'
+            success = False
+            failed = True
+            _logger.info('%s Skipped method %s, deadline has passed', tracking_id, func.__name__)
+
         except VykedServiceException as e:
             Stats.tcp_stats['total_responses'] += 1
             error = str(e)
@@ -183,9 +343,17 @@ def _get_api_decorator(func=None, old_api=None, replacement_api=None, timeout=No
 
         else:
             Stats.tcp_stats['total_responses'] += 1
+            if cache_key is not None and not cache_hit:
+                result_cache.put(cache_key, result)
+                if shared_cache is not None:
+                    asyncio.async(shared_cache.set(result_cache.namespace_for(self), cache_key, result,
+                                                   result_cache.ttl))
 
         end_time = int(time.time() * 1000)
         end_process_time = int(time.process_time() * 1000)
+        queue_time = int(queue_time * 1000)
+        if admitted:
+            bulkhead.release()
 
         hostname = socket.gethostname()
         service_name = '_'.join(setproctitle.getproctitle().split('_')[:-1])
@@ -212,8 +380,8 @@ def _get_api_decorator(func=None, old_api=None, replacement_api=None, timeout=No
 
         # call to update aggregator, designed to replace the stats module.
         Aggregator.update_stats(endpoint=func.__name__, status=status, success=success,
-                                server_type='tcp', time_taken=end_time - start_time,
-                                process_time_taken=end_process_time - start_process_time)
+                                server_type='tcp', time_taken=end_time - start_time - queue_time,
+                                process_time_taken=end_process_time - start_process_time, queue_time=queue_time)
 
         if not old_api:
             return self._make_response_packet(request_id=rid, from_id=from_id, entity=entity, result=result,
@@ -226,6 +394,9 @@ def _get_api_decorator(func=None, old_api=None, replacement_api=None, timeout=No
                                               service_name=self.name)
 
     wrapper.is_api = True
+    wrapper.is_stream = stream
+    wrapper.cancellable = cancellable
+    wrapper.result_cache = result_cache
     return wrapper
 
 
@@ -38,5 +38,17 @@ class ClientDisconnected(ClientException):
     pass
 
 
+class SendBufferFull(ClientException):
+    pass
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class ServiceOverloaded(ClientException):
+    pass
+
+
 class RecursionDepthExceeded(Exception):
     pass
@@ -0,0 +1,114 @@
+"""
+Thread and process pools that run blocking or CPU-bound handlers off the event loop.
+A function run in the process pool is looked up by its module and qualified name in the worker, so it must be
+importable there, its arguments and return value must be picklable and the service instance is not passed to it
+"""
+import asyncio
+import importlib
+import inspect
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+
+from .config import CONFIG
+
+THREAD = 'thread'
+PROCESS = 'process'
+KINDS = (THREAD, PROCESS)
+
+_executors = {}
+_workers = {}
+_pending = {THREAD: 0, PROCESS: 0}
+_completed = {THREAD: 0, PROCESS: 0}
+_queue_time = {THREAD: 0.0, PROCESS: 0.0}
+# functions already looked up by a process pool worker
+_resolved = {}
+
+
+def validate(kind, func):
+    if kind not in KINDS:
+        raise ValueError('executor must be one of {}, got {}'.format(KINDS, kind))
+    if asyncio.iscoroutinefunction(func) or inspect.isgeneratorfunction(func):
+        raise ValueError('{} runs in an executor and must be a plain function'.format(func.__name__))
+
+
+def get_executor(kind):
+    executor = _executors.get(kind)
+    if executor is None:
+        if kind == THREAD:
+            workers = CONFIG.EXECUTOR_THREADS or (os.cpu_count() or 1) * 5
+            executor = ThreadPoolExecutor(workers)
+        else:
+            workers = CONFIG.EXECUTOR_PROCESSES or os.cpu_count() or 1
+            executor = ProcessPoolExecutor(workers)
+        _workers[kind] = workers
+        _executors[kind] = executor
+    return executor
+
+
+def _timed_call(func, args, kwargs):
+    return time.time(), func(*args, **kwargs)
+
+
+def _call_by_name(module_name, qualname, args, kwargs):
+    key = (module_name, qualname)
+    func = _resolved.get(key)
+    if func is None:
+        func = importlib.import_module(module_name)
+        for name in qualname.split('.'):
+            func = getattr(func, name)
+        # the module holds the decorated function, run the one underneath
+        func = _resolved[key] = inspect.unwrap(func)
+    return _timed_call(func, args, kwargs)
+
+
+@asyncio.coroutine
+def run(kind, func, args, kwargs):
+    """
+    Run func(*args, **kwargs) in the pool of the kind. Cancelling drops the call if it is still queued, a call that
+    has started runs to completion and the cancellation only takes effect once it is done
+    """
+    executor = get_executor(kind)
+    if kind == PROCESS:
+        call = partial(_call_by_name, func.__module__, func.__qualname__, args, kwargs)
+    else:
+        call = partial(_timed_call, func, args, kwargs)
+    submitted = time.time()
+    concurrent_future = executor.submit(call)
+    future = asyncio.wrap_future(concurrent_future)
+    _pending[kind] += 1
+    try:
+        started, result = yield from asyncio.shield(future)
+    except asyncio.CancelledError:
+        if not concurrent_future.cancel():
+            # already running, whoever waits for the call holds on to its resources till it returns
+            yield from asyncio.wait([future])
+        raise
+    finally:
+        _pending[kind] -= 1
+    _completed[kind] += 1
+    _queue_time[kind] += max(started - submitted, 0)
+    return result
+
+
+def gauges():
+    """
+    :return: per pool in use, its workers, the calls submitted and not done, the calls waiting for a worker and the
+             calls completed with their average wait (ms) since the last call
+    """
+    d = {}
+    for kind in _executors:
+        completed = _completed[kind]
+        d[kind] = {'workers': _workers[kind], 'pending': _pending[kind],
+                   'queued': max(_pending[kind] - _workers[kind], 0), 'completed': completed,
+                   'average_queue_time': int(_queue_time[kind] * 1000 / completed) if completed else 0}
+        _completed[kind] = 0
+        _queue_time[kind] = 0.0
+    return d
+
+
+def shutdown(wait=True):
+    for executor in _executors.values():
+        executor.shutdown(wait=wait)
+    _executors.clear()
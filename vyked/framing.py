@@ -0,0 +1,77 @@
+import struct
+
+DELIMITER = b'!<^>!'
+
+# Binary (v2) frames start with a byte that can never begin a legacy JSON frame (0x80-0xBF is a UTF-8
+# continuation byte), so both framings can be told apart frame by frame on the same connection.
+FRAME_MAGIC = 0xB7
+HEADER = struct.Struct('!BBI')  # magic, flags, payload length
+CODEC_MASK = 0x0F  # low nibble of the flags holds the id of the codec the payload was encoded with
+FLAG_COMPRESSED = 0x80  # payload is zlib compressed
+
+FRAMING_LEGACY = 1
+FRAMING_V2 = 2
+
+LEGACY_FRAME = None
+
+
+def make_legacy_frame(data: bytes) -> bytes:
+    return data + DELIMITER
+
+
+def make_binary_frame(data: bytes, flags=0) -> bytes:
+    return HEADER.pack(FRAME_MAGIC, flags, len(data)) + data
+
+
+class FrameBuffer:
+    """
+    Receive buffer that splits a byte stream into complete frames.
+    Binary frames are read using their length header, anything else is treated as a legacy
+    delimiter terminated frame. The delimiter is only searched for in bytes that have not been scanned yet, so a
+    frame that arrives over many reads is scanned and copied once.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._scan_from = 0
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def feed(self, data: bytes):
+        """
+        Add received bytes to the buffer
+        :return: list of (flags, frame) tuples for every frame completed by data, flags is LEGACY_FRAME for
+                 delimiter terminated frames
+        """
+        buffer = self._buffer
+        buffer.extend(data)
+        frames = []
+        start = 0
+        with memoryview(buffer) as view:
+            while start < len(buffer):
+                if buffer[start] == FRAME_MAGIC:
+                    if len(buffer) - start < HEADER.size:
+                        break
+                    _, flags, length = HEADER.unpack_from(buffer, start)
+                    end = start + HEADER.size + length
+                    if len(buffer) < end:
+                        break
+                    frames.append((flags, view[start + HEADER.size:end].tobytes()))
+                    start = end
+                else:
+                    index = buffer.find(DELIMITER, max(start, self._scan_from))
+                    if index < 0:
+                        # resume after the bytes already scanned, a delimiter may straddle two reads
+                        self._scan_from = max(start, len(buffer) - len(DELIMITER) + 1)
+                        break
+                    frames.append((LEGACY_FRAME, view[start:index].tobytes()))
+                    start = index + len(DELIMITER)
+        if start:
+            del buffer[:start]
+            self._scan_from = max(0, self._scan_from - start)
+        return frames
+
+    def clear(self):
+        self._buffer.clear()
+        self._scan_from = 0
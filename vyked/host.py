@@ -3,6 +3,10 @@ import logging
 from functools import partial
 import signal
 import os
+import shutil
+import socket
+import tempfile
+import time
 
 from aiohttp.web import Application
 from .utils.monkey_patch import monkey_patch_asyncio_task_factory, monkey_patch_aiohttp_client_session_request, \
@@ -10,6 +14,7 @@ from .utils.monkey_patch import monkey_patch_asyncio_task_factory, monkey_patch_
 from .bus import TCPBus, PubSubBus
 from vyked.registry_client import RegistryClient
 from vyked.services import HTTPService, TCPService
+from .packet import _Packet
 from .protocol_factory import get_vyked_protocol
 from .utils.log import setup_logging, LogFormatHelper
 from vyked.utils.stats import Stats, Aggregator
@@ -23,6 +28,10 @@ class Host:
     pubsub_port = None
     name = None
     ronin = False
+    # number of worker processes sharing the service's sockets, the host process supervises them when more than one
+    workers = 1
+    _worker_index = None
+    _inherited_sockets = {}
     _host_id = None
     _tcp_service = None
     _http_service = None
@@ -53,6 +62,13 @@ class Host:
 
     @classmethod
     def run(cls):
+        if (cls._tcp_service or cls._http_service) and cls.workers > 1:
+            cls._supervise()
+        else:
+            cls._run()
+
+    @classmethod
+    def _run(cls):
         if cls._tcp_service or cls._http_service:
             cls.monkey_patch()
             cls._set_host_id()
@@ -65,6 +81,90 @@ class Host:
             cls._logger.error('No services to host')
 
 
+    @classmethod
+    def _services(cls):
+        return [service for service in (cls._tcp_service, cls._http_service) if service]
+
+    @classmethod
+    def _supervise(cls):
+        """
+        Fork the workers, restart the ones that exit and pass SIGINT and SIGTERM on to them
+        """
+        cls._logger.info('Starting %s workers, supervisor pid %s', cls.workers, os.getpid())
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            # the workers accept on sockets bound once here instead of binding their own
+            for service in cls._services():
+                cls._inherited_sockets[service.socket_address] = _bind_socket(*service.socket_address,
+                                                                              reuse_port=False)
+        stats_dir = tempfile.mkdtemp(prefix='vyked_stats_')
+        workers = {}
+        stopping = []
+
+        def forward(signum, _):
+            stopping.append(signum)
+            for pid in workers:
+                try:
+                    os.kill(pid, signum)
+                except ProcessLookupError:
+                    pass
+
+        signal.signal(signal.SIGINT, forward)
+        signal.signal(signal.SIGTERM, forward)
+        try:
+            for index in range(cls.workers):
+                workers[cls._fork_worker(index, stats_dir)] = (index, time.time())
+            while workers:
+                try:
+                    pid, status = os.wait()
+                except InterruptedError:
+                    continue
+                except ChildProcessError:
+                    break
+                index, started = workers.pop(pid, (None, None))
+                if index is None or stopping:
+                    continue
+                cls._logger.error('Worker %s (pid %s) exited with status %s, restarting it', index, pid, status)
+                if time.time() - started < 1:
+                    # don't spin on a worker that can't start
+                    time.sleep(1)
+                workers[cls._fork_worker(index, stats_dir)] = (index, time.time())
+        finally:
+            shutil.rmtree(stats_dir, ignore_errors=True)
+
+    @classmethod
+    def _fork_worker(cls, index, stats_dir):
+        pid = os.fork()
+        if pid:
+            return pid
+        status = 0
+        try:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            # nothing of the supervisor's event loop or packet ids is shared with the workers
+            asyncio.set_event_loop(asyncio.new_event_loop())
+            _Packet.reset_ids()
+            cls._worker_index = index
+            for service in cls._services():
+                service.set_worker(index, cls.workers)
+            Aggregator.stats_dir = stats_dir
+            Aggregator.worker_id = index
+            cls._run()
+        except BaseException:
+            cls._logger.exception('Worker %s failed', index)
+            status = 1
+        finally:
+            os._exit(status)
+
+    @classmethod
+    def _listening_socket(cls, service):
+        """
+        :return: the socket a worker accepts the service's connections on, None when not running workers
+        """
+        if cls._worker_index is None:
+            return None
+        address = service.socket_address
+        return cls._inherited_sockets.get(address) or _bind_socket(*address, reuse_port=True)
+
     @classmethod
     def monkey_patch(cls):
         monkey_patch_asyncio_task_factory()
@@ -81,8 +181,11 @@ class Host:
         if cls._tcp_service:
             ssl_context = cls._tcp_service.ssl_context
             host_ip, host_port = cls._tcp_service.socket_address
+            sock = cls._listening_socket(cls._tcp_service)
+            if sock is not None:
+                host_ip, host_port = None, None
             task = asyncio.get_event_loop().create_server(partial(get_vyked_protocol, cls._tcp_service.tcp_bus),
-                                                          host_ip, host_port, ssl=ssl_context)
+                                                          host_ip, host_port, ssl=ssl_context, sock=sock)
             result = asyncio.get_event_loop().run_until_complete(task)
             return result
 
@@ -108,7 +211,10 @@ class Host:
                             app.router.add_route('options', path, cls._http_service.preflight_response)
             handler = app.make_handler(access_log=cls._logger,
                                        access_log_format=LogFormatHelper.LogFormat)
-            task = asyncio.get_event_loop().create_server(handler, host_ip, host_port, ssl=ssl_context)
+            sock = cls._listening_socket(cls._http_service)
+            if sock is not None:
+                host_ip, host_port = None, None
+            task = asyncio.get_event_loop().create_server(handler, host_ip, host_port, ssl=ssl_context, sock=sock)
             return asyncio.get_event_loop().run_until_complete(task)
 
     @classmethod
@@ -216,4 +322,19 @@ class Host:
         Stats.service_name = host.name
         Stats.periodic_stats_logger()
         Aggregator.periodic_aggregated_stats_logger()
+        if Aggregator.stats_dir is not None:
+            Aggregator.periodic_worker_stats_writer()
         ClientStats.periodic_aggregator()
+
+
+def _bind_socket(host, port, reuse_port):
+    family = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0][0]
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        # each worker has a socket of its own, the kernel spreads the connections over them
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(100)
+    sock.setblocking(False)
+    return sock
@@ -1,10 +1,20 @@
 import asyncio
 import json
 import logging
+import time
+import zlib
+from functools import partial
 
 from jsonstreamer import ObjectStreamer
+from .batcher import Batcher
+from .codec import JSONCodec, get_codec, get_codec_by_id, codec_names
+from .config import CONFIG
+from .exceptions import ClientDisconnected
+from .framing import (FrameBuffer, DELIMITER, CODEC_MASK, FLAG_COMPRESSED, FRAMING_V2, LEGACY_FRAME,
+                      make_binary_frame, make_legacy_frame)
+from .packet import ControlPacket, MessagePacket
 from .sendqueue import SendQueue
-from .utils.jsonencoder import VykedEncoder
+from .utils.stats import Stats
 
 
 class JSONProtocol(asyncio.Protocol):
@@ -16,12 +26,50 @@ class JSONProtocol(asyncio.Protocol):
         self._transport = None
         self._obj_streamer = None
         self._pending_data = []
-        self._partial_data = ""
+        self._frame_buffer = FrameBuffer()
+        self._partial_frame = b''
+        self._binary_framing = False
+        self._codec = JSONCodec
+        self._compression_threshold = 0
+        self._peer_features = {}
+        self._reading_paused = False
+        self._deferred_sends = 0
+        self._batcher = None
+
+    def _make_frame(self, packet):
+        if self._binary_framing:
+            data = self._codec.encode(packet)
+            flags = self._codec.codec_id
+            if self._compression_threshold and len(data) >= self._compression_threshold:
+                start = time.time()
+                compressed = zlib.compress(data)
+                Stats.compression_stats['compress_time'] += time.time() - start
+                Stats.compression_stats['uncompressed_bytes'] += len(data)
+                Stats.compression_stats['compressed_bytes'] += len(compressed)
+                if len(compressed) < len(data):
+                    Stats.compression_stats['compressed_frames'] += 1
+                    data = compressed
+                    flags |= FLAG_COMPRESSED
+            return make_binary_frame(data, flags)
+        return make_legacy_frame(JSONCodec.encode(packet))
 
     @staticmethod
-    def _make_frame(packet):
-        string = json.dumps(packet, cls=VykedEncoder) + '!<^>!'
-        return string.encode()
+    def local_features():
+        """
+        Features advertised to the peer in the hello packet, a peer that never sends a hello is treated as a
+        legacy node and is only spoken to using delimited JSON frames
+        """
+        features = {}
+        if CONFIG.TCP_BINARY_FRAMING:
+            features['framing'] = [FRAMING_V2]
+            # codecs in order of preference, the codec id travels in every binary frame
+            features['codecs'] = sorted(codec_names(), key=lambda name: name != CONFIG.TCP_CODEC)
+            features['compression'] = ['zlib']
+        if CONFIG.TCP_BATCHING:
+            features['batch'] = True
+        if CONFIG.TCP_CANCEL_REQUESTS:
+            features['cancel'] = True
+        return features
 
     def is_connected(self):
         return self._connected
@@ -37,11 +85,43 @@ class JSONProtocol(asyncio.Protocol):
         self._transport = transport
 
         self._transport.send = self._transport.write
-        self._send_q = SendQueue(transport, self.is_connected)
+        self._transport.set_write_buffer_limits(high=CONFIG.TCP_SEND_BUFFER_HIGH_WATER,
+                                                low=CONFIG.TCP_SEND_BUFFER_LOW_WATER)
+        self._send_q = SendQueue(transport, self.is_connected, high_water=CONFIG.TCP_SEND_BUFFER_HIGH_WATER)
 
         self.set_streamer()
+        self._send_hello()
         self._send_q.send()
 
+    def _send_hello(self):
+        features = self.local_features()
+        if features:
+            self.send(ControlPacket.hello(features))
+
+    def _handle_hello(self, packet):
+        self._peer_features = packet.get('features') or {}
+        local_features = self.local_features()
+        self._binary_framing = (FRAMING_V2 in local_features.get('framing', []) and
+                                FRAMING_V2 in self._peer_features.get('framing', []))
+        self._codec = JSONCodec
+        self._compression_threshold = 0
+        if self._binary_framing:
+            peer_codecs = self._peer_features.get('codecs', [])
+            for name in local_features['codecs']:
+                if name in peer_codecs:
+                    self._codec = get_codec(name)
+                    break
+            if 'zlib' in self._peer_features.get('compression', []):
+                self._compression_threshold = CONFIG.TCP_COMPRESSION_THRESHOLD
+        if local_features.get('batch') and self._peer_features.get('batch'):
+            if self._batcher is None:
+                self._batcher = Batcher(self.send, window=CONFIG.TCP_BATCH_WINDOW, max_size=CONFIG.TCP_BATCH_MAX_SIZE)
+        elif self._batcher is not None:
+            self._batcher.flush()
+            self._batcher = None
+        self.logger.debug('Negotiated binary framing %s, codec %s with %s', self._binary_framing, self._codec.name,
+                          self._transport.get_extra_info('peername'))
+
     def set_streamer(self):
         self._obj_streamer = ObjectStreamer()
         self._obj_streamer.auto_listen(self, prefix='on_')
@@ -49,42 +129,140 @@ class JSONProtocol(asyncio.Protocol):
 
     def connection_lost(self, exc):
         self._connected = False
+        self._send_q.close(ClientDisconnected())
         self.logger.info('Peer closed %s', self._transport.get_extra_info('peername'))
 
+    def pause_writing(self):
+        self._send_q.pause()
+
+    def resume_writing(self):
+        self._send_q.resume()
+
+    @property
+    def send_queue_depth(self):
+        return self._send_q.depth if self._send_q else 0
+
+    def is_writable(self):
+        return not self._send_q.is_full()
+
+    @asyncio.coroutine
+    def drain(self):
+        """
+        Wait till the peer has read enough for the send buffer to drop below its high water mark
+        """
+        yield from self._send_q.drain()
+
+    @property
+    def deferred_sends(self):
+        return self._deferred_sends
+
+    def send_when_writable(self, packet: dict):
+        """
+        Send a packet once the send buffer drains, without making the caller wait for it
+        """
+        self._deferred_sends += 1
+        asyncio.async(self._send_when_writable(packet))
+
+    @asyncio.coroutine
+    def _send_when_writable(self, packet):
+        try:
+            yield from self._send_q.drain()
+            self.send(packet)
+        except ClientDisconnected:
+            # the requests in flight on the connection are failed when it is lost
+            pass
+        finally:
+            self._deferred_sends -= 1
+
+    def throttle_reading(self):
+        """
+        Stop reading from a peer that is not reading what we send it, until the send buffer drains
+        """
+        if not self._reading_paused:
+            self._reading_paused = True
+            self._transport.pause_reading()
+            asyncio.async(self._resume_reading_when_writable())
+
+    @asyncio.coroutine
+    def _resume_reading_when_writable(self):
+        try:
+            yield from self._send_q.drain()
+        except ClientDisconnected:
+            return
+        self._reading_paused = False
+        self._transport.resume_reading()
+
     def send(self, packet: dict):
         frame = self._make_frame(packet)
         self._send_q.send(frame)
-        self.logger.debug('Data sent: %s', frame.decode())
+        self.logger.debug('Data sent: %s', packet)
+
+    def send_batched(self, packet: dict):
+        """
+        Send a packet as part of a batch when the peer takes batches, on its own otherwise
+        """
+        if self._batcher is not None:
+            self._batcher.add(packet)
+        else:
+            self.send(packet)
 
     def close(self):
+        if self._batcher is not None:
+            self._batcher.flush()
+        self._send_q.flush()
         self._transport.write(']'.encode())  # end the json array
         self._transport.close()
 
     def data_received(self, byte_data):
-        string_data = byte_data.decode()
-        self.logger.debug('Data received: %s', string_data)
+        self.logger.debug('Data received: %s', byte_data)
         try:
-            pass
-            try:
-                string_data = self._partial_data + string_data
-                partial_data = ''
-                for e in string_data.split('!<^>!'):
-                    if e:
-                        try:
-                            element = json.loads(partial_data + e)
-                            partial_data = ''
-                            self.on_element(element)
-                        except Exception as exc:
-                            partial_data += e
-                            self.logger.debug('Packet splitting: %s', self._partial_data)
-                self._partial_data = partial_data
-            except Exception as e:
-                self.logger.error('Could not parse data: %s', string_data)
-            # self._obj_streamer.consume(string_data)
+            for flags, frame in self._frame_buffer.feed(byte_data):
+                if flags is LEGACY_FRAME:
+                    self._on_legacy_frame(frame)
+                else:
+                    self._on_binary_frame(flags, frame)
         except:
             # recover from invalid data
             self.logger.exception('Invalid data received')
-            self.set_streamer()
+            self._frame_buffer.clear()
+            self._partial_frame = b''
+
+    def _on_legacy_frame(self, frame):
+        if not frame:
+            return
+        if self._partial_frame:
+            # the delimiter was part of the payload, stitch the pieces back together
+            frame = self._partial_frame + DELIMITER + frame
+        try:
+            element = json.loads(frame.decode())
+        except ValueError:
+            self._partial_frame = frame
+            self.logger.debug('Packet splitting: %s', frame)
+            return
+        self._partial_frame = b''
+        self._on_packet(element)
+
+    def _on_binary_frame(self, flags, frame):
+        try:
+            if flags & FLAG_COMPRESSED:
+                start = time.time()
+                frame = zlib.decompress(frame)
+                Stats.compression_stats['decompress_time'] += time.time() - start
+                Stats.compression_stats['decompressed_frames'] += 1
+            element = get_codec_by_id(flags & CODEC_MASK).decode(frame)
+        except KeyError:
+            self.logger.error('Unknown codec in frame flags %s', flags)
+            return
+        except (ValueError, zlib.error):
+            self.logger.error('Could not parse data: %s', frame)
+            return
+        self._on_packet(element)
+
+    def _on_packet(self, element):
+        if isinstance(element, dict) and element.get('type') == 'hello':
+            self._handle_hello(element)
+        else:
+            self.on_element(element)
 
     def on_object_stream_start(self):
         raise RuntimeError('Incorrect JSON Streaming Format: expect a JSON Array to start at root, got object')
@@ -110,6 +288,8 @@ class VykedProtocol(JSONProtocol):
     def __init__(self, handler):
         super().__init__()
         self._handler = handler
+        self._in_flight = {}
+        self._connection_lost_callbacks = []
 
     def connection_made(self, transport):
         peer_name = transport.get_extra_info('peername')
@@ -118,6 +298,45 @@ class VykedProtocol(JSONProtocol):
 
     def connection_lost(self, exc):
         super(VykedProtocol, self).connection_lost(exc)
+        for callback in self._connection_lost_callbacks:
+            callback(self, exc)
+
+    def add_connection_lost_callback(self, callback):
+        """
+        :param callback: called with the protocol and the exception (or None) once the connection is lost
+        """
+        self._connection_lost_callbacks.append(callback)
+
+    def remove_connection_lost_callback(self, callback):
+        if callback in self._connection_lost_callbacks:
+            self._connection_lost_callbacks.remove(callback)
+
+    def track_request(self, request_id, future):
+        """
+        Count a request sent on this connection as in flight till its future is done
+        """
+        self._in_flight[request_id] = future
+        future.add_done_callback(partial(self._request_done, request_id))
+
+    def _request_done(self, request_id, future):
+        if self._in_flight.pop(request_id, None) is None:
+            return
+        if future.cancelled() or isinstance(future.exception(), TimeoutError):
+            # nobody is waiting for the response anymore, let the server stop working on it
+            if self._connected and self._peer_features.get('cancel') and CONFIG.TCP_CANCEL_REQUESTS:
+                self.send(MessagePacket.cancel(request_id))
+
+    @property
+    def in_flight(self):
+        return len(self._in_flight)
+
+    def pop_in_flight(self):
+        """
+        :return: futures of the requests still in flight on this connection, which stops tracking them
+        """
+        futures = [future for future in self._in_flight.values() if not future.done()]
+        self._in_flight.clear()
+        return futures
 
     def on_element(self, element):
         try:
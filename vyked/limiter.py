@@ -0,0 +1,146 @@
+import asyncio
+import time
+from collections import deque
+
+from .config import CONFIG
+from .exceptions import ServiceOverloaded
+
+OVERLOADED = 'overloaded'
+
+# weight of every response time in the slowly moving latency baseline
+BASELINE_WEIGHT = 0.01
+
+
+class ConcurrencyLimiter:
+    """
+    Limit on the requests a server works on at once, adapted with AIMD on observed latency.
+    While responses are not much slower than the latency baseline and the limit is being used, it grows by one per
+    limit's worth of responses. A response slower than CONCURRENCY_LATENCY_TOLERANCE times the baseline, or a timeout,
+    cuts it by CONCURRENCY_LIMIT_BACKOFF, at most once per baseline latency so one burst of slow responses counts once.
+    Requests over the limit are rejected right away instead of queueing behind work that will time out anyway
+    """
+
+    def __init__(self, initial=None, min_limit=None, max_limit=None):
+        self.min_limit = min_limit or CONFIG.CONCURRENCY_LIMIT_MIN
+        self.max_limit = max_limit or CONFIG.CONCURRENCY_LIMIT_MAX
+        self.limit = float(initial or CONFIG.CONCURRENCY_LIMIT_INITIAL)
+        self.in_flight = 0
+        self.rejected = 0
+        self._baseline = None
+        self._next_decrease = 0
+
+    def try_acquire(self):
+        if self.in_flight >= int(self.limit):
+            self.rejected += 1
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self, time_taken=None, dropped=False):
+        """
+        :param time_taken: response time in ms, None when the request ended without a meaningful one (cancelled)
+        :param dropped: the request timed out
+        """
+        in_flight = self.in_flight
+        self.in_flight -= 1
+        if time_taken is None and not dropped:
+            return
+        if time_taken is not None:
+            if self._baseline is None:
+                self._baseline = float(time_taken)
+            else:
+                self._baseline += BASELINE_WEIGHT * (time_taken - self._baseline)
+        baseline = self._baseline or 0
+        if dropped or time_taken > max(baseline * CONFIG.CONCURRENCY_LATENCY_TOLERANCE, 1):
+            now = time.monotonic()
+            if now >= self._next_decrease:
+                self.limit = max(self.min_limit, self.limit * CONFIG.CONCURRENCY_LIMIT_BACKOFF)
+                self._next_decrease = now + baseline / 1000
+        elif in_flight >= self.limit / 2:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def gauges(self):
+        return {'limit': int(self.limit), 'in_flight': self.in_flight, 'rejected': self.rejected}
+
+
+class Bulkhead:
+    """
+    Isolates one endpoint from the others: at most max_concurrency calls run at once and up to queue_size more wait
+    for a free slot in order, calls beyond that are rejected with ServiceOverloaded
+    """
+
+    def __init__(self, max_concurrency, queue_size=0):
+        self.max_concurrency = max_concurrency
+        self.queue_size = queue_size
+        self.running = 0
+        self._waiters = deque()
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    @asyncio.coroutine
+    def acquire(self):
+        """
+        Wait for a slot
+        :return: seconds spent waiting in the queue
+        """
+        if self.running < self.max_concurrency and not self._waiters:
+            self.running += 1
+            return 0
+        if len(self._waiters) >= self.queue_size:
+            raise ServiceOverloaded()
+        start = time.time()
+        waiter = asyncio.Future()
+        self._waiters.append(waiter)
+        try:
+            yield from waiter
+        except asyncio.CancelledError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif waiter.done() and not waiter.cancelled():
+                # the slot was handed over just before the cancellation
+                self.release()
+            raise
+        return time.time() - start
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # hand the slot straight to the next caller in the queue
+                waiter.set_result(None)
+                return
+        self.running -= 1
+
+
+server_limiter = ConcurrencyLimiter()
+
+
+def try_acquire():
+    """
+    :return: whether a server request may start, always True unless CONCURRENCY_LIMIT is enabled
+    """
+    return not CONFIG.CONCURRENCY_LIMIT or server_limiter.try_acquire()
+
+
+def release(time_taken=None, dropped=False):
+    if CONFIG.CONCURRENCY_LIMIT:
+        server_limiter.release(time_taken, dropped)
+
+
+def release_when_done(task, bulkhead=None):
+    """
+    Release the limit, and the bulkhead slot when given, taken for a server request once its handler task is done
+    rather than when the request stops waiting for it, a handler that timed out (task.timed_out set) keeps running
+    and counting against both
+    """
+    start = time.time()
+
+    def done(_):
+        time_taken = None if task.cancelled() else int((time.time() - start) * 1000)
+        release(time_taken, dropped=getattr(task, 'timed_out', False))
+        if bulkhead is not None:
+            bulkhead.release()
+
+    task.add_done_callback(done)
@@ -1,6 +1,6 @@
 import asyncio
 from .shared_context import SharedContext
-from .utils.common_utils import X_REQUEST_ID, get_uuid
+from .utils.common_utils import X_REQUEST_ID, X_DEADLINE, get_uuid, parse_deadline
 
 @asyncio.coroutine
 def request_id_middleware_factory(app, handler):
@@ -9,6 +9,9 @@ def request_id_middleware_factory(app, handler):
     def middleware(request):
         tracking_id = request.headers.get(X_REQUEST_ID, get_uuid())
         SharedContext.set(X_REQUEST_ID, tracking_id)
+        deadline = parse_deadline(request.headers.get(X_DEADLINE))
+        if deadline is not None:
+            SharedContext.set(X_DEADLINE, deadline)
         response = yield from handler(request)
         return response
 
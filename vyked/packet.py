@@ -1,22 +1,39 @@
 from collections import defaultdict
+from itertools import count
 from uuid import uuid4
 from .utils.common_utils import X_REQUEST_ID
 from .shared_context import SharedContext
 
 
 class _Packet:
-    _pid = 0
+    # ids are a random per process prefix followed by a counter, unique without a uuid4() per packet
+    _pid_prefix = uuid4().hex[:12] + '-'
+    _pid_counter = count(1)
 
     @classmethod
     def _next_pid(cls):
-        from uuid import uuid4
+        return _Packet._pid_prefix + str(next(_Packet._pid_counter))
 
-        return str(uuid4())
+    @classmethod
+    def next_request_id(cls):
+        return cls._next_pid()
+
+    @classmethod
+    def reset_ids(cls):
+        """
+        Pick a new prefix, a forked process must not hand out the same ids as its parent
+        """
+        _Packet._pid_prefix = uuid4().hex[:12] + '-'
+        _Packet._pid_counter = count(1)
 
     @classmethod
     def ack(cls, request_id):
         return {'pid': cls._next_pid(), 'type': 'ack', 'request_id': request_id}
 
+    @classmethod
+    def hello(cls, features):
+        return {'pid': cls._next_pid(), 'type': 'hello', 'features': features}
+
     @classmethod
     def pong(cls, node_id, payload=None):
         return cls._get_ping_pong(node_id, 'pong', payload=payload)
@@ -58,7 +75,7 @@ class ControlPacket(_Packet):
                   'service': service,
                   'version': version,
                   'params': params,
-                  'request_id': str(uuid4())}
+                  'request_id': cls.next_request_id()}
 
         return packet
 
@@ -73,7 +90,7 @@ class ControlPacket(_Packet):
         packet = {'pid': cls._next_pid(),
                   'type': 'get_subscribers',
                   'params': params,
-                  'request_id': str(uuid4())}
+                  'request_id': cls.next_request_id()}
         return packet
 
     @classmethod
@@ -155,16 +172,19 @@ class ControlPacket(_Packet):
 class MessagePacket(_Packet):
 
     @classmethod
-    def request(cls, name, version, app_name, packet_type, endpoint, params, entity):
+    def request(cls, name, version, app_name, packet_type, endpoint, params, entity, deadline=None):
         params[X_REQUEST_ID] = SharedContext.get(X_REQUEST_ID)
-        return {'pid': cls._next_pid(),
-                'app': app_name,
-                'service': name,
-                'version': version,
-                'entity': entity,
-                'endpoint': endpoint,
-                'type': packet_type,
-                'payload': params}
+        packet = {'pid': cls._next_pid(),
+                  'app': app_name,
+                  'service': name,
+                  'version': version,
+                  'entity': entity,
+                  'endpoint': endpoint,
+                  'type': packet_type,
+                  'payload': params}
+        if deadline is not None:
+            packet['deadline'] = deadline
+        return packet
 
     @classmethod
     def publish(cls, publish_id, service, version, endpoint, payload):
@@ -175,3 +195,27 @@ class MessagePacket(_Packet):
                 'endpoint': endpoint,
                 'payload': payload,
                 'publish_id': publish_id}
+
+    @classmethod
+    def response_chunk(cls, request_id, seq, chunk):
+        return {'pid': cls._next_pid(), 'type': 'response_chunk', 'request_id': request_id, 'seq': seq, 'chunk': chunk}
+
+    @classmethod
+    def cancel(cls, request_id):
+        return {'pid': cls._next_pid(), 'type': 'cancel', 'request_id': request_id}
+
+    @classmethod
+    def stream_ack(cls, request_id, credit):
+        return {'pid': cls._next_pid(), 'type': 'stream_ack', 'request_id': request_id, 'credit': credit}
+
+    @classmethod
+    def batch(cls, packets):
+        """
+        Several request or response packets sent to one node as one packet
+        """
+        packet = {'pid': cls._next_pid(), 'type': 'batch', 'packets': packets}
+        first = packets[0]
+        if 'service' in first:
+            packet['service'] = first['service']
+            packet['version'] = first['version']
+        return packet
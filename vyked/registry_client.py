@@ -1,6 +1,5 @@
 import asyncio
 import logging
-import random
 from collections import defaultdict
 from functools import partial
 
@@ -9,6 +8,7 @@ from retrial.retrial import retry
 from .packet import ControlPacket
 from .protocol_factory import get_vyked_protocol
 from .pinger import TCPPinger
+from .routing import RoutingTable, NodeStats, NodeHealth
 
 
 def _retry_for_result(result):
@@ -37,7 +37,7 @@ class RegistryClient:
         self._conn_handler = None
         self._pending_requests = {}
         self._available_services = defaultdict(list)
-        self._assigned_services = defaultdict(lambda: defaultdict(list))
+        self._routes = RoutingTable()
         self._ssl_context = ssl_context
         self.logger = logging.getLogger(__name__)
         self._xsubscribe_packet = None
@@ -132,30 +132,15 @@ class RegistryClient:
                     return host, port, node, service_type
         return None
 
-    def get_random_service(self, service_name, service_type):
-        services = self._available_services[service_name]
-        services = [service for service in services if service[3] == service_type]
-        if len(services):
-            return random.choice(services)
-        else:
-            return None
+    def choose_service(self, service_name, service_type, exclude=None):
+        return self._routes.choose(service_name, service_type, exclude=exclude)
 
-    def resolve(self, service: str, version: str, entity: str, service_type: str):
+    def resolve(self, service: str, version: str, entity: str, service_type: str, exclude=None):
         service_name = self._get_full_service_name(service, version)
         if entity is not None:
-            entity_map = self._assigned_services.get(service_name)
-            if entity_map is None:
-                self._assigned_services[service_name] = {}
-            entity_map = self._assigned_services.get(service_name)
-            if entity in entity_map:
-                return entity_map[entity]
-            else:
-                host, port, node_id, service_type = self.get_random_service(service_name, service_type)
-                if node_id is not None:
-                    entity_map[entity] = host, port, node_id, service_type
-                return host, port, node_id, service_type
+            return self._routes.choose_for_entity(service_name, service_type, entity, exclude=exclude)
         else:
-            return self.get_random_service(service_name, service_type)
+            return self.choose_service(service_name, service_type, exclude=exclude)
 
     @staticmethod
     def _get_full_service_name(service, version):
@@ -167,15 +152,16 @@ class RegistryClient:
             for address in vendor.get('addresses', []):
                 vendor_entry = (address['host'], address['port'], address['node_id'], address['type'])
                 if vendor_entry not in self._available_services[vendor_name]:
-                    self._available_services[vendor_name].append(
-                        (address['host'], address['port'], address['node_id'], address['type']))
+                    self._available_services[vendor_name].append(vendor_entry)
+                    self._routes.add(vendor_name, vendor_entry)
         self.logger.debug('Connection cache after registration is %s', self._available_services)
 
     def cache_instance(self, service, version, host, port, node, type):
         vendor = self._get_full_service_name(service, version)
         vendor_entry = (host, port, node, type)
         if vendor_entry not in self._available_services[vendor]:
-            self._available_services[vendor].append((host, port, node, type))
+            self._available_services[vendor].append(vendor_entry)
+            self._routes.add(vendor, vendor_entry)
         self.logger.debug('Connection cache on getting new instance is %s', self._available_services)
 
     def _handle_deregistration(self, packet):
@@ -183,14 +169,9 @@ class RegistryClient:
         vendor = self._get_full_service_name(params['service'], params['version'])
         node = params['node_id']
         self._available_services[vendor] = [x for x in self._available_services[vendor] if x[2] != node]
-        entity_map = self._assigned_services.get(vendor)
-        if entity_map is not None:
-            stale_entities = []
-            for entity, node_id in entity_map.items():
-                if node == node_id:
-                    stale_entities.append(entity)
-            for entity in stale_entities:
-                entity_map.pop(entity)
+        self._routes.remove(vendor, node)
+        NodeStats.forget(node)
+        NodeHealth.forget(node)
         self.logger.debug('Connection cache after deregister is %s', self._available_services)
 
     def _handle_subscriber_packet(self, packet):
@@ -0,0 +1,305 @@
+import logging
+import random
+import time
+import zlib
+from collections import defaultdict, deque
+
+from .config import CONFIG
+
+# weight of the latest response time in a node's moving average
+EWMA_WEIGHT = 0.2
+
+_MASK_64 = 0xffffffffffffffff
+
+
+def _mix(h):
+    """
+    64 bit finalizer from murmur3, spreads the bits of a hash over the whole word
+    """
+    h ^= h >> 33
+    h = (h * 0xff51afd7ed558ccd) & _MASK_64
+    h ^= h >> 33
+    h = (h * 0xc4ceb9fe1a85ec53) & _MASK_64
+    h ^= h >> 33
+    return h
+
+
+def _hash(key):
+    return _mix(zlib.crc32(str(key).encode()))
+
+
+class NodeStats:
+    """
+    Requests in flight and a moving average of response times (ms) for every node requests are sent to
+    """
+    _in_flight = defaultdict(int)
+    _latency = {}
+
+    @classmethod
+    def request_sent(cls, node_id):
+        cls._in_flight[node_id] += 1
+
+    @classmethod
+    def request_done(cls, node_id):
+        count = cls._in_flight.get(node_id, 0) - 1
+        if count > 0:
+            cls._in_flight[node_id] = count
+        else:
+            cls._in_flight.pop(node_id, None)
+
+    @classmethod
+    def track(cls, future, node_id):
+        """
+        Count a request as in flight to node_id, the node it was just sent to, till its future is done. A request
+        sent again to another node stops counting against the first one. The response time and outcome of the
+        request are charged to future.node_id, timed from future.send_time
+        """
+        if hasattr(future, 'node_id'):
+            if future.node_id is not None:
+                cls.request_done(future.node_id)
+        else:
+            future.add_done_callback(cls._tracked_request_done)
+        future.node_id = node_id
+        future.send_time = time.time()
+        if node_id is not None:
+            cls.request_sent(node_id)
+
+    @classmethod
+    def _tracked_request_done(cls, future):
+        if future.node_id is not None:
+            cls.request_done(future.node_id)
+
+    @classmethod
+    def update_latency(cls, node_id, time_taken):
+        average = cls._latency.get(node_id)
+        if average is None:
+            cls._latency[node_id] = float(time_taken)
+        else:
+            cls._latency[node_id] = average + EWMA_WEIGHT * (time_taken - average)
+
+    @classmethod
+    def in_flight(cls, node_id):
+        return cls._in_flight.get(node_id, 0)
+
+    @classmethod
+    def latency(cls, node_id):
+        return cls._latency.get(node_id)
+
+    @classmethod
+    def forget(cls, node_id):
+        cls._in_flight.pop(node_id, None)
+        cls._latency.pop(node_id, None)
+
+    @classmethod
+    def less_loaded(cls, first, second):
+        """
+        :return: the node a new request is expected to finish on sooner, in flight requests times average latency.
+        A node without a latency yet is assumed to be as fast as the other so it gets probed
+        """
+        first_latency = cls._latency.get(first)
+        second_latency = cls._latency.get(second)
+        if first_latency is None:
+            first_latency = second_latency or 1.0
+        if second_latency is None:
+            second_latency = first_latency
+        first_load = (cls._in_flight.get(first, 0) + 1) * first_latency
+        second_load = (cls._in_flight.get(second, 0) + 1) * second_latency
+        return first if first_load <= second_load else second
+
+
+class CircuitBreaker:
+    """
+    Health of one node from the outcomes of the requests sent to it.
+    Closed while the share of failed or slow responses among the last CIRCUIT_BREAKER_WINDOW stays below
+    CIRCUIT_BREAKER_ERROR_RATE. Once it is reached the breaker opens and the node is ejected for a backoff that
+    doubles every time the node trips again, after which one probe request is let through (half open): its outcome
+    closes the breaker or opens it again, outcomes of requests sent before the probe are ignored
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self):
+        self.state = self.CLOSED
+        self._outcomes = deque(maxlen=CONFIG.CIRCUIT_BREAKER_WINDOW)
+        self._failures = 0
+        self._trips = 0
+        self._retry_at = 0
+        # when the probe was routed, wall clock time to compare with the send time of a request
+        self._probe_sent = 0
+
+    def record(self, failed, sent_at=None):
+        """
+        :param sent_at: time the request was sent, None when it isn't known
+        """
+        if self.state == self.HALF_OPEN:
+            if sent_at is not None and sent_at < self._probe_sent:
+                # a late outcome of a request sent before the probe
+                return
+            if failed:
+                self._open()
+            else:
+                self._close()
+            return
+        if self.state == self.OPEN:
+            # a response to a request sent before the breaker opened
+            return
+        if len(self._outcomes) == self._outcomes.maxlen:
+            self._failures -= self._outcomes[0]
+        self._outcomes.append(failed)
+        self._failures += failed
+        if (len(self._outcomes) == self._outcomes.maxlen and
+                self._failures >= CONFIG.CIRCUIT_BREAKER_ERROR_RATE * len(self._outcomes)):
+            self._open()
+
+    def is_available(self):
+        """
+        Closed, or due for a probe request
+        """
+        return self.state == self.CLOSED or time.monotonic() >= self._retry_at
+
+    def routed(self):
+        if self.state != self.CLOSED:
+            # the probe is in flight, another one may go out if it never gets an outcome
+            self.state = self.HALF_OPEN
+            self._retry_at = time.monotonic() + CONFIG.CIRCUIT_BREAKER_MAX_BACKOFF
+            self._probe_sent = time.time()
+
+    def _open(self):
+        backoff = min(CONFIG.CIRCUIT_BREAKER_BACKOFF * 2 ** self._trips, CONFIG.CIRCUIT_BREAKER_MAX_BACKOFF)
+        self.state = self.OPEN
+        self._trips += 1
+        self._retry_at = time.monotonic() + backoff
+
+    def _close(self):
+        self.state = self.CLOSED
+        self._trips = 0
+        self._outcomes.clear()
+        self._failures = 0
+
+
+class NodeHealth:
+    """
+    Circuit breakers of the nodes requests are sent to. The routing table skips nodes whose breaker isn't closed,
+    unless that would leave no instance of a service
+    """
+    _breakers = {}
+    _unhealthy = set()
+    _logger = logging.getLogger(__name__)
+
+    @classmethod
+    def record(cls, node_id, failed=False, time_taken=0, sent_at=None):
+        breaker = cls._breakers.get(node_id)
+        if breaker is None:
+            breaker = cls._breakers[node_id] = CircuitBreaker()
+        state = breaker.state
+        breaker.record(bool(failed or time_taken > CONFIG.CIRCUIT_BREAKER_SLOW_MS), sent_at)
+        if breaker.state != state:
+            cls._logger.info('Circuit breaker of node %s is %s', node_id, breaker.state)
+        if breaker.state == CircuitBreaker.CLOSED:
+            cls._unhealthy.discard(node_id)
+        else:
+            cls._unhealthy.add(node_id)
+
+    @classmethod
+    def any_unhealthy(cls):
+        return bool(cls._unhealthy)
+
+    @classmethod
+    def is_available(cls, node_id):
+        return node_id not in cls._unhealthy or cls._breakers[node_id].is_available()
+
+    @classmethod
+    def routed(cls, node_id):
+        if node_id in cls._unhealthy:
+            cls._breakers[node_id].routed()
+
+    @classmethod
+    def forget(cls, node_id):
+        cls._breakers.pop(node_id, None)
+        cls._unhealthy.discard(node_id)
+
+    @classmethod
+    def states(cls):
+        return {node_id: breaker.state for node_id, breaker in cls._breakers.items()}
+
+
+class RoutingTable:
+    """
+    Instances of every service and version by type, updated as instances come and go rather than filtered on every
+    request. Requests are routed with power of two choices, the less loaded of two random instances, requests for an
+    entity with rendezvous hashing so they keep going to the same instance without remembering the assignment
+    """
+
+    def __init__(self):
+        self._routes = defaultdict(list)
+        # (hash of node id, entry) for every route, for rendezvous hashing
+        self._hashed_routes = defaultdict(list)
+
+    def add(self, service_name, entry):
+        key = (service_name, entry[3])
+        routes = self._routes[key]
+        if entry not in routes:
+            routes.append(entry)
+            self._hashed_routes[key].append((_hash(entry[2]), entry))
+
+    def remove(self, service_name, node_id):
+        for key, routes in self._routes.items():
+            if key[0] == service_name:
+                routes[:] = [entry for entry in routes if entry[2] != node_id]
+                hashed_routes = self._hashed_routes[key]
+                hashed_routes[:] = [(node_hash, entry) for node_hash, entry in hashed_routes if entry[2] != node_id]
+
+    def get(self, service_name, service_type):
+        return self._routes.get((service_name, service_type), [])
+
+    def choose(self, service_name, service_type, exclude=None):
+        """
+        :param exclude: id of a node to leave out, None is returned when there is no other
+        """
+        routes = self._routes.get((service_name, service_type))
+        if exclude is not None and routes:
+            routes = [entry for entry in routes if entry[2] != exclude]
+        if not routes:
+            return None
+        unhealthy = NodeHealth.any_unhealthy()
+        if unhealthy:
+            # skip ejected nodes, but fail open when every node is ejected
+            routes = [entry for entry in routes if NodeHealth.is_available(entry[2])] or routes
+        if len(routes) == 1:
+            chosen = routes[0]
+        else:
+            first = random.randrange(len(routes))
+            second = random.randrange(len(routes) - 1)
+            if second >= first:
+                second += 1
+            first, second = routes[first], routes[second]
+            chosen = first if NodeStats.less_loaded(first[2], second[2]) == first[2] else second
+        if unhealthy:
+            NodeHealth.routed(chosen[2])
+        return chosen
+
+    def choose_for_entity(self, service_name, service_type, entity, exclude=None):
+        """
+        The instance with the highest hash of (entity, instance). When an instance comes or goes only the entities it
+        wins move, about 1/N of them
+        """
+        hashed_routes = self._hashed_routes.get((service_name, service_type))
+        if exclude is not None and hashed_routes:
+            hashed_routes = [route for route in hashed_routes if route[1][2] != exclude]
+        if not hashed_routes:
+            return None
+        unhealthy = NodeHealth.any_unhealthy()
+        if unhealthy:
+            hashed_routes = [route for route in hashed_routes if NodeHealth.is_available(route[1][2])] or hashed_routes
+        entity_hash = _hash(entity)
+        best, best_score = None, -1
+        for node_hash, entry in hashed_routes:
+            # both hashes are already mixed, one multiply and shift is enough to combine them per instance
+            score = ((entity_hash ^ node_hash) * 0xff51afd7ed558ccd) & _MASK_64
+            score ^= score >> 29
+            if score > best_score:
+                best, best_score = entry, score
+        if unhealthy:
+            NodeHealth.routed(best[2])
+        return best
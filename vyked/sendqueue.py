@@ -1,19 +1,103 @@
+import asyncio
+
+from .exceptions import ClientDisconnected
+from .utils.stats import Stats
+
+
 class SendQueue:
     """
-    Queues packets to send when transport can send
+    Queues packets to send when transport can send.
+    Packets queued within one iteration of the event loop are written to the transport together from a single
+    call_soon callback instead of one write per packet. While the transport has asked us to pause writing packets
+    are held in the queue, and writers can wait on drain() for the queue to drop below its high water mark
     """
 
-    def __init__(self, transport, can_send_func=lambda: True, pre_process_func=lambda x: x):
+    def __init__(self, transport, can_send_func=lambda: True, pre_process_func=lambda x: x, high_water=None,
+                 loop=None):
         self._q = []
         self._transport = transport
         self._can_send = can_send_func
         self._pre_process = pre_process_func
+        self._high_water = high_water
+        self._loop = loop or asyncio.get_event_loop()
+        self._flush_handle = None
+        self._paused = False
+        self._queued_bytes = 0
+        self._waiters = []
+        self.flushes = 0
+        self.frames_flushed = 0
+        self.bytes_flushed = 0
+
+    @property
+    def depth(self):
+        """
+        Bytes waiting to be sent, both in this queue and in the transport's buffer
+        """
+        return self._queued_bytes + self._transport.get_write_buffer_size()
+
+    def is_full(self):
+        return self._high_water is not None and self.depth > self._high_water
 
     def send(self, packet=None):
         if packet:
             self._q.append(packet)
-        if self._can_send():
-            for each in self._q:
-                each = self._pre_process(each)
-                self._transport.write(each)
-            self._q.clear()
+            self._queued_bytes += len(packet)
+        if self._q and self._flush_handle is None and not self._paused and self._can_send():
+            self._flush_handle = self._loop.call_soon(self.flush)
+
+    def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._q or self._paused or not self._can_send():
+            return
+        frames = [self._pre_process(each) for each in self._q]
+        self._q.clear()
+        self._queued_bytes = 0
+        self._transport.writelines(frames)
+
+        size = sum(map(len, frames))
+        self.flushes += 1
+        self.frames_flushed += len(frames)
+        self.bytes_flushed += size
+        Stats.send_stats['flushes'] += 1
+        Stats.send_stats['frames_flushed'] += len(frames)
+        Stats.send_stats['bytes_flushed'] += size
+        self._wakeup_waiters()
+
+    def pause(self):
+        self._paused = True
+
+    def resume(self):
+        self._paused = False
+        self.send()
+        self._wakeup_waiters()
+
+    @asyncio.coroutine
+    def drain(self):
+        """
+        Wait till the queue is at or below its high water mark
+        """
+        while self.is_full():
+            if not self._can_send():
+                raise ClientDisconnected()
+            waiter = asyncio.Future(loop=self._loop)
+            self._waiters.append(waiter)
+            yield from waiter
+
+    def close(self, exc=None):
+        """
+        Fail everyone waiting on drain(), the queued packets will never be sent
+        """
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_exception(exc or ClientDisconnected())
+
+    def _wakeup_waiters(self):
+        if self._paused or self.is_full():
+            return
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
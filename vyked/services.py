@@ -1,4 +1,4 @@
-from asyncio import Future, get_event_loop
+from asyncio import Future, shield
 import json
 import logging
 import time
@@ -8,11 +8,20 @@ from again.utils import unique_hex
 
 from aiohttp.web import Response, Request
 
+from .config import CONFIG
 from .packet import MessagePacket
-from .exceptions import RequestException, ClientException
+from .exceptions import RequestException, ClientException, ServiceOverloaded
+from .limiter import OVERLOADED
+from .routing import NodeStats, NodeHealth
+from .streams import ResponseStream
 from .utils.ordered_class_member import OrderedClassMembers
-from .utils.stats import Aggregator
+from .utils.stats import Aggregator, Stats
+from .utils.cache import canonical_key
 from .utils.client_stats import ClientStats
+from .utils.common_utils import request_deadline
+from .utils.timing_wheel import TimingWheel
+
+_HOST_IP = socket.gethostbyname(socket.gethostname())
 
 
 class _Service:
@@ -46,6 +55,9 @@ class TCPServiceClient(_Service):
     def __init__(self, service_name, service_version, ssl_context=None):
         super(TCPServiceClient, self).__init__(service_name, service_version)
         self._pending_requests = {}
+        self._pending_streams = {}
+        self._flights = {}
+        self._timeouts = TimingWheel()
         self.tcp_bus = None
         self._ssl_context = ssl_context
 
@@ -53,16 +65,26 @@ class TCPServiceClient(_Service):
     def ssl_context(self):
         return self._ssl_context
 
-    def _send_request(self, app_name, endpoint, entity, params):
+    def _send_request(self, app_name, endpoint, entity, params, timeout=None, idempotent=False, coalesce=False):
+        flight_key = None
+        if coalesce:
+            # identical requests still waiting for their response share it instead of being sent again
+            flight_params = {k: v for k, v in params.items() if k != 'request_id'}
+            flight_key = canonical_key(app_name, endpoint, entity, flight_params)
+            flight = self._flights.get(flight_key)
+            if flight is not None:
+                Stats.coalesce_stats['requests_collapsed'] += 1
+                return shield(flight)
+        deadline = request_deadline(timeout or TCPServiceClient.REQUEST_TIMEOUT_SECS)
         packet = MessagePacket.request(self.name, self.version, app_name, _Service._REQ_PKT_STR, endpoint, params,
-                                       entity)
+                                       entity, deadline=deadline)
         future = Future()
         request_id = params['request_id']
         try:
-            self.tcp_bus.send(packet)
-        except ClientException:
+            self.tcp_bus.send(packet, future)
+        except ClientException as e:
             if not future.done() and not future.cancelled():
-                error = 'Client not found'
+                error = str(e) or 'Client not found'
                 exception = ClientException(error)
                 exception.error = error
                 future.set_exception(exception)
@@ -72,15 +94,43 @@ class TCPServiceClient(_Service):
             raise e
         else:
             future.request_id = request_id
-            future.send_time = time.time()
+            NodeStats.track(future, packet.get('to'))
+            # an idempotent request is sent again to another instance if its connection is lost
+            future.retry_packet = packet if idempotent else None
             self._pending_requests[request_id] = future
-
-        self.time_future(future, TCPServiceClient.REQUEST_TIMEOUT_SECS)
+            future.add_done_callback(lambda f: self._pending_requests.pop(f.request_id, None))
+
+        self.time_future(future, max(deadline - time.time(), 0))
+        if flight_key is not None and not future.done():
+            self._flights[flight_key] = future
+            future.add_done_callback(lambda f: self._end_flight(flight_key, f))
+            # a caller giving up on a shared request mustn't cancel it for the others
+            return shield(future)
         return future
 
+    def _end_flight(self, flight_key, future):
+        if self._flights.get(flight_key) is future:
+            del self._flights[flight_key]
+
+    def _send_stream_request(self, app_name, endpoint, entity, params, timeout=None):
+        request_id = params['request_id']
+        params['_stream_window'] = CONFIG.TCP_STREAM_WINDOW
+        future = self._send_request(app_name, endpoint, entity, params, timeout=timeout)
+        stream = ResponseStream(request_id, future, CONFIG.TCP_STREAM_WINDOW)
+        self._pending_streams[request_id] = stream
+        future.add_done_callback(lambda _: self._pending_streams.pop(request_id, None))
+        return stream
+
     def receive(self, packet: dict, protocol, transport):
         if packet['type'] == 'ping':
             pass
+        elif packet['type'] == 'response_chunk':
+            stream = self._pending_streams.get(packet['request_id'])
+            if stream is not None:
+                stream.feed(packet['chunk'], protocol)
+        elif packet['type'] == 'batch':
+            for response in packet['packets']:
+                self._process_response(response)
         else:
             self._process_response(packet)
 
@@ -105,8 +155,12 @@ class TCPServiceClient(_Service):
                 future.set_result(payload['result'])
         elif has_error:
             if payload.get('failed', False):
+                if payload['error'] == OVERLOADED:
+                    exception = ServiceOverloaded(OVERLOADED)
+                else:
+                    exception = Exception(payload['error'])
                 if not future.done() and not future.cancelled():
-                    future.set_exception(Exception(payload['error']))
+                    future.set_exception(exception)
             else:
                 exception = RequestException()
                 exception.error = payload['error']
@@ -114,8 +168,14 @@ class TCPServiceClient(_Service):
                     future.set_exception(exception)
         else:
             print('Invalid response to request:', packet)
-        ClientStats.update(packet['from'], packet['host'], packet['endpoint'],
-            time_taken=int((time.time() - future.send_time)*1000))
+        time_taken = int((time.time() - future.send_time)*1000)
+        ClientStats.update(packet['from'], packet['host'], packet['endpoint'], time_taken=time_taken)
+        if future.node_id is not None:
+            if not has_error or payload['error'] != OVERLOADED:
+                # a rejection is fast, it mustn't make the node look like a good choice
+                NodeStats.update_latency(future.node_id, time_taken)
+            NodeHealth.record(future.node_id, failed=has_error and payload.get('failed', False), time_taken=time_taken,
+                              sent_at=future.send_time)
 
     def _process_publication(self, packet):
         endpoint = packet['endpoint']
@@ -123,15 +183,20 @@ class TCPServiceClient(_Service):
         func(**packet['payload'])
 
     def time_future(self, future: Future, timeout: int):
-        def timer_callback(self, f):
-            if not f.done() and not f.cancelled():
-                f.set_exception(TimeoutError())
+        def timer_callback():
+            if not future.done() and not future.cancelled():
+                future.set_exception(TimeoutError())
+                if getattr(future, 'node_id', None) is not None:
+                    NodeHealth.record(future.node_id, failed=True, sent_at=future.send_time)
                 try:
-                    self._pending_requests.pop(f.request_id)
+                    self._pending_requests.pop(future.request_id)
                 except Exception as e:
                     logging.getLogger().info(e)
 
-        get_event_loop().call_later(timeout, timer_callback, self, future)
+        if not future.done():
+            # one timer wheel per client instead of a loop timer per request, dropped as soon as the request is done
+            self._timeouts.schedule(future, timeout, timer_callback)
+            future.add_done_callback(self._timeouts.cancel)
 
     def _enqueue(self, endpoint, payload):
         self._pubsub_bus.enqueue(endpoint, payload)
@@ -145,10 +210,20 @@ class _ServiceHost(_Service):
     def __init__(self, service_name, service_version, host_ip, host_port):
         super(_ServiceHost, self).__init__(service_name, service_version)
         self._node_id = unique_hex()
+        # node ids of the other workers listening on the same socket address
+        self._sibling_node_ids = set()
         self._ip = host_ip
         self._port = host_port
         self._clients = []
 
+    def set_worker(self, index, workers):
+        """
+        Give each worker of a multi-process Host a node id of its own, the same one for the worker that replaces it
+        """
+        node_ids = ['{}-{}'.format(self._node_id, i) for i in range(workers)]
+        self._node_id = node_ids[index]
+        self._sibling_node_ids = set(node_ids)
+
     def is_for_me(self, service, version):
         return service == self.name and version == self.version
 
@@ -229,8 +304,7 @@ class TCPService(_ServiceHost):
 
     @staticmethod
     def _make_response_packet(request_id: str, from_id: str, entity: str, result: object, error: object,
-                              failed: bool, old_api=None, replacement_api=None, 
-                              host=socket.gethostbyname(socket.gethostname()), service_name='',
+                              failed: bool, old_api=None, replacement_api=None, host=_HOST_IP, service_name='',
                               method=''):
         if error:
             payload = {'request_id': request_id, 'error': error, 'failed': failed}
@@ -240,7 +314,7 @@ class TCPService(_ServiceHost):
             payload['old_api'] = old_api
             if replacement_api:
                 payload['replacement_api'] = replacement_api
-        packet = {'pid': unique_hex(),
+        packet = {'pid': MessagePacket._next_pid(),
                   'from': service_name,
                   'endpoint': method,
                   'to': from_id,
@@ -285,14 +359,15 @@ class HTTPService(_ServiceHost, metaclass=OrderedClassMembers):
 
     def pong(self, request: Request):
         node_id = request.match_info.get('node')
-        if node_id == self._node_id:
+        # a ping for a worker can reach any of the workers sharing its socket
+        if node_id == self._node_id or node_id in self._sibling_node_ids:
             return Response()
         else:
             return Response(status=500)
 
     @staticmethod
     def stats(_):
-        res_d = Aggregator.dump_stats()
+        res_d = Aggregator.dump_all_stats()
         return Response(status=200, content_type='application/json', body=json.dumps(res_d).encode())
 
     @staticmethod
@@ -0,0 +1,96 @@
+import asyncio
+import hashlib
+import json
+import logging
+
+import asyncio_redis as redis
+
+from .utils.jsonencoder import VykedEncoder
+
+
+class SharedCache:
+    """
+    Second tier of the @api result cache, kept in redis so that results are shared by all the instances of a service
+    and outlive restarts.
+    Entries of an endpoint live under its own namespace and expire with their ttl, values serialized to more than
+    max_value_size bytes are not stored
+    """
+    PREFIX = 'vyked:cache'
+    stats = {'hits': 0, 'misses': 0, 'stores': 0, 'too_large': 0, 'errors': 0, 'invalidations': 0}
+
+    def __init__(self, redis_host, redis_port, pool_size=4, max_value_size=512 * 1024):
+        self._redis_host = redis_host
+        self._redis_port = redis_port
+        self._pool_size = pool_size
+        self._max_value_size = max_value_size
+        self._pool = None
+        self._logger = logging.getLogger(__name__)
+
+    @asyncio.coroutine
+    def connect(self):
+        self._pool = yield from redis.Pool.create(self._redis_host, self._redis_port, poolsize=self._pool_size,
+                                                  auto_reconnect=True)
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+
+    def _key(self, namespace, key):
+        return '{}:{}:{}'.format(self.PREFIX, namespace, hashlib.sha1(key.encode()).hexdigest())
+
+    @asyncio.coroutine
+    def get(self, namespace, key):
+        """
+        :return: (True, result) on a hit, (False, None) on a miss or when redis can't be reached
+        """
+        if self._pool is None:
+            return False, None
+        try:
+            value = yield from self._pool.get(self._key(namespace, key))
+        except redis.Error as e:
+            self.stats['errors'] += 1
+            self._logger.error('Cache get failed with error %s', repr(e))
+            return False, None
+        if value is None:
+            self.stats['misses'] += 1
+            return False, None
+        self.stats['hits'] += 1
+        return True, json.loads(value)
+
+    @asyncio.coroutine
+    def set(self, namespace, key, result, ttl):
+        if self._pool is None:
+            return False
+        value = json.dumps(result, cls=VykedEncoder)
+        if len(value) > self._max_value_size:
+            self.stats['too_large'] += 1
+            return False
+        try:
+            yield from self._pool.set(self._key(namespace, key), value, pexpire=max(1, int(ttl * 1000)))
+        except redis.Error as e:
+            self.stats['errors'] += 1
+            self._logger.error('Cache set failed with error %s', repr(e))
+            return False
+        self.stats['stores'] += 1
+        return True
+
+    @asyncio.coroutine
+    def invalidate(self, namespace):
+        """
+        Remove every entry of the namespace. Every instance of a service that gets the invalidation event does it,
+        deleting is idempotent and none of them can tell a repeat of an event from a new one
+        """
+        if self._pool is None:
+            return 0
+        try:
+            cursor = yield from self._pool.scan(match='{}:{}:*'.format(self.PREFIX, namespace))
+            keys = yield from cursor.fetchall()
+            if keys:
+                yield from self._pool.delete(keys)
+        except redis.Error as e:
+            self.stats['errors'] += 1
+            self._logger.error('Cache invalidation failed with error %s', repr(e))
+            return 0
+        self.stats['invalidations'] += 1
+        return len(keys)
@@ -0,0 +1,112 @@
+import asyncio
+from collections import deque
+
+from .exceptions import ClientDisconnected
+from .packet import MessagePacket
+
+
+class StreamWriter:
+    """
+    Sends the chunks of a streamed @api response as response_chunk packets.
+    The client grants credit for a number of chunks at a time, write() waits once the credit is used up so a slow
+    reader bounds how much of the response is buffered on either side
+    """
+
+    def __init__(self, protocol, request_id, window):
+        self.request_id = request_id
+        self.chunks_sent = 0
+        self._protocol = protocol
+        self._credit = window
+        self._waiter = None
+        self._exception = None
+
+    def grant(self, credit):
+        self._credit += credit
+        self._wake()
+
+    def connection_lost(self, _, exc):
+        self._exception = exc or ClientDisconnected()
+        self._wake()
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+        self._waiter = None
+
+    @asyncio.coroutine
+    def write(self, chunk):
+        while self._credit <= 0 and self._exception is None:
+            self._waiter = asyncio.Future()
+            yield from self._waiter
+        if self._exception is not None:
+            raise self._exception
+        if not self._protocol.is_writable():
+            yield from self._protocol.drain()
+        self._credit -= 1
+        self._protocol.send(MessagePacket.response_chunk(self.request_id, self.chunks_sent, chunk))
+        self.chunks_sent += 1
+
+
+class ResponseStream:
+    """
+    Client side of a streamed response, chunks can be processed as they arrive using read()
+        chunk = yield from stream.read()
+    which returns None once the stream has ended and raises the request's error if it failed.
+    On python 3.5+ the stream can also be consumed with `async for`
+    """
+
+    def __init__(self, request_id, future, window):
+        self.request_id = request_id
+        self._future = future
+        self._window = window
+        self._chunks = deque()
+        self._waiter = None
+        self._protocol = None
+        self._consumed = 0
+        future.add_done_callback(lambda _: self._wake())
+
+    @property
+    def future(self):
+        """
+        Resolved by the final response of the stream
+        """
+        return self._future
+
+    def feed(self, chunk, protocol):
+        self._protocol = protocol
+        self._chunks.append(chunk)
+        self._wake()
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+        self._waiter = None
+
+    @asyncio.coroutine
+    def read(self):
+        while not self._chunks:
+            if self._future.done():
+                self._future.result()
+                return None
+            self._waiter = asyncio.Future()
+            yield from self._waiter
+        chunk = self._chunks.popleft()
+        self._acknowledge()
+        return chunk
+
+    def _acknowledge(self):
+        # hand credit back in steps of half the window rather than one packet per chunk
+        self._consumed += 1
+        if self._consumed >= max(1, self._window // 2) and self._protocol is not None and not self._future.done():
+            self._protocol.send(MessagePacket.stream_ack(self.request_id, self._consumed))
+            self._consumed = 0
+
+    def __aiter__(self):
+        return self
+
+    @asyncio.coroutine
+    def __anext__(self):
+        chunk = yield from self.read()
+        if chunk is None:
+            raise StopAsyncIteration
+        return chunk
@@ -0,0 +1,117 @@
+import json
+import time
+from collections import OrderedDict
+
+from .jsonencoder import VykedEncoder
+
+DEFAULT_TTL = 60
+DEFAULT_MAX_SIZE = 1024
+
+
+class ResultCache:
+    """
+    Bounded LRU of endpoint results, entries expire ttl seconds after they were stored.
+    With shared set, results are also kept in the redis SharedCache under namespace, which defaults to the
+    service/version/endpoint of the api.
+    The counters are kept for the life of the process and are reported with the aggregated stats
+    """
+
+    def __init__(self, name, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE, invalidated_by=(), shared=False,
+                 namespace=None):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max(1, max_size)
+        self.invalidated_by = list(invalidated_by)
+        self.shared = shared
+        self.namespace = namespace
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def namespace_for(self, service):
+        if self.namespace is None:
+            self.namespace = '/'.join((service.name, str(service.version), self.name))
+        return self.namespace
+
+    @staticmethod
+    def make_key(entity, params):
+        """
+        :return: params in a canonical form, or None when they can't be serialized and so can't be cached
+        """
+        return canonical_key(entity, params)
+
+    def get(self, key):
+        """
+        :return: (True, result) on a hit, (False, None) otherwise
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return False, None
+        expires_at, result = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return False, None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True, result
+
+    def put(self, key, result):
+        self._entries[key] = (time.monotonic() + self.ttl, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        if self._entries:
+            self.invalidations += 1
+            self._entries.clear()
+
+    def to_dict(self):
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'expirations': self.expirations, 'invalidations': self.invalidations}
+
+
+def canonical_key(*parts):
+    """
+    :return: the parts as JSON with sorted keys, equal for equal parts, or None when they can't be serialized
+    """
+    try:
+        return json.dumps(parts, sort_keys=True, separators=(',', ':'), cls=VykedEncoder)
+    except (TypeError, ValueError):
+        return None
+
+
+# by the qualified name of the api, endpoints of different services may share a name
+_caches = {}
+
+
+def create_cache(name, spec, qualname=None):
+    """
+    :param spec: True for the defaults, the ttl in seconds or a dict with any of ttl, max_size, invalidated_by (a list
+                 of events that clear the cache when published), shared and namespace
+    :param qualname: the cache is registered under it for cache_stats(), defaults to name
+    """
+    if isinstance(spec, dict):
+        cache = ResultCache(name, ttl=spec.get('ttl', DEFAULT_TTL), max_size=spec.get('max_size', DEFAULT_MAX_SIZE),
+                            invalidated_by=spec.get('invalidated_by', ()), shared=spec.get('shared', False),
+                            namespace=spec.get('namespace'))
+    elif spec is True:
+        cache = ResultCache(name)
+    else:
+        cache = ResultCache(name, ttl=spec)
+    _caches[qualname or name] = cache
+    return cache
+
+
+def cache_stats():
+    return {name: cache.to_dict() for name, cache in _caches.items()}
@@ -1,7 +1,11 @@
 import json
+import time
 import uuid
 
+from ..shared_context import SharedContext
+
 X_REQUEST_ID = 'X-REQUEST-ID'
+X_DEADLINE = 'X-DEADLINE'
 
 def json_file_to_dict(_file: str) -> dict:
     """
@@ -27,3 +31,22 @@ def valid_timeout(timeout):
 
 def get_uuid():
     return str(uuid.uuid4())
+
+
+def parse_deadline(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def request_deadline(timeout):
+    """
+    Absolute deadline (epoch seconds) for a call made now that waits `timeout` seconds, never later than the deadline
+    of the request being handled
+    """
+    deadline = time.time() + timeout
+    inherited = SharedContext.get(X_DEADLINE)
+    if inherited is not None and inherited < deadline:
+        return inherited
+    return deadline
@@ -0,0 +1,101 @@
+from array import array
+
+# values below 2 * SUB_BUCKETS get a bucket each, above that every power of two is split in SUB_BUCKETS buckets,
+# so a value is known to within 1 / SUB_BUCKETS of itself
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+# values past 2 ** (MAX_SHIFT + SUB_BUCKET_BITS + 1) ms, over 9 hours, all land in the last bucket
+MAX_SHIFT = 20
+BUCKETS = (MAX_SHIFT + 2) * SUB_BUCKETS
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def bucket_index(value):
+    value = int(value)
+    if value < 2 * SUB_BUCKETS:
+        return value if value > 0 else 0
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    if shift > MAX_SHIFT:
+        return BUCKETS - 1
+    return shift * SUB_BUCKETS + (value >> shift)
+
+
+def bucket_value(index):
+    """
+    :return: the middle of the range of values counted in the bucket
+    """
+    if index < 2 * SUB_BUCKETS:
+        return index
+    shift = index // SUB_BUCKETS - 1
+    return ((index - shift * SUB_BUCKETS) << shift) + ((1 << shift) - 1) // 2
+
+
+class Histogram:
+    """
+    Log-linear histogram of non negative values (ms), fixed size whatever the number of values recorded
+    """
+    __slots__ = ('counts', 'count', 'max')
+
+    def __init__(self):
+        self.counts = array('I', bytes(4 * BUCKETS))
+        self.count = 0
+        self.max = 0
+
+    def record(self, value):
+        self.counts[bucket_index(value)] += 1
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        if not other.count:
+            return
+        counts = self.counts
+        for index, count in enumerate(other.counts):
+            if count:
+                counts[index] += count
+        self.count += other.count
+        if other.max > self.max:
+            self.max = other.max
+
+    def clear(self):
+        if self.count:
+            self.counts = array('I', bytes(4 * BUCKETS))
+            self.count = 0
+            self.max = 0
+
+    def percentiles(self, percentiles=PERCENTILES):
+        """
+        :return: {'p50': .., 'p99.9': ..} for the percentiles asked for, in one pass over the buckets
+        """
+        d = {}
+        wanted = sorted(percentiles)
+        if not self.count:
+            return {'p{}'.format(p): 0 for p in wanted}
+        seen = 0
+        position = 0
+        for index, count in enumerate(self.counts):
+            if not count:
+                continue
+            seen += count
+            while position < len(wanted) and seen >= wanted[position] / 100 * self.count:
+                d['p{}'.format(wanted[position])] = min(bucket_value(index), self.max)
+                position += 1
+            if position == len(wanted):
+                break
+        return d
+
+    def to_dict(self):
+        """
+        :return: the non empty buckets, in a form that can be sent as JSON and merged with from_dict
+        """
+        return {'counts': {str(index): count for index, count in enumerate(self.counts) if count}, 'max': self.max}
+
+    @classmethod
+    def from_dict(cls, d):
+        histogram = cls()
+        for index, count in d.get('counts', {}).items():
+            histogram.counts[int(index)] += count
+            histogram.count += count
+        histogram.max = d.get('max', 0)
+        return histogram
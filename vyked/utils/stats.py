@@ -4,6 +4,16 @@ import setproctitle
 from collections import defaultdict
 import socket
 import resource
+import json
+import os
+import time
+
+from ..config import CONFIG
+from ..limiter import server_limiter
+from .. import executors
+from .cache import cache_stats
+from .histogram import Histogram
+from ..shared_cache import SharedCache
 
 
 class Stats:
@@ -12,8 +22,14 @@ class Stats:
     hostname = socket.gethostbyname(socket.gethostname())
     service_name = '_'.join(setproctitle.getproctitle().split('_')[1:-1])
     # hostd = {'hostname': '', 'service_name': ''}
-    http_stats = {'total_requests': 0, 'total_responses': 0, 'timedout': 0, 'total_errors': 0}
-    tcp_stats = {'total_requests': 0, 'total_responses': 0, 'timedout': 0, 'total_errors': 0}
+    http_stats = {'total_requests': 0, 'total_responses': 0, 'timedout': 0, 'total_errors': 0, 'deadline_exceeded': 0,
+                  'overloaded': 0}
+    tcp_stats = {'total_requests': 0, 'total_responses': 0, 'timedout': 0, 'total_errors': 0, 'deadline_exceeded': 0,
+                 'cancelled': 0, 'overloaded': 0}
+    send_stats = {'flushes': 0, 'frames_flushed': 0, 'bytes_flushed': 0, 'batches': 0, 'batched_packets': 0}
+    coalesce_stats = {'requests_collapsed': 0, 'calls_collapsed': 0}
+    compression_stats = {'compressed_frames': 0, 'uncompressed_bytes': 0, 'compressed_bytes': 0,
+                         'compress_time': 0.0, 'decompressed_frames': 0, 'decompress_time': 0.0}
 
     @classmethod
     def periodic_stats_logger(cls):
@@ -32,84 +48,266 @@ class Stats:
             logd['tcp_' + key] = value
             cls.tcp_stats[key] = 0
 
+        if CONFIG.CONCURRENCY_LIMIT:
+            for key, value in server_limiter.gauges().items():
+                logd['concurrency_' + key] = value
+            server_limiter.rejected = 0
+
+        for kind, executor_gauges in executors.gauges().items():
+            for key, value in executor_gauges.items():
+                logd['executor_{}_{}'.format(kind, key)] = value
+
+        flushes = cls.send_stats['flushes']
+        logd['frames_per_flush'] = cls.send_stats['frames_flushed'] / flushes if flushes else 0
+        logd['bytes_per_flush'] = cls.send_stats['bytes_flushed'] / flushes if flushes else 0
+        batches = cls.send_stats['batches']
+        logd['packets_per_batch'] = cls.send_stats['batched_packets'] / batches if batches else 0
+        for key, value in cls.send_stats.items():
+            logd['send_' + key] = value
+            cls.send_stats[key] = 0
+
+        for key, value in cls.coalesce_stats.items():
+            logd[key] = value
+            cls.coalesce_stats[key] = 0
+
+        compressed = cls.compression_stats['uncompressed_bytes']
+        logd['compression_ratio'] = cls.compression_stats['compressed_bytes'] / compressed if compressed else 0
+        for key, value in cls.compression_stats.items():
+            if key.endswith('_time'):
+                logd[key + '_ms'] = int(value * 1000)
+            else:
+                logd[key] = value
+            cls.compression_stats[key] = 0
+
         _logger = logging.getLogger('stats')
         _logger.info(dict(logd))
 
         asyncio.get_event_loop().call_later(120, cls.periodic_stats_logger)
 
 
+class _Window:
+    """
+    Totals of the requests in one slot of a StatUnit's window, averages are of the successful requests
+    """
+    __slots__ = ('count', 'success_count', 'time_taken', 'process_time', 'queue_time', 'histogram')
+
+    def __init__(self):
+        self.count = 0
+        self.success_count = 0
+        self.time_taken = 0
+        self.process_time = 0
+        self.queue_time = 0
+        self.histogram = Histogram()
+
+    def clear(self):
+        self.count = self.success_count = self.time_taken = self.process_time = self.queue_time = 0
+        self.histogram.clear()
+
+    def merge(self, other):
+        self.count += other.count
+        self.success_count += other.success_count
+        self.time_taken += other.time_taken
+        self.process_time += other.process_time
+        self.queue_time += other.queue_time
+        self.histogram.merge(other.histogram)
+
+    def to_dict(self, raw=False):
+        """
+        :param raw: send the histogram itself instead of its percentiles, for the stats to be merged with others
+        """
+        success_count = self.success_count
+        d = {'count': self.count, 'success_count': success_count,
+             'average': int(self.time_taken / success_count) if success_count else 0,
+             'process_time_average': self.process_time / success_count if success_count else 0,
+             'queue_time_average': self.queue_time / success_count if success_count else 0}
+        if raw:
+            d['histogram'] = self.histogram.to_dict()
+        else:
+            d.update(self.histogram.percentiles())
+            d['max'] = self.histogram.max
+        return d
+
+
 class StatUnit:
-    MAXSIZE = 10
+    """
+    Requests to one (server_type, endpoint, status) over the last WINDOW seconds. The window is split in SLOTS
+    slots, the oldest one is cleared and reused as the window slides on
+    """
+    WINDOW = 300
+    SLOTS = 5
 
     def __init__(self, key=None):
         self.key = key
-        self.average = 0
-        self.process_time_average = 0
-        self.values = list()
-        self.count = 0
-        self.success_count = 0
-        self.sub = dict()
+        self._slot_length = self.WINDOW / self.SLOTS
+        self._slots = [_Window() for _ in range(self.SLOTS)]
+        self._tick = None
+        self._current = self._slots[0]
 
-    def update(self, val, process_time_taken, success):
-        self.values.append(val)
-        if len(self.values) > self.MAXSIZE:
-            self.values.pop(0)
+    def _slide(self, now):
+        tick = int(now / self._slot_length)
+        if tick == self._tick:
+            return
+        if self._tick is None or tick - self._tick >= self.SLOTS:
+            for slot in self._slots:
+                slot.clear()
+        else:
+            for passed in range(self._tick + 1, tick + 1):
+                self._slots[passed % self.SLOTS].clear()
+        self._tick = tick
+        self._current = self._slots[tick % self.SLOTS]
 
-        self.count += 1
+    def update(self, val, process_time_taken, success, queue_time=0):
+        self._slide(time.monotonic())
+        slot = self._current
+        slot.count += 1
+        slot.histogram.record(val)
         if success:
-            self.average = (self.average * self.success_count + val)/(self.success_count+1)
-            self.process_time_average = (self.process_time_average * self.success_count + process_time_taken)/(self.success_count+1)
-            self.success_count += 1
+            slot.success_count += 1
+            slot.time_taken += val
+            slot.process_time += process_time_taken
+            slot.queue_time += queue_time
 
-    def to_dict(self):
+    def window(self):
+        """
+        :return: the totals over the whole window
+        """
+        self._slide(time.monotonic())
+        window = _Window()
+        for slot in self._slots:
+            window.merge(slot)
+        return window
 
-        d = dict({'count': self.count, 'average': int(self.average), 'success_count': self.success_count, 'sub': dict(),
-            'process_time_average': self.process_time_average})
-        for k, v in self.sub.items():
-            d['sub'][k] = v.to_dict()
+    def __str__(self):
+        window = self.window()
+        return "{} {} {}".format(self.key, window.count, window.to_dict()['average'])
+
+
+class _Node:
+    def __init__(self):
+        self.window = _Window()
+        self.sub = {}
+
+    def to_dict(self, raw=False):
+        d = self.window.to_dict(raw)
+        d['sub'] = {key: node.to_dict(raw) for key, node in self.sub.items()}
         return d
 
-    def __str__(self):
-        return "{} {} {} {}".format(self.key, self.sum, self.average, self.count)
+
+def _merge_units(units):
+    """
+    Merge raw stats dicts of several processes, averages are weighted by the successful calls they were taken over
+    """
+    success_count = sum(unit['success_count'] for unit in units)
+    d = {'count': sum(unit['count'] for unit in units), 'success_count': success_count, 'sub': {}}
+    for key in ('average', 'process_time_average', 'queue_time_average'):
+        total = sum(unit.get(key, 0) * unit['success_count'] for unit in units)
+        d[key] = total / success_count if success_count else 0
+    d['average'] = int(d['average'])
+    histogram = Histogram()
+    for unit in units:
+        histogram.merge(Histogram.from_dict(unit.get('histogram', {})))
+    d.update(histogram.percentiles())
+    d['max'] = histogram.max
+    for key in {key for unit in units for key in unit['sub']}:
+        d['sub'][key] = _merge_units([unit['sub'][key] for unit in units if key in unit['sub']])
+    return d
+
+
+def _sum_counters(dicts):
+    d = {}
+    for each in dicts:
+        for key, value in each.items():
+            if isinstance(value, dict):
+                d[key] = _sum_counters([d.get(key, {}), value])
+            else:
+                d[key] = d.get(key, 0) + value
+    return d
 
 
 class Aggregator:
-    _stats = StatUnit(key='total')
+    # (server_type, endpoint, status) -> StatUnit, totals per endpoint and server type are added up when dumped
+    _units = {}
+    # set in the workers of a multi-process Host, each of them keeps its stats in a file of this directory
+    stats_dir = None
+    worker_id = None
 
     @classmethod
-    def recursive_update(cls, d, new_val, keys, success, process_time_taken=0):
-        if len(keys) == 0:
-            return
+    def update_stats(cls, endpoint, status, time_taken, server_type, success=True, process_time_taken=0, queue_time=0):
+        """
+        :param time_taken: execution time in ms, not counting queue_time (ms) spent waiting for the endpoint's bulkhead
+        """
+        key = (server_type, endpoint, status)
+        unit = cls._units.get(key)
+        if unit is None:
+            unit = cls._units[key] = StatUnit(key=key)
+        unit.update(time_taken, process_time_taken, success, queue_time)
 
-        try:
-            key = keys.pop()
-            value = d[key]
-
-        except KeyError:
-            value = StatUnit(key=key)
-            d[key] = value
+    @classmethod
+    def _tree(cls):
+        root = _Node()
+        for keys, unit in list(cls._units.items()):
+            window = unit.window()
+            node = root
+            node.window.merge(window)
+            for key in keys:
+                node = node.sub.setdefault(key, _Node())
+                node.window.merge(window)
+        return root
 
-        finally:
-            value.update(new_val, process_time_taken, success)
-            cls.recursive_update(value.sub, new_val, keys, success, process_time_taken)
+    @classmethod
+    def dump_stats(cls, raw=False):
+        d = cls._tree().to_dict(raw)
+        d['cache'] = cache_stats()
+        if CONFIG.SHARED_CACHE:
+            d['shared_cache'] = dict(SharedCache.stats)
+        return d
 
     @classmethod
-    def update_stats(cls, endpoint, status, time_taken, server_type, success=True, process_time_taken=0):
+    def _write_worker_stats(cls):
+        path = os.path.join(cls.stats_dir, '{}.json'.format(cls.worker_id))
+        with open(path + '.tmp', 'w') as f:
+            json.dump(cls.dump_stats(raw=True), f)
+        os.replace(path + '.tmp', path)
 
-        cls._stats.update(val=time_taken, process_time_taken=process_time_taken,success=success)
-        cls.recursive_update(cls._stats.sub, time_taken, keys=[status, endpoint, server_type], success=success,
-            process_time_taken=process_time_taken)
+    @classmethod
+    def periodic_worker_stats_writer(cls):
+        try:
+            cls._write_worker_stats()
+        except OSError:
+            logging.getLogger(__name__).exception('Could not write the stats of worker %s', cls.worker_id)
+        asyncio.get_event_loop().call_later(5, cls.periodic_worker_stats_writer)
 
     @classmethod
-    def dump_stats(cls):
-        return cls._stats.to_dict()
+    def dump_all_stats(cls):
+        """
+        :return: the stats of this process, or of all the workers of a multi-process Host, as last written by them
+        """
+        if cls.stats_dir is None:
+            return cls.dump_stats()
+        cls._write_worker_stats()
+        dumps = []
+        for name in os.listdir(cls.stats_dir):
+            if name.endswith('.json'):
+                try:
+                    with open(os.path.join(cls.stats_dir, name)) as f:
+                        dumps.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        d = _merge_units(dumps)
+        for key in ('cache', 'shared_cache'):
+            counters = [dump[key] for dump in dumps if key in dump]
+            if counters:
+                d[key] = _sum_counters(counters)
+        d['workers'] = len(dumps)
+        return d
 
     @classmethod
     def periodic_aggregated_stats_logger(cls):
         hostname = socket.gethostbyname(socket.gethostname())
         service_name = '_'.join(setproctitle.getproctitle().split('_')[1:-1])
 
-        logd = cls._stats.to_dict()
+        logd = cls.dump_stats()
+        caches = logd['cache']
         logs = []
         for server_type in ['http', 'tcp']:
             try:
@@ -124,15 +322,25 @@ class Aggregator:
                     'service_name': service_name,
                     'average_response_time': v['average'],
                     'average_process_time': v['process_time_average'],
+                    'average_queue_time': v['queue_time_average'],
+                    'p50_response_time': v['p50'],
+                    'p90_response_time': v['p90'],
+                    'p99_response_time': v['p99'],
+                    'max_response_time': v['max'],
                     'total_request_count': v['count'],
                     'success_count': v['success_count']
                 })
                 for k2, v2 in v['sub'].items():
                     d['CODE_{}'.format(k2)] = v2['count']
+                # caches are kept by qualified name, the caches of all the apis with this name are added up
+                endpoint_caches = [v2 for k2, v2 in caches.items() if k2.rsplit('.', 1)[-1] == k]
+                if server_type == 'tcp' and endpoint_caches:
+                    for k2, v2 in _sum_counters(endpoint_caches).items():
+                        d['cache_{}'.format(k2)] = v2
                 logs.append(d)
 
         _logger = logging.getLogger('stats')
         for logd in logs:
             _logger.info(dict(logd))
-        cls._stats = StatUnit(key='total')
-        asyncio.get_event_loop().call_later(300, cls.periodic_aggregated_stats_logger)
+        # the windows slide, nothing is reset between two logs
+        asyncio.get_event_loop().call_later(StatUnit.WINDOW, cls.periodic_aggregated_stats_logger)
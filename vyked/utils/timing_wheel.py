@@ -0,0 +1,67 @@
+import asyncio
+import math
+
+
+class TimingWheel:
+    """
+    Hashed timing wheel for timeouts that are usually cancelled before they expire.
+    A timeout is kept in the slot of the tick it expires on, cancelling it is a dict removal and expired timeouts are
+    handled together by a single loop timer that only runs while timeouts are pending. Timeouts expire up to
+    `resolution` seconds late
+    """
+
+    def __init__(self, resolution=0.1, slots=512, loop=None):
+        self._resolution = resolution
+        self._slots = [{} for _ in range(slots)]
+        self._slot_of = {}
+        self._loop = loop
+        self._last_tick = None
+        self._handle = None
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def _tick_for(self, when):
+        return int(math.ceil(when / self._resolution))
+
+    def schedule(self, key, timeout, callback):
+        """
+        Call callback() after timeout seconds unless the key is cancelled first
+        """
+        if self._loop is None:
+            self._loop = asyncio.get_event_loop()
+        self.cancel(key)
+        now = self._loop.time()
+        if self._handle is None:
+            self._last_tick = int(now / self._resolution)
+            self._handle = self._loop.call_later(self._resolution, self._tick)
+        # never into a tick that has already been handled
+        tick = max(self._tick_for(now + timeout), self._last_tick + 1)
+        index = tick % len(self._slots)
+        self._slots[index][key] = (tick, callback)
+        self._slot_of[key] = index
+
+    def cancel(self, key):
+        index = self._slot_of.pop(key, None)
+        if index is not None:
+            self._slots[index].pop(key, None)
+
+    def _tick(self):
+        self._handle = None
+        current = int(self._loop.time() / self._resolution)
+        # after a stall every slot is visited at most once
+        first = max(self._last_tick + 1, current - len(self._slots) + 1)
+        expired = []
+        for tick in range(first, current + 1):
+            slot = self._slots[tick % len(self._slots)]
+            if not slot:
+                continue
+            due = [key for key, (deadline, _) in slot.items() if deadline <= current]
+            for key in due:
+                expired.append(slot.pop(key)[1])
+                del self._slot_of[key]
+        self._last_tick = current
+        if self._slot_of:
+            self._handle = self._loop.call_later(self._resolution, self._tick)
+        for callback in expired:
+            callback()